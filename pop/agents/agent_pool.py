@@ -0,0 +1,248 @@
+import contextlib
+import logging
+import warnings
+from typing import Any, Dict, List, Optional, Tuple
+
+import ray
+import torch as th
+from dgl import DGLHeteroGraph
+from torch import Tensor
+
+from pop.agents.base_gcn_agent import BaseGCNAgent
+from pop.configs.agent_architecture import AgentArchitecture
+from pop.constants import PER_PROCESS_GPU_MEMORY_FRACTION
+from pop.networks.dueling_ensemble import DuelingEnsemble
+
+logging.getLogger("lightning").addHandler(logging.NullHandler())
+logging.getLogger("lightning").propagate = False
+
+warnings.filterwarnings("ignore", category=UserWarning)
+
+
+class PooledGCNAgent(BaseGCNAgent):
+    """
+    In-process substation agent, hosted by an AgentPool
+    """
+
+    def __init__(
+        self,
+        agent_actions: int,
+        node_features: int,
+        architecture: AgentArchitecture,
+        name: str,
+        training: bool,
+        device: str,
+        feature_ranges: Dict[str, Tuple[float, float]],
+        edge_features: Optional[int] = None,
+    ):
+        BaseGCNAgent.__init__(
+            self,
+            agent_actions=agent_actions,
+            node_features=node_features,
+            edge_features=edge_features,
+            architecture=architecture,
+            name=name,
+            training=training,
+            device=device,
+            tensorboard_dir=None,
+            log_dir=None,
+            feature_ranges=feature_ranges,
+        )
+
+    @staticmethod
+    def factory(checkpoint: Dict[str, Any], **kwargs) -> "PooledGCNAgent":
+        agent = PooledGCNAgent(
+            agent_actions=checkpoint["agent_actions"],
+            node_features=checkpoint["node_features"],
+            architecture=(
+                AgentArchitecture(load_from_dict=checkpoint["architecture"])
+                if kwargs.get("architecture") is None
+                else kwargs["architecture"]
+            ),
+            name=checkpoint["name"],
+            training=bool(kwargs.get("training")),
+            device=checkpoint["device"],
+            edge_features=checkpoint["edge_features"],
+            feature_ranges=checkpoint["feature_ranges"],
+        )
+        agent.load_checkpoint(checkpoint, bool(kwargs.get("reset_exploration")))
+        return agent
+
+    def take_ensemble_action(
+        self, transformed_observation: DGLHeteroGraph, q_values: Tensor
+    ) -> Tuple[int, float]:
+        """
+        Same as take_action() given the Q values computed by a DuelingEnsemble
+        """
+
+        # -> (actions)
+        q_values = q_values[: self.actions]
+
+        def greedy_action(
+            transformed_observation: DGLHeteroGraph, mask: Optional[List[int]] = None
+        ) -> int:
+            return int(th.argmax(q_values).item())
+
+        with self.learning_lock:
+            if self.training:
+                action = self.exploration.action_exploration(greedy_action)(
+                    self, transformed_observation
+                )
+            else:
+                action = greedy_action(transformed_observation)
+        self.last_action = action
+
+        return action, q_values[action].item()
+
+    def load_checkpoint(
+        self, checkpoint: Dict[str, Any], reset_exploration: bool = False
+    ) -> None:
+        self.load_state(
+            optimizer_state=checkpoint["optimizer_state"],
+            q_network_state=checkpoint["q_network_state"],
+            target_network_state=checkpoint["target_network_state"],
+            memory=checkpoint["memory"],
+            exploration=checkpoint["exploration"],
+            alive_steps=checkpoint["alive_steps"],
+            train_steps=checkpoint["train_steps"],
+            learning_steps=checkpoint["learning_steps"],
+            reset_exploration=reset_exploration,
+        )
+
+
+@ray.remote(
+    num_cpus=1,
+    num_gpus=0 if not th.cuda.is_available() else PER_PROCESS_GPU_MEMORY_FRACTION,
+)
+class AgentPool:
+    """
+    Hosts several substation agents in one Ray actor.
+    Every method serves a batch of substations so that one remote call reaches all the pooled agents.
+    With ensemble=True actions are computed by one batched forward pass over every pooled Q network.
+    """
+
+    def __init__(
+        self,
+        substation_to_agent_kwargs: Dict[int, Dict[str, Any]],
+        ensemble: bool = False,
+    ):
+        self.agents: Dict[int, PooledGCNAgent] = {
+            substation: PooledGCNAgent(**agent_kwargs)
+            for substation, agent_kwargs in substation_to_agent_kwargs.items()
+        }
+
+        self.ensemble: Optional[DuelingEnsemble] = None
+        self.ensemble_members: Dict[int, int] = {
+            substation: member for member, substation in enumerate(self.agents.keys())
+        }
+        # Stacked weights are rebuilt lazily after the agents learn
+        self.ensemble_outdated: bool = True
+        if ensemble:
+            q_networks = [agent.q_network for agent in self.agents.values()]
+            if DuelingEnsemble.supports(q_networks):
+                self.ensemble = DuelingEnsemble(q_networks)
+                self.ensemble_outdated = False
+            else:
+                print(
+                    "Agent architecture does not support ensemble execution, "
+                    "falling back to one forward pass per agent"
+                )
+
+    def take_actions(
+        self, observations: Dict[int, List[DGLHeteroGraph]]
+    ) -> Dict[int, List[Tuple[int, float]]]:
+        """
+        Action and Q value of each agent for each of its observations,
+        observations of every environment are answered by one call
+        """
+        if self.ensemble is None:
+            return {
+                substation: self.agents[substation].take_actions(
+                    substation_observations
+                )
+                for substation, substation_observations in observations.items()
+            }
+
+        for substation, substation_observations in observations.items():
+            for observation in substation_observations:
+                self.agents[substation]._add_missing_edge(observation)
+                self.agents[substation]._cast_features_to_float32(observation)
+
+        if self.ensemble_outdated:
+            # Weights are stacked while no pooled agent is updating them
+            with contextlib.ExitStack() as learning_locks:
+                for agent in self.agents.values():
+                    learning_locks.enter_context(agent.learning_lock)
+                self.ensemble.refresh()
+            self.ensemble_outdated = False
+
+        graphs: List[Tuple[int, DGLHeteroGraph]] = [
+            (substation, observation)
+            for substation, substation_observations in observations.items()
+            for observation in substation_observations
+        ]
+        # -> (graphs, max_actions)
+        q_values: Tensor = self.ensemble(
+            [observation for _, observation in graphs],
+            [self.ensemble_members[substation] for substation, _ in graphs],
+        )
+        actions: Dict[int, List[Tuple[int, float]]] = {
+            substation: [] for substation in observations.keys()
+        }
+        for (substation, observation), graph_q_values in zip(graphs, q_values):
+            actions[substation].append(
+                self.agents[substation].take_ensemble_action(
+                    observation, graph_q_values
+                )
+            )
+        return actions
+
+    def step(
+        self, transitions: Dict[int, Dict[str, Any]]
+    ) -> Dict[int, Tuple[Optional[float], float]]:
+        # Each transition holds the keyword arguments of BaseGCNAgent.step()
+        step_answers = {
+            substation: self.agents[substation].step(**transition)
+            for substation, transition in transitions.items()
+        }
+        if any(loss is not None for loss, _ in step_answers.values()):
+            self.ensemble_outdated = True
+        return step_answers
+
+    def get_names(self) -> Dict[int, str]:
+        return {
+            substation: agent.get_name() for substation, agent in self.agents.items()
+        }
+
+    def get_exploration_logs(self) -> Dict[int, Dict[str, Any]]:
+        return {
+            substation: agent.get_exploration_logs()
+            for substation, agent in self.agents.items()
+        }
+
+    def get_state(self) -> Dict[int, Dict[str, Any]]:
+        return {
+            substation: agent.get_state() for substation, agent in self.agents.items()
+        }
+
+    def save_shards(self, substation_to_shard_file: Dict[int, str]) -> None:
+        for substation, shard_file in substation_to_shard_file.items():
+            self.agents[substation].save_shard(shard_file)
+
+    def shards_written(self) -> bool:
+        return all(agent.shard_written() for agent in self.agents.values())
+
+    def get_inference_state(self) -> Dict[int, Dict[str, Any]]:
+        return {
+            substation: agent.get_inference_state()
+            for substation, agent in self.agents.items()
+        }
+
+    def load_state(
+        self,
+        substation_to_checkpoint: Dict[int, Dict[str, Any]],
+        reset_exploration: bool = False,
+    ) -> None:
+        for substation, checkpoint in substation_to_checkpoint.items():
+            self.agents[substation].load_checkpoint(checkpoint, reset_exploration)
+        self.ensemble_outdated = True
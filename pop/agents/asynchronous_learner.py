@@ -0,0 +1,72 @@
+import threading
+from typing import Callable, List, Optional
+
+import numpy as np
+
+
+class AsynchronousLearner:
+    """
+    Runs the learn steps of an agent in a background thread, so that stepping never waits for them.
+    Steps schedule learn steps instead of running them.
+    At most max_pending_learn_steps can be waiting at once: scheduling one more blocks until the learner
+    catches up, which bounds how many learn steps the acting weights can lag behind.
+    """
+
+    def __init__(
+        self, learn: Callable[[], Optional[float]], max_pending_learn_steps: int
+    ):
+        self.learn: Callable[[], Optional[float]] = learn
+        self.max_pending_learn_steps: int = max_pending_learn_steps
+        self.pending_learn_steps: int = 0
+        self.losses: List[float] = []
+        self.error: Optional[BaseException] = None
+        self.condition: threading.Condition = threading.Condition()
+        self.thread: threading.Thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def schedule(self):
+        with self.condition:
+            while (
+                self.pending_learn_steps >= self.max_pending_learn_steps
+                and self.error is None
+            ):
+                self.condition.wait()
+            self._raise_error()
+            self.pending_learn_steps += 1
+            self.condition.notify_all()
+
+    def wait(self):
+        # Blocks until every scheduled learn step is done
+        with self.condition:
+            while self.pending_learn_steps > 0 and self.error is None:
+                self.condition.wait()
+            self._raise_error()
+
+    def pop_loss(self) -> Optional[float]:
+        # Mean loss of the learn steps completed since the last call
+        with self.condition:
+            self._raise_error()
+            losses, self.losses = self.losses, []
+        return float(np.mean(losses)) if losses else None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.pending_learn_steps == 0:
+                    self.condition.wait()
+            try:
+                loss = self.learn()
+            except BaseException as error:
+                with self.condition:
+                    self.error = error
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.pending_learn_steps -= 1
+                if loss is not None:
+                    self.losses.append(loss)
+                self.condition.notify_all()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise Exception("Asynchronous learn step failed") from self.error
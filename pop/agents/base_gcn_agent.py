@@ -1,14 +1,17 @@
 import copy
+import threading
 from abc import ABC
 from dataclasses import asdict
+from pathlib import Path
 from random import choice
-from typing import Any, Dict, List, Optional, OrderedDict, Tuple
+from typing import Any, Dict, List, Optional, OrderedDict, Tuple, Union
 
 import dgl
 import networkx as nx
 import psutil
 import torch as th
 import torch.nn as nn
+from pop.agents.asynchronous_learner import AsynchronousLearner
 from pop.agents.exploration.exploration_module import ExplorationModule
 from pop.agents.exploration.exploration_module_factory import get_exploration_module
 from dgl import DGLHeteroGraph
@@ -16,8 +19,10 @@ from grid2op.Observation import BaseObservation
 from torch import Tensor
 
 from pop.agents.loggable_module import LoggableModule
-from pop.agents.replay_buffer import ReplayMemory, Transition
+from pop.agents.replay_buffer import ReplayMemory, TransitionBatch, get_replay_memory
+from pop.agents.replay_memory_file import replay_memory_reference
 from pop.configs.agent_architecture import AgentArchitecture
+from pop.networks.checkpoint_shards import ShardWriter
 from pop.networks.dueling_net import DuelingNet
 from pop.networks.serializable_module import SerializableModule
 
@@ -106,7 +111,9 @@ class BaseGCNAgent(SerializableModule, LoggableModule, ABC):
         )
 
         # Replay Buffer
-        self.memory: ReplayMemory = ReplayMemory(self.architecture.replay_memory)
+        self.memory: ReplayMemory = get_replay_memory(
+            self.architecture.replay_memory, self.device
+        )
 
         # Training or Evaluation
         self.training: bool = training
@@ -114,6 +121,19 @@ class BaseGCNAgent(SerializableModule, LoggableModule, ABC):
 
         self.exploration: ExplorationModule = get_exploration_module(self)
 
+        # Guards the replay memory, the exploration module and the weights
+        # Acting holds it so that forward passes never read a half applied optimizer step,
+        # learn steps only hold it to sample and to update the weights, not for their forward and backward passes
+        self.learning_lock: threading.RLock = threading.RLock()
+        self.learner: Optional[AsynchronousLearner] = (
+            AsynchronousLearner(
+                self._asynchronous_learn, self.architecture.max_pending_learn_steps
+            )
+            if self.architecture.asynchronous_learning and training
+            else None
+        )
+        self.shard_writer: ShardWriter = ShardWriter()
+
     def get_exploration_logs(self) -> Dict[str, Any]:
         return self.exploration.get_state_to_log()
 
@@ -124,13 +144,14 @@ class BaseGCNAgent(SerializableModule, LoggableModule, ABC):
         psutil.Process().cpu_affinity(cpus)
 
     def compute_loss(
-        self, transitions_batch: Transition, sampling_weights: Tensor
+        self, transitions_batch: TransitionBatch, sampling_weights: Tensor
     ) -> Tuple[Tensor, Tensor]:
 
-        observation_batch = self.batch_observations(transitions_batch.observation)
-        next_observation_batch = self.batch_observations(
-            transitions_batch.next_observation
-        )
+        batch_size: int = len(transitions_batch.action)
+
+        # Current and next observations share one batched graph
+        # The first batch_size graphs are the current observations
+        observations_batch = self.batch_observations(transitions_batch.observations)
 
         # Get 1 action per batch and restructure as an index for gather()
         # -> (batch_size)
@@ -145,24 +166,29 @@ class BaseGCNAgent(SerializableModule, LoggableModule, ABC):
         # -> (batch_size)
         rewards = th.Tensor(transitions_batch.reward).unsqueeze(1).to(self.device)
 
-        # Compute Q value for the current observation
-        # -> (batch_size)
-        q_values: Tensor = (
-            self.q_network(observation_batch).gather(1, actions).to(self.device)
-        )
-
-        # Compute TD error
-        # -> (batch_size, action_space_size)
-        target_q_values: Tensor = self.target_network(next_observation_batch).to(
+        # One online forward pass serves both the current Q values and the double DQN argmax
+        # -> (2 * batch_size, action_space_size)
+        online_q_values: Tensor = self.q_network(observations_batch, segments=2).to(
             self.device
         )
 
+        # Compute Q value for the current observation
+        # -> (batch_size)
+        q_values: Tensor = online_q_values[:batch_size].gather(1, actions)
+
         # -> (batch_size)
         best_actions: Tensor = (
-            th.argmax(self.q_network(next_observation_batch), dim=1)
+            th.argmax(online_q_values[batch_size:].detach(), dim=1)
             .unsqueeze(1)
             .type(th.int64)
-        ).to(self.device)
+        )
+
+        # Compute TD error
+        # -> (batch_size, action_space_size)
+        with th.no_grad():
+            target_q_values: Tensor = self.target_network(
+                observations_batch, segments=2
+            )[batch_size:].to(self.device)
 
         # -> (batch_size)
         td_errors: Tensor = rewards + self.architecture.gamma * target_q_values.gather(
@@ -201,18 +227,83 @@ class BaseGCNAgent(SerializableModule, LoggableModule, ABC):
     def take_action(
         self, transformed_observation: DGLHeteroGraph, mask: Optional[List[int]] = None
     ) -> Tuple[int, float]:
-        if self.edge_features is not None and transformed_observation.num_edges() == 0:
-            transformed_observation.add_edges([0], [0])
-            self._add_fake_edge_features(transformed_observation)
+        self._add_missing_edge(transformed_observation)
+
+        with self.learning_lock:
+            if self.training:
+                action = self.exploration.action_exploration(self._take_action)(
+                    self, transformed_observation, mask=mask
+                )
+            else:
+                action = self._take_action(transformed_observation, mask=mask)
+
+            return action, self.q_value(transformed_observation, action)
+
+    def take_actions(
+        self,
+        transformed_observations: List[DGLHeteroGraph],
+        masks: Optional[List[Optional[List[int]]]] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        Same as take_action() for each observation, with one forward pass over the batched observations
+        """
+        actions, q_values, _ = self._take_actions(transformed_observations, masks)
+        return list(zip(actions, q_values))
+
+    def _take_actions(
+        self,
+        transformed_observations: List[DGLHeteroGraph],
+        masks: Optional[List[Optional[List[int]]]] = None,
+    ) -> Tuple[List[int], List[float], Tensor]:
+        masks = [None] * len(transformed_observations) if masks is None else masks
+        for transformed_observation in transformed_observations:
+            self._add_missing_edge(transformed_observation)
+            # dgl.batch() needs one schema: features converted from networkx may be integers
+            self._cast_features_to_float32(transformed_observation)
+
+        with self.learning_lock:
+            with th.no_grad():
+                # -> (observations, actions), (observations, actions), (observations, embedding_size)
+                q_values, advantages, graph_embeddings = self.q_network.evaluate_batch(
+                    dgl.batch(transformed_observations).to(self.device)
+                )
+
+            actions: List[int] = [
+                self._explore(transformed_observation, observation_advantages, mask)
+                for transformed_observation, observation_advantages, mask in zip(
+                    transformed_observations, advantages, masks
+                )
+            ]
+        self.last_action = actions[-1]
+
+        return (
+            actions,
+            [
+                observation_q_values[action].item()
+                for observation_q_values, action in zip(q_values, actions)
+            ],
+            graph_embeddings,
+        )
+
+    def _explore(
+        self,
+        transformed_observation: DGLHeteroGraph,
+        advantages: Tensor,
+        mask: Optional[List[int]] = None,
+    ) -> int:
+        def greedy_action(
+            transformed_observation: DGLHeteroGraph, mask: Optional[List[int]] = None
+        ) -> int:
+            return self._greedy_action(advantages, mask)
 
         if self.training:
-            action = self.exploration.action_exploration(self._take_action)(
+            return self.exploration.action_exploration(greedy_action)(
                 self, transformed_observation, mask=mask
             )
-        else:
-            action = self._take_action(transformed_observation, mask=mask)
+        return greedy_action(transformed_observation, mask=mask)
 
-        return action, self.q_value(transformed_observation, action)
+    def _greedy_action(self, advantages: Tensor, mask: Optional[List[int]]) -> int:
+        return int(th.argmax(advantages).item())
 
     def update_mem(
         self,
@@ -237,11 +328,12 @@ class BaseGCNAgent(SerializableModule, LoggableModule, ABC):
             self.target_network.parameters = self.q_network.parameters
 
         # Sample from Replay Memory and unpack
-
-        memory_indices, transitions, sampling_weights = self.memory.sample(
-            self.architecture.batch_size
-        )
-        transitions = Transition(*zip(*transitions))
+        with self.learning_lock:
+            memory_indices, transitions, sampling_weights = self.memory.sample_batch(
+                self.architecture.batch_size
+            )
+            if self.training:
+                transitions = self._add_intrinsic_rewards(transitions)
 
         loss, td_error = self.compute_loss(
             transitions, th.Tensor(sampling_weights).to(self.device)
@@ -250,15 +342,49 @@ class BaseGCNAgent(SerializableModule, LoggableModule, ABC):
         # Backward propagation
         self.optimizer.zero_grad()
         loss.backward()
-        nn.utils.clip_grad_norm_(self.q_network.parameters(), max_norm=40)
-        self.optimizer.step()
+        with self.learning_lock:
+            nn.utils.clip_grad_norm_(self.q_network.parameters(), max_norm=40)
+            self.optimizer.step()
 
-        # Update priorities for sampling
-        self.memory.update_priorities(
-            memory_indices, td_error.abs().detach().numpy().flatten()
-        )
+            # Update priorities for sampling
+            self.memory.update_priorities(
+                memory_indices, td_error.abs().detach().numpy().flatten()
+            )
         return loss.item()
 
+    def _asynchronous_learn(self) -> Optional[float]:
+        loss = self.learn()
+        if loss is not None:
+            self.learning_steps += 1
+        return loss
+
+    def _add_intrinsic_rewards(
+        self, transitions_batch: TransitionBatch
+    ) -> TransitionBatch:
+        # Exploration modules may compute intrinsic rewards of the sampled transitions at learn time
+        observations = self.batch_observations(transitions_batch.observations)
+        intrinsic_rewards: Optional[
+            Tensor
+        ] = self.exploration.compute_intrinsic_rewards(
+            observations, transitions_batch.action, transitions_batch.done
+        )
+        if intrinsic_rewards is None:
+            return transitions_batch._replace(observations=observations)
+        return transitions_batch._replace(
+            observations=observations,
+            reward=tuple(
+                (
+                    th.Tensor(transitions_batch.reward)
+                    + self.architecture.intrinsic_reward_relevance * intrinsic_rewards
+                ).tolist()
+            ),
+        )
+
+    def _add_missing_edge(self, graph: dgl.DGLGraph):
+        if self.edge_features is not None and graph.num_edges() == 0:
+            graph.add_edges([0], [0])
+            self._add_fake_edge_features(graph)
+
     def _add_fake_edge_features(self, graph: dgl.DGLGraph):
         if self.edge_features_schema is not None:
             for edge_feature in self.edge_features_schema:
@@ -301,11 +427,18 @@ class BaseGCNAgent(SerializableModule, LoggableModule, ABC):
         else:
             self.alive_steps += 1
 
-        self.memory.push(observation, action, next_observation, reward, done)
+        with self.learning_lock:
+            self.memory.push(observation, action, next_observation, reward, done)
 
-        if not stop_decay and self.training:
-            self.exploration.update(action)
-            self.memory.update()
+            if not stop_decay and self.training:
+                self.exploration.update(action)
+                self.memory.update()
+
+        if self.learner is not None:
+            # Learn steps run in the background, losses are reported as they complete
+            if self.train_steps % self.architecture.learning_frequency == 0:
+                self.learner.schedule()
+            return self.learner.pop_loss(), reward
 
         # every so often the agents should learn from experiences
         if self.train_steps % self.architecture.learning_frequency == 0:
@@ -370,25 +503,79 @@ class BaseGCNAgent(SerializableModule, LoggableModule, ABC):
     def get_state(
         self,
     ) -> Dict[str, Any]:
-        return {
-            "optimizer_state": self.optimizer.state_dict(),
-            "q_network_state": self.q_network.state_dict(),
-            "target_network_state": self.target_network.state_dict(),
-            "memory": self.memory.get_state(),
-            "exploration": self.exploration.get_state(),
-            "alive_steps": self.alive_steps,
-            "train_steps": self.train_steps,
-            "learning_steps": self.learning_steps,
-            "agent_actions": self.actions,
-            "node_features": self.node_features_schema,
-            "edge_features": self.edge_features_schema,
-            "single_node_features": self.single_node_features,
-            "architecture": asdict(self.architecture),
-            "name": self.name,
-            "training": self.training,
-            "device": self.device,
-            "feature_ranges": self.feature_ranges,
-        }
+        if self.learner is not None:
+            # Checkpoints hold the state reached after every scheduled learn step
+            self.learner.wait()
+        with self.learning_lock:
+            return {
+                **self._get_state_except_memory(),
+                "memory": self.memory.get_state(),
+            }
+
+    def save_shard(self, shard_file: str) -> None:
+        """
+        Writes get_state() to shard_file in the background, see ShardWriter.
+        Learning only waits for the weights, the optimizer state and the replay memory priorities to be copied,
+        stored transitions are streamed by the writer thread, see ReplayMemorySnapshot.
+        """
+        if self.learner is not None:
+            self.learner.wait()
+        with self.learning_lock:
+            state = copy.deepcopy(self._get_state_except_memory())
+            memory = self.memory.snapshot()
+        # The replay memory is saved next to the shard in its own binary format
+        memory_directory = Path(shard_file).with_name(Path(shard_file).stem + "_memory")
+
+        def get_state() -> Dict[str, Any]:
+            memory.save(str(memory_directory), self.learning_lock)
+            return {
+                **state,
+                "memory": replay_memory_reference(memory_directory.name),
+            }
+
+        self.shard_writer.write_shard(shard_file, get_state)
+
+    def shard_written(self) -> bool:
+        return self.shard_writer.done()
+
+    def _get_state_except_memory(self) -> Dict[str, Any]:
+        with self.learning_lock:
+            return {
+                "optimizer_state": self.optimizer.state_dict(),
+                "q_network_state": self.q_network.state_dict(),
+                "target_network_state": self.target_network.state_dict(),
+                "exploration": self.exploration.get_state(),
+                "alive_steps": self.alive_steps,
+                "train_steps": self.train_steps,
+                "learning_steps": self.learning_steps,
+                "agent_actions": self.actions,
+                "node_features": self.node_features_schema,
+                "edge_features": self.edge_features_schema,
+                "single_node_features": self.single_node_features,
+                "architecture": asdict(self.architecture),
+                "name": self.name,
+                "training": self.training,
+                "device": self.device,
+                "feature_ranges": self.feature_ranges,
+            }
+
+    def get_inference_state(self) -> Dict[str, Any]:
+        """
+        Subset of get_state() needed to act greedily, see FrozenAgent
+        """
+        if self.learner is not None:
+            self.learner.wait()
+        with self.learning_lock:
+            return {
+                "q_network_state": self.q_network.state_dict(),
+                "agent_actions": self.actions,
+                "node_features": self.node_features_schema,
+                "edge_features": self.edge_features_schema,
+                "single_node_features": self.single_node_features,
+                "architecture": asdict(self.architecture),
+                "name": self.name,
+                "feature_ranges": self.feature_ranges,
+            }
 
     def load_state(
         self,
@@ -402,18 +589,26 @@ class BaseGCNAgent(SerializableModule, LoggableModule, ABC):
         learning_steps: int,
         reset_exploration: bool = False,
     ) -> None:
-        self.alive_steps = alive_steps
-        self.train_steps = train_steps
-        self.learning_steps = learning_steps
-        self.optimizer.load_state_dict(optimizer_state)
-        self.q_network.load_state_dict(q_network_state)
-        self.target_network.load_state_dict(target_network_state)
-        self.memory.load_state(memory)
-        if not reset_exploration:
-            self.exploration.load_state(exploration)
+        if self.learner is not None:
+            self.learner.wait()
+        with self.learning_lock:
+            self.alive_steps = alive_steps
+            self.train_steps = train_steps
+            self.learning_steps = learning_steps
+            self.optimizer.load_state_dict(optimizer_state)
+            self.q_network.load_state_dict(q_network_state)
+            self.target_network.load_state_dict(target_network_state)
+            self.memory.load_state(memory)
+            if not reset_exploration:
+                self.exploration.load_state(exploration)
 
     @staticmethod
-    def batch_observations(graphs: List[DGLHeteroGraph]) -> DGLHeteroGraph:
+    def batch_observations(
+        graphs: Union[List[DGLHeteroGraph], DGLHeteroGraph]
+    ) -> DGLHeteroGraph:
+        if isinstance(graphs, DGLHeteroGraph):
+            # Columnar replay memories return an already batched graph
+            return graphs
         return dgl.batch(graphs)
 
     @staticmethod
@@ -0,0 +1,254 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import dgl
+import numpy as np
+import torch as th
+from dgl import DGLHeteroGraph
+
+
+class GraphColumn(object):
+    """
+    Stores one graph per slot in preallocated contiguous arrays.
+    Node and edge features are kept as float32 arrays of shape (capacity, width, *feature_shape),
+    edges as int32 node offsets local to their slot.
+    Slot width grows by doubling whenever a graph larger than every previous one is stored.
+    """
+
+    def __init__(self, capacity: int, device: Optional[th.device] = None) -> None:
+        self.capacity: int = capacity
+        self.device: th.device = th.device("cpu") if device is None else device
+
+        self.max_nodes: int = 0
+        self.max_edges: int = 0
+
+        self.num_nodes: np.ndarray = np.zeros(capacity, dtype=np.int32)
+        self.num_edges: np.ndarray = np.zeros(capacity, dtype=np.int32)
+        self.src: np.ndarray = np.zeros((capacity, 0), dtype=np.int32)
+        self.dst: np.ndarray = np.zeros((capacity, 0), dtype=np.int32)
+
+        self.node_data: Dict[str, np.ndarray] = {}
+        self.edge_data: Dict[str, np.ndarray] = {}
+
+    def __setitem__(self, idx: int, graph: DGLHeteroGraph) -> None:
+        nodes: int = graph.num_nodes()
+        edges: int = graph.num_edges()
+        self._ensure_width(nodes, edges)
+
+        src, dst = graph.edges()
+        self.num_nodes[idx] = nodes
+        self.num_edges[idx] = edges
+        self.src[idx, :edges] = src.cpu().numpy()
+        self.dst[idx, :edges] = dst.cpu().numpy()
+
+        for name, feature in dict(graph.ndata).items():
+            feature = feature.detach().cpu().numpy()
+            self._get_column(self.node_data, name, feature.shape[1:], self.max_nodes)[
+                idx, :nodes
+            ] = feature
+
+        for name, feature in dict(graph.edata).items():
+            feature = feature.detach().cpu().numpy()
+            self._get_column(self.edge_data, name, feature.shape[1:], self.max_edges)[
+                idx, :edges
+            ] = feature
+
+    def __getitem__(self, idx: int) -> DGLHeteroGraph:
+        return self.batch([idx])
+
+    def batch(self, indices: List[int]) -> DGLHeteroGraph:
+        return batch_graph_columns([(self, indices)])
+
+    def _ensure_width(self, nodes: int, edges: int) -> None:
+        if nodes > self.max_nodes:
+            self.max_nodes = max(nodes, 2 * self.max_nodes)
+            self.node_data = {
+                name: self._widen(column, self.max_nodes)
+                for name, column in self.node_data.items()
+            }
+        if edges > self.max_edges:
+            self.max_edges = max(edges, 2 * self.max_edges)
+            self.src = self._widen(self.src, self.max_edges)
+            self.dst = self._widen(self.dst, self.max_edges)
+            self.edge_data = {
+                name: self._widen(column, self.max_edges)
+                for name, column in self.edge_data.items()
+            }
+
+    def _get_column(
+        self,
+        data: Dict[str, np.ndarray],
+        name: str,
+        feature_shape: Tuple[int, ...],
+        width: int,
+    ) -> np.ndarray:
+        if name not in data:
+            data[name] = np.zeros(
+                (self.capacity, width, *feature_shape), dtype=np.float32
+            )
+        return data[name]
+
+    @staticmethod
+    def _widen(column: np.ndarray, width: int) -> np.ndarray:
+        widened = np.zeros(
+            (column.shape[0], width, *column.shape[2:]), dtype=column.dtype
+        )
+        widened[:, : column.shape[1]] = column
+        return widened
+
+    def nbytes(self) -> int:
+        return sum(
+            array.nbytes
+            for array in [
+                self.num_nodes,
+                self.num_edges,
+                self.src,
+                self.dst,
+                *self.node_data.values(),
+                *self.edge_data.values(),
+            ]
+        )
+
+    def get_state(self, length: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Arrays are views of the first length slots, every slot when length is None
+        """
+        return {
+            "max_nodes": self.max_nodes,
+            "max_edges": self.max_edges,
+            "num_nodes": self.num_nodes[:length],
+            "num_edges": self.num_edges[:length],
+            "src": self.src[:length],
+            "dst": self.dst[:length],
+            "node_data": {
+                name: feature[:length] for name, feature in self.node_data.items()
+            },
+            "edge_data": {
+                name: feature[:length] for name, feature in self.edge_data.items()
+            },
+        }
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        """
+        Arrays are used as they are when they hold every slot, memory-mapped arrays included
+        """
+        self.max_nodes = state["max_nodes"]
+        self.max_edges = state["max_edges"]
+        self.num_nodes = fit_capacity(state["num_nodes"], self.capacity)
+        self.num_edges = fit_capacity(state["num_edges"], self.capacity)
+        self.src = fit_capacity(state["src"], self.capacity)
+        self.dst = fit_capacity(state["dst"], self.capacity)
+        self.node_data = {
+            name: fit_capacity(feature, self.capacity)
+            for name, feature in state["node_data"].items()
+        }
+        self.edge_data = {
+            name: fit_capacity(feature, self.capacity)
+            for name, feature in state["edge_data"].items()
+        }
+
+
+def fit_capacity(array: np.ndarray, capacity: int) -> np.ndarray:
+    # Saved states may only hold the slots in use
+    if array.shape[0] == capacity:
+        return array
+    fitted = np.zeros((capacity, *array.shape[1:]), dtype=array.dtype)
+    fitted[: array.shape[0]] = array
+    return fitted
+
+
+def batch_graph_columns(
+    column_slices: List[Tuple[GraphColumn, List[int]]]
+) -> DGLHeteroGraph:
+    """
+    Assemble one batched graph out of slots taken from one or more columns
+    without building any intermediate graph.
+    Graphs appear in the batch in the same order as the given slots.
+    """
+    num_nodes = np.concatenate(
+        [column.num_nodes[np.asarray(indices)] for column, indices in column_slices]
+    ).astype(np.int64)
+    num_edges = np.concatenate(
+        [column.num_edges[np.asarray(indices)] for column, indices in column_slices]
+    ).astype(np.int64)
+
+    # Local node offsets become global by shifting them by the nodes of the previous graphs
+    node_offsets = np.cumsum(num_nodes) - num_nodes
+
+    src: List[np.ndarray] = []
+    dst: List[np.ndarray] = []
+    node_data: Dict[str, List[np.ndarray]] = {}
+    edge_data: Dict[str, List[np.ndarray]] = {}
+    first_graph = 0
+    for column, indices in column_slices:
+        indices = np.asarray(indices, dtype=np.int64)
+        offsets = node_offsets[first_graph : first_graph + len(indices), None]
+        first_graph += len(indices)
+
+        node_mask = np.arange(column.max_nodes) < column.num_nodes[indices][:, None]
+        edge_mask = np.arange(column.max_edges) < column.num_edges[indices][:, None]
+        src.append((column.src[indices] + offsets)[edge_mask])
+        dst.append((column.dst[indices] + offsets)[edge_mask])
+        for name, feature in column.node_data.items():
+            node_data.setdefault(name, []).append(feature[indices][node_mask])
+        for name, feature in column.edge_data.items():
+            edge_data.setdefault(name, []).append(feature[indices][edge_mask])
+
+    graph: DGLHeteroGraph = dgl.graph(
+        (th.from_numpy(np.concatenate(src)), th.from_numpy(np.concatenate(dst))),
+        num_nodes=int(num_nodes.sum()),
+    )
+    for name, features in node_data.items():
+        graph.ndata[name] = th.from_numpy(np.concatenate(features))
+    for name, features in edge_data.items():
+        graph.edata[name] = th.from_numpy(np.concatenate(features))
+
+    graph.set_batch_num_nodes(th.from_numpy(num_nodes))
+    graph.set_batch_num_edges(th.from_numpy(num_edges))
+    return graph.to(column_slices[0][0].device)
+
+
+class ColumnarTransitionStorage(object):
+    """
+    Column-oriented transition storage: observations and next observations are GraphColumns,
+    actions, rewards and done flags are plain arrays.
+    """
+
+    def __init__(self, capacity: int, device: Optional[th.device] = None) -> None:
+        self.observation: GraphColumn = GraphColumn(capacity, device)
+        self.next_observation: GraphColumn = GraphColumn(capacity, device)
+        self.action: np.ndarray = np.zeros(capacity, dtype=np.int64)
+        self.reward: np.ndarray = np.zeros(capacity, dtype=np.float32)
+        self.done: np.ndarray = np.zeros(capacity, dtype=np.bool_)
+
+    def __setitem__(self, idx: int, transition) -> None:
+        self.observation[idx] = transition.observation
+        self.next_observation[idx] = transition.next_observation
+        self.action[idx] = transition.action
+        self.reward[idx] = transition.reward
+        self.done[idx] = transition.done
+
+    def nbytes(self) -> int:
+        return (
+            self.observation.nbytes()
+            + self.next_observation.nbytes()
+            + self.action.nbytes
+            + self.reward.nbytes
+            + self.done.nbytes
+        )
+
+    def get_state(self, length: Optional[int] = None) -> Dict[str, Any]:
+        return {
+            "observation": self.observation.get_state(length),
+            "next_observation": self.next_observation.get_state(length),
+            "action": self.action[:length],
+            "reward": self.reward[:length],
+            "done": self.done[:length],
+        }
+
+    def load_state(self, state: Dict[str, Any]) -> None:
+        self.observation.load_state(state["observation"])
+        self.next_observation.load_state(state["next_observation"])
+        capacity = self.observation.capacity
+        self.action = fit_capacity(state["action"], capacity)
+        self.reward = fit_capacity(state["reward"], capacity)
+        self.done = fit_capacity(state["done"], capacity)
@@ -0,0 +1,311 @@
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+
+class EmbeddingMemory:
+    """
+    Fixed size memory of embeddings with the eviction of deque(maxlen=size):
+    when full, the oldest embedding is replaced.
+    Embeddings are stored in a ring buffer allocated on the first append,
+    together with their squared norms for batched distance computations.
+    Nearest neighbors are searched exactly.
+    """
+
+    def __init__(self, size: int):
+        self.size: int = size
+        self.clear()
+
+    def clear(self):
+        # -> (size, embedding_size)
+        self.embeddings: Optional[np.ndarray] = None
+        # -> (size)
+        self.squared_norms: Optional[np.ndarray] = None
+        self.next_position: int = 0
+        self.length: int = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        # From the oldest embedding to the newest one
+        oldest = (self.next_position - self.length) % self.size
+        for position in range(self.length):
+            yield self.embeddings[(oldest + position) % self.size]
+
+    def append(self, embedding: np.ndarray) -> Optional[int]:
+        """
+        Returns the position of the evicted embedding, if any
+        """
+        if self.embeddings is None:
+            self.embeddings = np.zeros((self.size, embedding.size), dtype=np.float32)
+            self.squared_norms = np.zeros(self.size, dtype=np.float32)
+
+        position = self.next_position
+        evicted = position if self.length == self.size else None
+        self.embeddings[position] = embedding.reshape(-1)
+        self.squared_norms[position] = np.dot(
+            self.embeddings[position], self.embeddings[position]
+        )
+        self.next_position = (position + 1) % self.size
+        self.length = min(self.length + 1, self.size)
+        return evicted
+
+    def squared_distances(
+        self, queries: np.ndarray, positions: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Squared euclidean distances from each query to the embeddings at positions (all of them by default)
+        """
+        # -> (queries, embedding_size)
+        queries = queries.reshape(-1, self.embeddings.shape[1]).astype(np.float32)
+        if positions is None:
+            positions = slice(0, self.length)
+        # |q - e|^2 = |q|^2 - 2 q.e + |e|^2
+        # -> (queries, positions)
+        return np.maximum(
+            np.sum(queries**2, axis=1, keepdims=True)
+            - 2 * queries @ self.embeddings[positions].T
+            + self.squared_norms[None, positions],
+            0,
+        )
+
+    def k_nearest_squared_distances(self, queries: np.ndarray, k: int) -> np.ndarray:
+        """
+        Squared euclidean distances from each query to its k nearest embeddings, in increasing order
+        """
+        # -> (queries, min(k, length))
+        return _k_smallest(self.squared_distances(queries), k)
+
+
+class IVFEmbeddingMemory(EmbeddingMemory):
+    """
+    Embedding memory with an inverted file index for approximate nearest neighbor search.
+    Each embedding is filed under the closest of lists k-means centroids,
+    a query only scans the embeddings filed under its probes closest centroids.
+    The search is exact until the memory holds enough embeddings to train the centroids,
+    and for queries whose probed lists hold fewer than k embeddings.
+    Since embeddings drift while the embedding network learns,
+    centroids are retrained each time the whole memory has been replaced.
+    """
+
+    # Training samples per centroid
+    minimum_training_samples: int = 39
+    maximum_training_samples: int = 256
+
+    def __init__(
+        self,
+        size: int,
+        lists: int,
+        probes: int,
+        training_iterations: int = 10,
+        seed: int = 0,
+    ):
+        self.lists: int = lists
+        self.probes: int = probes
+        self.training_iterations: int = training_iterations
+        self.random: np.random.Generator = np.random.default_rng(seed)
+        super().__init__(size)
+
+    def clear(self):
+        super().clear()
+        # -> (lists, embedding_size)
+        self.centroids: Optional[np.ndarray] = None
+        # List of each position and offset of the position in its list
+        # -> (size)
+        self.position_list: np.ndarray = np.full(self.size, -1, dtype=np.int64)
+        self.position_offset: np.ndarray = np.zeros(self.size, dtype=np.int64)
+        # Positions filed under each list, only the first list_lengths[list] are valid
+        self.list_positions: List[np.ndarray] = []
+        # -> (lists)
+        self.list_lengths: np.ndarray = np.zeros(0, dtype=np.int64)
+        self.insertions_since_training: int = 0
+
+    @property
+    def training_size(self) -> int:
+        return min(self.size, self.minimum_training_samples * self.lists)
+
+    def append(self, embedding: np.ndarray) -> Optional[int]:
+        evicted = super().append(embedding)
+        position = (self.next_position - 1) % self.size
+        if self.centroids is None:
+            if self.length >= self.training_size:
+                self.train()
+            return evicted
+
+        if evicted is not None:
+            self._remove(evicted)
+        self.insertions_since_training += 1
+        if self.insertions_since_training >= self.size:
+            self.train()
+        else:
+            self._insert(
+                position,
+                int(
+                    _k_smallest_indices(
+                        self._squared_distances_to_centroids(self.embeddings[position]),
+                        1,
+                    )[0, 0]
+                ),
+            )
+        return evicted
+
+    def train(self):
+        # Lloyd iterations on a sample of the memory
+        samples = self.embeddings[
+            self.random.choice(
+                self.length,
+                min(self.length, self.maximum_training_samples * self.lists),
+                replace=False,
+            )
+        ]
+        centroids = samples[
+            self.random.choice(
+                len(samples), min(self.lists, len(samples)), replace=False
+            )
+        ]
+        for _ in range(self.training_iterations):
+            # -> (samples)
+            assignment = self._assign(samples, centroids)
+            counts = np.bincount(assignment, minlength=len(centroids))
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, samples)
+            # Empty lists keep their centroid
+            centroids = np.where(
+                counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centroids
+            ).astype(np.float32)
+        self.centroids = centroids
+        self.insertions_since_training = 0
+        self._rebuild()
+
+    def k_nearest_squared_distances(self, queries: np.ndarray, k: int) -> np.ndarray:
+        if self.centroids is None:
+            return super().k_nearest_squared_distances(queries, k)
+
+        # -> (queries, embedding_size)
+        queries = queries.reshape(-1, self.embeddings.shape[1]).astype(np.float32)
+        # -> (queries, probes)
+        probed_lists = _k_smallest_indices(
+            self._squared_distances_to_centroids(queries), self.probes
+        )
+        # -> (queries, min(k, length))
+        k_squared_distances = np.empty(
+            (len(queries), min(k, self.length)), dtype=np.float32
+        )
+        for query, lists in enumerate(probed_lists):
+            candidates = np.concatenate(
+                [
+                    self.list_positions[list_][: self.list_lengths[list_]]
+                    for list_ in lists
+                ]
+            )
+            k_squared_distances[query] = _k_smallest(
+                self.squared_distances(
+                    queries[query], candidates if len(candidates) >= k else None
+                ),
+                k,
+            )[0]
+        return k_squared_distances
+
+    def _squared_distances_to_centroids(self, queries: np.ndarray) -> np.ndarray:
+        # -> (queries, lists)
+        queries = queries.reshape(-1, self.centroids.shape[1])
+        return np.maximum(
+            np.sum(queries**2, axis=1, keepdims=True)
+            - 2 * queries @ self.centroids.T
+            + np.sum(self.centroids**2, axis=1)[None, :],
+            0,
+        )
+
+    @staticmethod
+    def _assign(
+        embeddings: np.ndarray, centroids: np.ndarray, chunk_size: int = 4096
+    ) -> np.ndarray:
+        # Chunked so that the (embeddings, lists) distance matrix stays small
+        # -> (embeddings)
+        squared_centroid_norms = np.sum(centroids**2, axis=1)
+        return np.concatenate(
+            [
+                np.argmin(
+                    squared_centroid_norms[None, :]
+                    - 2 * embeddings[start : start + chunk_size] @ centroids.T,
+                    axis=1,
+                )
+                for start in range(0, len(embeddings), chunk_size)
+            ]
+        )
+
+    def _rebuild(self):
+        self.position_list[:] = -1
+        # -> (length)
+        assignment = self._assign(self.embeddings[: self.length], self.centroids)
+        self.position_list[: self.length] = assignment
+        self.list_lengths = np.bincount(assignment, minlength=len(self.centroids))
+        positions_by_list = np.argsort(assignment, kind="stable")
+        list_starts = np.cumsum(self.list_lengths) - self.list_lengths
+        self.position_offset[positions_by_list] = np.arange(self.length) - np.repeat(
+            list_starts, self.list_lengths
+        )
+        # Spare capacity for the insertions until the next training
+        self.list_positions = [
+            np.concatenate(
+                (
+                    positions_by_list[start : start + length],
+                    np.zeros(max(length, 16), dtype=np.int64),
+                )
+            )
+            for start, length in zip(list_starts, self.list_lengths)
+        ]
+
+    def _insert(self, position: int, list_: int):
+        length = self.list_lengths[list_]
+        if length == len(self.list_positions[list_]):
+            self.list_positions[list_] = np.concatenate(
+                (self.list_positions[list_], np.zeros(max(length, 16), dtype=np.int64))
+            )
+        self.list_positions[list_][length] = position
+        self.position_list[position] = list_
+        self.position_offset[position] = length
+        self.list_lengths[list_] += 1
+
+    def _remove(self, position: int):
+        # The last position of the list takes the place of the removed one
+        list_ = self.position_list[position]
+        offset = self.position_offset[position]
+        last_position = self.list_positions[list_][self.list_lengths[list_] - 1]
+        self.list_positions[list_][offset] = last_position
+        self.position_offset[last_position] = offset
+        self.list_lengths[list_] -= 1
+        self.position_list[position] = -1
+
+
+def _k_smallest_indices(values: np.ndarray, k: int) -> np.ndarray:
+    # Indices of the k smallest values of each row, in increasing order of value
+    # -> (rows, min(k, columns))
+    k = min(k, values.shape[1])
+    smallest = np.argpartition(values, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(
+        smallest,
+        np.argsort(np.take_along_axis(values, smallest, axis=1), axis=1),
+        axis=1,
+    )
+
+
+def _k_smallest(values: np.ndarray, k: int) -> np.ndarray:
+    # -> (rows, min(k, columns))
+    k = min(k, values.shape[1])
+    return np.sort(np.partition(values, k - 1, axis=1)[:, :k], axis=1)
+
+
+def get_embedding_memory(
+    index: str, size: int, lists: int, probes: int
+) -> EmbeddingMemory:
+    if index == "exact":
+        return EmbeddingMemory(size)
+    if index == "ivf":
+        return IVFEmbeddingMemory(size, lists=lists, probes=probes)
+    raise Exception(
+        "Unknown embedding memory index: "
+        + str(index)
+        + "\nAvailable indices are: exact, ivf"
+    )
@@ -1,8 +1,9 @@
 import abc
 import functools
-from typing import Any, Callable, Dict
+from typing import Any, Callable, Dict, Optional, Sequence
 
 import dgl
+import torch as th
 
 
 class ExplorationModule(abc.ABC):
@@ -30,6 +31,17 @@ class ExplorationModule(abc.ABC):
     ) -> float:
         return 0
 
+    def compute_intrinsic_rewards(
+        self,
+        observations: dgl.DGLHeteroGraph,
+        actions: Sequence[int],
+        dones: Sequence[bool],
+    ) -> Optional[th.Tensor]:
+        # Called at learn time on a sampled batch: observations holds the current observations
+        # followed by the next observations.
+        # Modules which compute intrinsic rewards at step time return None
+        return None
+
     @abc.abstractmethod
     def get_state(self) -> Dict[str, Any]:
         ...
@@ -1,17 +1,15 @@
-from typing import Dict, Optional, Tuple, Callable, Any
+from typing import Dict, List, Optional, Sequence, Tuple, Callable, Any
 
 import dgl
 from torch import Tensor
 
 from agents.base_gcn_agent import BaseGCNAgent
+from agents.exploration.embedding_memory import get_embedding_memory
 from agents.exploration.exploration_module import ExplorationModule
 from agents.exploration.random_network_distiller import RandomNetworkDistiller
-from collections import deque
 import torch as th
 import numpy as np
-from numpy.linalg import norm
 import torch.nn as nn
-from sklearn.neighbors import NearestNeighbors
 
 from configs.agent_architecture import (
     EpisodicMemoryParameters,
@@ -37,11 +35,21 @@ class EpisodicMemory(ExplorationModule):
         edge_features = agent.edge_features
         self.name = agent.name + "_episodic_memory"
 
-        self.memory = deque(maxlen=exploration_parameters.size)
+        self.memory = get_embedding_memory(
+            index=exploration_parameters.index,
+            size=exploration_parameters.size,
+            lists=exploration_parameters.index_lists,
+            probes=exploration_parameters.index_probes,
+        )
         self.neighbors = exploration_parameters.neighbors
         self.maximum_similarity = exploration_parameters.maximum_similarity
         self.exploration_bonus_limit = exploration_parameters.exploration_bonus_limit
 
+        # In batched mode observations are only queued at step time,
+        # they are embedded and added to memory at learn time
+        self.batched = exploration_parameters.batched
+        self.pending_observations: List[dgl.DGLHeteroGraph] = []
+
         self.inverse_model = self.InverseNetwork(
             node_features=node_features,
             edge_features=edge_features,
@@ -85,6 +93,9 @@ class EpisodicMemory(ExplorationModule):
     ):
         if done:
             return 0
+        if self.batched:
+            self.pending_observations.append(current_state)
+            return 0
         try:
             (
                 self.last_predicted_action_values,
@@ -100,9 +111,60 @@ class EpisodicMemory(ExplorationModule):
             th.Tensor(self.exploration_bonus), 1, self.exploration_bonus_limit
         )
 
+    def compute_intrinsic_rewards(
+        self,
+        observations: dgl.DGLHeteroGraph,
+        actions: Sequence[int],
+        dones: Sequence[bool],
+    ) -> Optional[th.Tensor]:
+        if not self.batched:
+            return None
+        batch_size = len(actions)
+
+        # -> (batch_size, actions), (batch_size, embedding_size)
+        (
+            predicted_action_values,
+            current_state_embeddings,
+        ) = self.inverse_model.forward_batch(observations, batch_size)
+        # -> (2 * batch_size)
+        distiller_errors = self.random_network_distiller.errors(observations)
+
+        # -> (batch_size)
+        episodic_rewards = self._episodic_rewards(
+            current_state_embeddings.detach().numpy()
+        )
+        exploration_bonuses = self._exploration_bonuses(
+            distiller_errors[:batch_size].detach().numpy()
+        )
+        intrinsic_rewards = episodic_rewards * np.clip(
+            exploration_bonuses, 1, self.exploration_bonus_limit
+        )
+        intrinsic_rewards[np.asarray(dones, dtype=bool)] = 0
+
+        self.inverse_model.learn_batch(actions, predicted_action_values)
+        self.random_network_distiller.learn_batch(distiller_errors[:batch_size])
+        self._add_pending_observations()
+
+        self.episodic_reward = float(np.mean(episodic_rewards))
+        self.exploration_bonus = float(np.mean(exploration_bonuses))
+        return th.from_numpy(intrinsic_rewards).float()
+
+    def _add_pending_observations(self):
+        # Swapped first: steps may queue observations meanwhile when learning asynchronously
+        pending_observations, self.pending_observations = self.pending_observations, []
+        if not pending_observations:
+            return
+        with th.no_grad():
+            # -> (pending observations, embedding_size)
+            embeddings = self.inverse_model.embed(
+                dgl.batch(pending_observations)
+            ).numpy()
+        for embedding in embeddings:
+            self.memory.append(embedding)
+
     def get_state(self) -> Dict[str, Any]:
         return {
-            "memory": pd.Series(self.memory).to_dict(),
+            "memory": pd.Series(list(self.memory)).to_dict(),
             "inverse_model": self.inverse_model.state_dict(),
             "k_squared_distance_running_mean": self.k_squared_distance_running_mean.get_state(),
             "random_network_distiller": self.random_network_distiller.state_dict(),
@@ -114,7 +176,9 @@ class EpisodicMemory(ExplorationModule):
         }
 
     def load_state(self, state: Dict[str, Any]) -> None:
-        self.memory = deque(state["memory"].values())
+        self.memory.clear()
+        for embedding in state["memory"].values():
+            self.memory.append(np.asarray(embedding))
         self.inverse_model.load_state_dict(state["inverse_model"])
         self.k_squared_distance_running_mean.load_state(
             state["k_squared_distance_running_mean"]
@@ -142,32 +206,41 @@ class EpisodicMemory(ExplorationModule):
     ):
         try:
             current_embedding_detached = current_embedding.detach().numpy()
-
-            if len(self.memory) <= self.neighbors:
-                neighbor_distances = [0]
-            else:
-                # TODO: replace this with MiniBatchKMeans so that we do not need to keep a memory
-                # Compute K nearest neighbors wrt inverse kernel from memory
-                neighbors_model = NearestNeighbors(
-                    n_neighbors=self.neighbors, metric=self._inverse_kernel
-                )
-                memory_array = np.array(self.memory)
-                neighbors_model.fit(memory_array)
-                neighbor_distances, _ = neighbors_model.kneighbors(
-                    np.array(current_embedding_detached).reshape(1, -1),
-                )
+            episodic_reward = self._episodic_rewards(
+                current_embedding_detached.reshape(1, -1), denominator_constant
+            )[0]
 
             # Update Memory
             self.memory.append(current_embedding_detached)
-
-            # Episodic Reward
-            episodic_reward = 1 / np.sqrt(
-                np.sum(neighbor_distances) + denominator_constant
-            )
-            return episodic_reward if episodic_reward <= self.maximum_similarity else 0
+            return episodic_reward
         except ValueError:
             return 0
 
+    def _episodic_rewards(
+        self, current_embeddings: np.ndarray, denominator_constant: float = 1e-5
+    ) -> np.ndarray:
+        # -> (embeddings)
+        if len(self.memory) <= self.neighbors:
+            neighbor_distances = np.zeros(len(current_embeddings))
+        else:
+            # Inverse kernel over the K nearest neighbors of each embedding in memory
+            # -> (embeddings, neighbors)
+            k_squared_distances = self.memory.k_nearest_squared_distances(
+                current_embeddings, self.neighbors
+            )
+            self.k_squared_distance_running_mean.update_many(
+                k_squared_distances.flatten()
+            )
+            neighbor_distances = np.sum(
+                self._inverse_kernel(k_squared_distances), axis=1
+            )
+
+        # Episodic Reward
+        episodic_rewards = 1 / np.sqrt(neighbor_distances + denominator_constant)
+        return np.where(
+            episodic_rewards <= self.maximum_similarity, episodic_rewards, 0
+        )
+
     def _exploration_bonus(self, current_state: dgl.DGLHeteroGraph) -> float:
         distiller_error: th.Tensor = self.random_network_distiller(current_state)
         self.distiller_error_running_mean.update(float(distiller_error.data))
@@ -184,34 +257,34 @@ class EpisodicMemory(ExplorationModule):
             else 1
         )
 
+    def _exploration_bonuses(self, distiller_errors: np.ndarray) -> np.ndarray:
+        self.distiller_error_running_mean.update_many(distiller_errors)
+        self.distiller_error_running_standard_deviation.update_many(distiller_errors)
+        if self.distiller_error_running_standard_deviation.value == 0:
+            return np.ones(len(distiller_errors))
+        return (
+            1
+            + (distiller_errors - self.distiller_error_running_mean.value)
+            / self.distiller_error_running_standard_deviation.value
+        )
+
     def _inverse_kernel(
         self,
-        x: np.array,
-        y: np.array,
+        k_squared_distances: np.ndarray,
         epsilon: float = 0.01,
         cluster_distance: float = 0.008,
-    ) -> float:
-        # x <- current_state_embedding as computed by the inverse model
-        # y <- K nearest neighbors to x in M (all Ks, then the outputs of the kernels are summed)
-        squared_euclidean_distance = float(norm(x - y) ** 2)
-        self.k_squared_distance_running_mean.update(squared_euclidean_distance)
-        return (
-            epsilon
-            / (
-                (
-                    max(
-                        (
-                            squared_euclidean_distance
-                            / self.k_squared_distance_running_mean.value
-                            - cluster_distance
-                        ),
-                        0,
-                    )
-                )
-                + epsilon
+    ) -> np.ndarray:
+        # k_squared_distances <- squared euclidean distances between the current state embedding
+        # and its K nearest neighbors in M (the outputs of the kernels are then summed)
+        if self.k_squared_distance_running_mean.value == 0:
+            return np.zeros_like(k_squared_distances)
+        return epsilon / (
+            np.maximum(
+                k_squared_distances / self.k_squared_distance_running_mean.value
+                - cluster_distance,
+                0,
             )
-            if self.k_squared_distance_running_mean.value != 0
-            else 0
+            + epsilon
         )
 
     class InverseNetwork(nn.Module):
@@ -272,12 +345,35 @@ class EpisodicMemory(ExplorationModule):
             )
             return predicted_action, current_state_embedding
 
+        def embed(self, observations: dgl.DGLHeteroGraph) -> Tensor:
+            # Mean node embedding of each graph of a batched graph
+            # -> (graphs, embedding_size)
+            return dgl.ops.segment_reduce(
+                observations.batch_num_nodes(),
+                self.embedding_network(observations),
+                "mean",
+            )
+
+        def forward_batch(
+            self, observations: dgl.DGLHeteroGraph, batch_size: int
+        ) -> Tuple[Tensor, Tensor]:
+            # Same as forward() for batch_size current states followed by batch_size next states
+            # -> (2 * batch_size, embedding_size)
+            embeddings = self.embed(observations)
+            # -> (batch_size, actions)
+            predicted_actions = self.action_prediction_stream(
+                th.cat((embeddings[:batch_size], embeddings[batch_size:]), dim=1)
+            )
+            return predicted_actions, embeddings[:batch_size]
+
         def learn(self, action: int, predicted_action: th.Tensor):
-            self.optimizer.zero_grad()
-            loss = self.loss(
-                predicted_action.reshape([1, self.action_space_size]),
-                th.Tensor([action]).long(),
+            self.learn_batch(
+                [action], predicted_action.reshape([1, self.action_space_size])
             )
+
+        def learn_batch(self, actions: Sequence[int], predicted_actions: th.Tensor):
+            self.optimizer.zero_grad()
+            loss = self.loss(predicted_actions, th.Tensor(actions).long())
             loss.backward()
             nn.utils.clip_grad_norm_(self.parameters(), max_norm=40)
             self.optimizer.step()
@@ -295,6 +391,10 @@ class EpisodicMemory(ExplorationModule):
             self.running_sum += value_to_add
             self.running_count += 1
 
+        def update_many(self, values_to_add: np.ndarray):
+            self.running_sum += float(np.sum(values_to_add))
+            self.running_count += len(values_to_add)
+
         def get_state(self) -> Dict[str, Any]:
             return {
                 "running_sum": self.running_sum,
@@ -323,6 +423,11 @@ class EpisodicMemory(ExplorationModule):
             self.running_sum_of_squares += value_to_add**2
             self.running_count += 1
 
+        def update_many(self, values_to_add: np.ndarray):
+            self.running_sum += float(np.sum(values_to_add))
+            self.running_sum_of_squares += float(np.sum(np.square(values_to_add)))
+            self.running_count += len(values_to_add)
+
         def get_state(self) -> Dict[str, Any]:
             return {
                 "running_sum": self.running_sum,
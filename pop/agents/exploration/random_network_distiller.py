@@ -53,6 +53,23 @@ class RandomNetworkDistiller(nn.Module):
         self.last_loss = self.mse_loss(target_features, predicted_features)
         return self.last_loss
 
+    def errors(self, observations: dgl.DGLHeteroGraph) -> th.Tensor:
+        # Same as forward() for each graph of a batched graph
+        # -> (nodes)
+        node_errors = th.mean(
+            (self.target_network(observations) - self.prediction_network(observations))
+            ** 2,
+            dim=1,
+        )
+        # -> (graphs)
+        return dgl.ops.segment_reduce(
+            observations.batch_num_nodes(), node_errors, "mean"
+        )
+
+    def learn_batch(self, errors: th.Tensor):
+        self.last_loss = th.mean(errors)
+        self.learn()
+
     def learn(self):
         if self.last_loss is not None:
             self.distiller_optimizer.zero_grad()
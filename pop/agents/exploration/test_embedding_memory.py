@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from pop.agents.exploration.embedding_memory import (
+    EmbeddingMemory,
+    IVFEmbeddingMemory,
+)
+
+
+def _embeddings(count: int, seed: int = 0) -> np.ndarray:
+    # Clustered embeddings, as produced by an embedding network
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 4, size=(6, 8))
+    return (
+        centers[rng.integers(len(centers), size=count)]
+        + rng.normal(0, 1, size=(count, 8))
+    ).astype(np.float32)
+
+
+@pytest.mark.parametrize("appended", [50, 200, 457, 1000])
+def test_ivf_with_all_lists_probed_is_exact(appended: int):
+    # The memory is trained at 156 embeddings, then retrained each time it is replaced
+    exact = EmbeddingMemory(200)
+    ivf = IVFEmbeddingMemory(200, lists=4, probes=4)
+    for embedding in _embeddings(appended):
+        assert exact.append(embedding) == ivf.append(embedding)
+    assert (ivf.centroids is not None) == (appended >= ivf.training_size)
+
+    queries = _embeddings(30, seed=1)
+    expected = np.sort(
+        np.sum((queries[:, None, :] - np.stack(list(exact))[None]) ** 2, axis=2),
+        axis=1,
+    )[:, :10]
+    for memory in (exact, ivf):
+        assert np.allclose(
+            memory.k_nearest_squared_distances(queries, 10),
+            expected,
+            rtol=1e-4,
+            atol=1e-3,
+        )
+
+
+def test_ivf_files_every_embedding_once():
+    ivf = IVFEmbeddingMemory(200, lists=4, probes=1)
+    for embedding in _embeddings(457):
+        ivf.append(embedding)
+
+    filed = np.concatenate(
+        [
+            ivf.list_positions[list_][: ivf.list_lengths[list_]]
+            for list_ in range(ivf.lists)
+        ]
+    )
+    assert sorted(filed) == list(range(len(ivf)))
+    for list_ in range(ivf.lists):
+        positions = ivf.list_positions[list_][: ivf.list_lengths[list_]]
+        assert (ivf.position_list[positions] == list_).all()
+        assert (ivf.position_offset[positions] == np.arange(len(positions))).all()
+
+
+def test_ivf_with_one_probe_never_underestimates():
+    ivf = IVFEmbeddingMemory(200, lists=4, probes=1)
+    exact = EmbeddingMemory(200)
+    for embedding in _embeddings(457):
+        ivf.append(embedding)
+        exact.append(embedding)
+
+    queries = _embeddings(30, seed=1)
+    # Approximate neighbors are a subset of the memory: their distances can only be larger
+    assert (
+        ivf.k_nearest_squared_distances(queries, 10)
+        >= exact.k_nearest_squared_distances(queries, 10) - 1e-3
+    ).all()
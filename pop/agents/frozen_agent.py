@@ -0,0 +1,102 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import dgl
+import torch as th
+from dgl import DGLHeteroGraph
+from torch import Tensor
+
+from pop.configs.agent_architecture import AgentArchitecture
+from pop.networks.dueling_net import DuelingNet
+
+
+class FrozenAgent:
+    """
+    Inference-only copy of a trained agent or manager.
+    Actions are greedy with respect to a Q network whose weights never change:
+    there is no replay memory, optimizer, exploration module or Ray actor,
+    so that frozen agents can be copied into other processes.
+    """
+
+    def __init__(
+        self,
+        q_network: DuelingNet,
+        actions: int,
+        name: str,
+        edge_features: Optional[List[str]] = None,
+        device: str = "cpu",
+    ):
+        self.q_network: DuelingNet = q_network.to(device).eval().requires_grad_(False)
+        self.actions: int = actions
+        self.name: str = name
+        self.edge_features: Optional[List[str]] = edge_features
+        self.device: th.device = th.device(device)
+
+    @staticmethod
+    def from_state(state: Dict[str, Any], device: str = "cpu") -> "FrozenAgent":
+        """
+        state is returned by get_inference_state() or get_state() of the agent
+        """
+        architecture = AgentArchitecture(load_from_dict=state["architecture"])
+        q_network = DuelingNet(
+            action_space_size=state["agent_actions"],
+            node_features=len(state["node_features"])
+            if state["single_node_features"] is None
+            else state["single_node_features"],
+            edge_features=len(state["edge_features"])
+            if state["edge_features"] is not None
+            else None,
+            embedding_architecture=architecture.embedding,
+            advantage_stream_architecture=architecture.advantage_stream,
+            value_stream_architecture=architecture.value_stream,
+            feature_ranges=state["feature_ranges"],
+            name=state["name"] + "_dueling",
+            log_dir=None,
+        )
+        q_network.load_state_dict(state["q_network_state"])
+        return FrozenAgent(
+            q_network,
+            actions=state["agent_actions"],
+            name=state["name"],
+            edge_features=state["edge_features"],
+            device=device,
+        )
+
+    def get_name(self) -> str:
+        return self.name
+
+    def take_action(
+        self, transformed_observation: DGLHeteroGraph, mask: Optional[List[int]] = None
+    ) -> Tuple[int, float]:
+        action, q_value, _ = self.take_action_with_embedding(
+            transformed_observation, mask
+        )
+        return action, q_value
+
+    def take_action_with_embedding(
+        self, transformed_observation: DGLHeteroGraph, mask: Optional[List[int]] = None
+    ) -> Tuple[int, float, Tensor]:
+        """
+        Same action and Q value as a non training agent (a manager when masked),
+        together with the graph embedding
+        """
+        self._add_missing_edge(transformed_observation)
+
+        with th.no_grad():
+            # -> (1, actions), (actions), (1, embedding_size)
+            q_values, advantages, graph_embedding = self.q_network.evaluate(
+                transformed_observation.to(self.device)
+            )
+
+        if mask is not None:
+            advantages[[action not in mask for action in range(self.actions)]] = float(
+                "-inf"
+            )
+        action = int(th.argmax(advantages).item())
+
+        return action, q_values.squeeze()[action].item(), graph_embedding.squeeze()
+
+    def _add_missing_edge(self, graph: dgl.DGLGraph):
+        if self.edge_features is not None and graph.num_edges() == 0:
+            graph.add_edges([0], [0])
+            for edge_feature in self.edge_features:
+                graph.edata[edge_feature] = th.zeros((1,)).to(graph.device)
@@ -67,18 +67,22 @@ class Manager(BaseGCNAgent):
             if transformed_observation.num_edges() == 0:
                 transformed_observation.add_edge([0], [0])
                 self._add_fake_edge_features(transformed_observation)
-        return self.q_network.embedding(transformed_observation.to(self.device))
+        with self.learning_lock:
+            return self.q_network.embedding(transformed_observation.to(self.device))
 
     def _take_action(
         self, transformed_observation: DGLHeteroGraph, mask: List[int] = None
     ) -> int:
         # Mask must be not none
 
-        action_list = list(range(self.actions))
-
         # -> (actions)
         advantages: Tensor = self.q_network.advantage(transformed_observation)
 
+        return self._masked_argmax(advantages, mask)
+
+    def _masked_argmax(self, advantages: Tensor, mask: List[int]) -> int:
+        action_list = list(range(self.actions))
+
         # Masking advantages
         advantages[
             [False if action in mask else True for action in action_list]
@@ -86,6 +90,61 @@ class Manager(BaseGCNAgent):
 
         return int(th.argmax(advantages).item())
 
+    def _greedy_action(self, advantages: Tensor, mask: List[int]) -> int:
+        return self._masked_argmax(advantages, mask)
+
+    def take_actions_with_embedding(
+        self, transformed_observations: List[DGLHeteroGraph], masks: List[List[int]]
+    ) -> List[Tuple[int, float, Tensor]]:
+        """
+        Same as take_action_with_embedding() for each observation,
+        with one forward pass over the batched observations
+        """
+        actions, q_values, graph_embeddings = self._take_actions(
+            transformed_observations, masks
+        )
+        # Embeddings are copied out of the batch so that each one is sent on its own
+        return list(
+            zip(
+                actions,
+                q_values,
+                [graph_embedding.clone() for graph_embedding in graph_embeddings],
+            )
+        )
+
+    def take_action_with_embedding(
+        self, transformed_observation: DGLHeteroGraph, mask: List[int]
+    ) -> Tuple[int, float, Tensor]:
+        """
+        Same action and Q value as take_action() together with the community embedding
+        (the mean of the node embeddings), all from one forward pass
+        """
+        self._add_missing_edge(transformed_observation)
+
+        def greedy_action(
+            transformed_observation: DGLHeteroGraph, mask: List[int] = None
+        ) -> int:
+            return self._masked_argmax(advantages, mask)
+
+        with self.learning_lock:
+            # -> (1, actions), (actions), (1, embedding_size)
+            q_values, advantages, graph_embedding = self.q_network.evaluate(
+                transformed_observation
+            )
+
+            if self.training:
+                action = self.exploration.action_exploration(greedy_action)(
+                    self, transformed_observation, mask=mask
+                )
+            else:
+                action = greedy_action(transformed_observation, mask=mask)
+
+        return (
+            action,
+            q_values.squeeze()[action].item(),
+            graph_embedding.squeeze().detach(),
+        )
+
     @staticmethod
     def factory(checkpoint: Dict[str, Any], **kwargs) -> ObjectRef:
         manager: ObjectRef = Manager.remote(
@@ -46,6 +46,13 @@ class RayShallowGCNAgent(BaseGCNAgent):
     ) -> Tuple[int, float]:
         return 0, 0  # Always no-action with 0 q-value
 
+    def take_actions(
+        self,
+        transformed_observations: List[DGLHeteroGraph],
+        masks: Optional[List[Optional[List[int]]]] = None,
+    ) -> List[Tuple[int, float]]:
+        return [(0, 0)] * len(transformed_observations)
+
     def step(
         self,
         observation: DGLHeteroGraph,
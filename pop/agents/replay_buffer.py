@@ -1,24 +1,50 @@
 from collections import namedtuple
-from dataclasses import asdict
+from dataclasses import asdict, replace
 
 import numpy as np
-from typing import Dict, Tuple, List, Any
-import pandas as pd
+from typing import Dict, Optional, Tuple, List, Any
+import torch as th
 from math import log10
 
+from pop.agents.columnar_storage import ColumnarTransitionStorage, batch_graph_columns
+from pop.agents.replay_memory_file import (
+    ArrayLayout,
+    allocate_replay_memory,
+    array_layout,
+    load_replay_memory,
+    save_replay_memory,
+)
+from pop.agents.segment_tree import MaxSegmentTree, MinSegmentTree, SumSegmentTree
 from pop.configs.agent_architecture import ReplayMemoryParameters
 
 Transition = namedtuple(
     "Transition", ("observation", "action", "next_observation", "reward", "done")
 )
 
+# Collated transitions: observations holds the batch_size current observations
+# followed by the batch_size next observations
+TransitionBatch = namedtuple(
+    "TransitionBatch", ("observations", "action", "reward", "done")
+)
+
 
 class ReplayMemory(object):
-    def __init__(self, architecture: ReplayMemoryParameters) -> None:
+    def __init__(
+        self, architecture: ReplayMemoryParameters, device: Optional[th.device] = None
+    ) -> None:
         self.capacity = architecture.capacity
+        self.device: Optional[th.device] = device
         self.memory = np.empty(
             self.capacity, dtype=[("priority", np.float32), ("transition", Transition)]
         )
+
+        # In columnar mode transitions live in preallocated arrays
+        # and the "transition" field of memory is left empty
+        self.storage: Optional[ColumnarTransitionStorage] = (
+            ColumnarTransitionStorage(self.capacity, device)
+            if architecture.columnar
+            else None
+        )
         self.architecture: ReplayMemoryParameters = architecture
         self.alpha: float = architecture.alpha
         self.buffer_length: int = 0
@@ -29,6 +55,9 @@ class ReplayMemory(object):
         self.beta: float = self.max_beta
         self.apply_uniform: bool = False
 
+        # Snapshots still streaming stored transitions, see ReplayMemorySnapshot
+        self.snapshots: List["ReplayMemorySnapshot"] = []
+
     def push(
         self,
         observation: Any,
@@ -47,18 +76,63 @@ class ReplayMemory(object):
         )
 
         # Assign priority to current transition
-        priority = 1.0 if self.is_empty() else self.memory["priority"].max()
+        priority = 1.0 if self.is_empty() else self._max_priority()
 
         if self.is_full():
-            if priority > self.memory["priority"].min():
+            if priority > self._min_priority():
                 # Replace the lowest priority transition
-                idx = self.memory["priority"].argmin()
-                self.memory[idx] = (priority, transition)
+                self._store(self._min_priority_index(), priority, transition)
         else:
             # Add to the buffer
-            self.memory[self.buffer_length] = (priority, transition)
+            self._store(self.buffer_length, priority, transition)
             self.buffer_length += 1
 
+    def _max_priority(self) -> float:
+        return self.memory["priority"].max()
+
+    def _min_priority(self) -> float:
+        return self.memory["priority"].min()
+
+    def _min_priority_index(self) -> int:
+        return int(self.memory["priority"].argmin())
+
+    def _store(self, idx: int, priority: float, transition: Transition) -> None:
+        for snapshot in self.snapshots:
+            snapshot.preserve(idx)
+        if self.storage is not None:
+            self.memory["priority"][idx] = priority
+            self.storage[idx] = transition
+        else:
+            self.memory[idx] = (priority, transition)
+
+    def _get_transitions(self, indices: np.ndarray) -> List[Transition]:
+        if self.storage is not None:
+            return [_stored_transition(self.storage, idx) for idx in indices]
+        return list(self.memory["transition"][indices])
+
+    def _get_batch(self, indices: np.ndarray) -> TransitionBatch:
+        if self.storage is not None:
+            # One batched graph is assembled straight from the feature arrays
+            return TransitionBatch(
+                observations=batch_graph_columns(
+                    [
+                        (self.storage.observation, indices),
+                        (self.storage.next_observation, indices),
+                    ]
+                ),
+                action=tuple(self.storage.action[indices].tolist()),
+                reward=tuple(self.storage.reward[indices].tolist()),
+                done=tuple(self.storage.done[indices].tolist()),
+            )
+        transitions = Transition(*zip(*self.memory["transition"][indices]))
+        return TransitionBatch(
+            observations=list(transitions.observation)
+            + list(transitions.next_observation),
+            action=transitions.action,
+            reward=transitions.reward,
+            done=transitions.done,
+        )
+
     def is_empty(self) -> bool:
         return self.buffer_length == 0
 
@@ -80,6 +154,26 @@ class ReplayMemory(object):
     def sample(
         self, batch_size: int, epsilon: float = 1e-4
     ) -> Tuple[List[int], List[Transition], List[float]]:
+        indices, normalized_weights = self._sample_indices(batch_size, epsilon)
+        return (
+            list(indices),
+            self._get_transitions(indices),
+            list(normalized_weights),
+        )
+
+    def sample_batch(
+        self, batch_size: int, epsilon: float = 1e-4
+    ) -> Tuple[List[int], TransitionBatch, List[float]]:
+        """
+        Same as sample() with transitions collated in a TransitionBatch.
+        In columnar mode observations are already one batched graph.
+        """
+        indices, normalized_weights = self._sample_indices(batch_size, epsilon)
+        return list(indices), self._get_batch(indices), list(normalized_weights)
+
+    def _sample_indices(
+        self, batch_size: int, epsilon: float
+    ) -> Tuple[np.ndarray, np.ndarray]:
 
         priorities = self.memory[: self.buffer_length]["priority"]
         sampling_probabilities = priorities**self.alpha / (
@@ -111,11 +205,10 @@ class ReplayMemory(object):
                 replace=True,
             )
 
-        transitions = self.memory["transition"][indices]
         weights = (self.buffer_length * sampling_probabilities[indices]) ** -self.beta
         normalized_weights = weights / weights.max()
 
-        return list(indices), list(transitions), list(normalized_weights)
+        return indices, normalized_weights
 
     def update_priorities(self, idxs: List[int], priorities: List[float]) -> None:
         self.memory["priority"][idxs] = priorities
@@ -123,22 +216,301 @@ class ReplayMemory(object):
     def __len__(self) -> int:
         return self.buffer_length
 
+    def snapshot(self) -> "ReplayMemorySnapshot":
+        """
+        State of the memory at this instant, written by ReplayMemorySnapshot.save()
+        Must be called with the lock guarding the memory held
+        """
+        snapshot = ReplayMemorySnapshot(self)
+        if self.storage is not None:
+            self.snapshots.append(snapshot)
+        return snapshot
+
     def get_state(self) -> dict:
+        """
+        Priorities and transitions of the stored slots as contiguous arrays, see save_replay_memory()
+        Transitions are stored in columns even when the memory is not columnar
+        """
+        if self.storage is not None:
+            storage = self.storage
+        else:
+            storage = ColumnarTransitionStorage(self.buffer_length)
+            for idx, transition in enumerate(
+                self.memory["transition"][: self.buffer_length]
+            ):
+                storage[idx] = transition
         return {
             "architecture": asdict(self.architecture),
             "beta": self.beta,
             "buffer_length": self.buffer_length,
-            "memory": pd.DataFrame(self.memory).to_dict(),
+            # -> (buffer_length)
+            "priority": self.memory["priority"][: self.buffer_length],
+            "storage": storage.get_state(self.buffer_length),
         }
 
     def load_state(self, state_dict: dict) -> None:
         self.buffer_length = state_dict["buffer_length"]
         self.beta = state_dict["beta"]
 
-        for idx, (priority, transition) in enumerate(
-            zip(
-                state_dict["memory"]["priority"].values(),
-                state_dict["memory"]["transition"].values(),
+        if "memory" in state_dict:
+            # Checkpoints saved before transitions were stored in columns
+            for idx, (priority, transition) in enumerate(
+                zip(
+                    state_dict["memory"]["priority"].values(),
+                    state_dict["memory"]["transition"].values(),
+                )
+            ):
+                self.memory[idx] = (priority, transition)
+
+            if self.storage is not None and state_dict.get("storage") is not None:
+                self.storage.load_state(state_dict["storage"])
+            return
+
+        self.memory["priority"][: self.buffer_length] = state_dict["priority"]
+        if self.storage is None:
+            # Object memories keep the loaded columns instead of rebuilding every graph,
+            # graphs are only built for the sampled transitions
+            self.storage = ColumnarTransitionStorage(self.capacity, self.device)
+            self.memory["transition"] = None
+        self.storage.load_state(state_dict["storage"])
+
+
+class SumTreeReplayMemory(ReplayMemory):
+    """
+    Prioritized replay memory with the same sampling distribution as ReplayMemory.
+    Priorities are mirrored in segment trees so that push(), sample() and update_priorities()
+    cost O(log(capacity)) instead of O(capacity).
+    """
+
+    def __init__(
+        self, architecture: ReplayMemoryParameters, device: Optional[th.device] = None
+    ) -> None:
+        super().__init__(architecture, device)
+
+        # priority**alpha, used for proportional sampling
+        self.sum_tree: SumSegmentTree = SumSegmentTree(self.capacity)
+
+        # Raw priorities, used for eviction and for the priority of new transitions
+        self.min_tree: MinSegmentTree = MinSegmentTree(self.capacity)
+        self.max_tree: MaxSegmentTree = MaxSegmentTree(self.capacity)
+
+    def _max_priority(self) -> float:
+        return self.max_tree.reduce()
+
+    def _min_priority(self) -> float:
+        return self.min_tree.reduce()
+
+    def _min_priority_index(self) -> int:
+        return self.min_tree.argmin()
+
+    def _store(self, idx: int, priority: float, transition: Transition) -> None:
+        super()._store(idx, priority, transition)
+        self._update_trees(idx, priority)
+
+    def _update_trees(self, idxs, priorities) -> None:
+        priorities = np.asarray(priorities, dtype=np.float64)
+        self.sum_tree[idxs] = priorities**self.alpha
+        self.min_tree[idxs] = priorities
+        self.max_tree[idxs] = priorities
+
+    def _sample_indices(
+        self, batch_size: int, epsilon: float
+    ) -> Tuple[np.ndarray, np.ndarray]:
+
+        total_priority = self.sum_tree.reduce()
+
+        if not self.apply_uniform and not np.isfinite(total_priority):
+            print(
+                "Found NaN in sampling probabilities, applying uniform sampling from now on"
+            )
+            self.apply_uniform = True
+
+        if not self.apply_uniform:
+            indices = np.minimum(
+                self.sum_tree.find_prefix_sum_index(
+                    np.random.uniform(0, total_priority, size=batch_size)
+                ),
+                self.buffer_length - 1,
+            )
+        else:
+            indices = np.random.choice(
+                self.buffer_length,
+                size=batch_size,
+                replace=True,
+            )
+
+        sampling_probabilities = self.sum_tree[indices] / (total_priority + epsilon)
+        weights = (self.buffer_length * sampling_probabilities) ** -self.beta
+        normalized_weights = weights / weights.max()
+
+        return indices, normalized_weights
+
+    def update_priorities(self, idxs: List[int], priorities: List[float]) -> None:
+        super().update_priorities(idxs, priorities)
+        self._update_trees(idxs, self.memory["priority"][idxs])
+
+    def load_state(self, state_dict: dict) -> None:
+        super().load_state(state_dict)
+        self.sum_tree.clear()
+        self.min_tree.clear()
+        self.max_tree.clear()
+        if self.buffer_length > 0:
+            self._update_trees(
+                np.arange(self.buffer_length),
+                self.memory["priority"][: self.buffer_length],
             )
+
+
+class ReplayMemorySnapshot(object):
+    """
+    State of a ReplayMemory written to disk while the memory keeps being pushed to.
+    Taking the snapshot only copies the priorities, stored transitions are copied chunk by chunk by save().
+    Slots overwritten before their chunk is copied are copied first, see ReplayMemory._store().
+    """
+
+    def __init__(self, memory: ReplayMemory) -> None:
+        self.memory: ReplayMemory = memory
+        self.architecture: Dict[str, Any] = asdict(memory.architecture)
+        self.beta: float = memory.beta
+        self.buffer_length: int = memory.buffer_length
+
+        # -> (buffer_length)
+        self.priority: np.ndarray = memory.memory["priority"][
+            : self.buffer_length
+        ].copy()
+
+        # Transitions of object memories are never modified, only their references are copied
+        self.transitions: Optional[np.ndarray] = (
+            memory.memory["transition"][: self.buffer_length].copy()
+            if memory.storage is None
+            else None
+        )
+
+        # Columns may be widened later on, only the shapes they had at this instant are saved
+        self.layout: Optional[Dict[str, Any]] = (
+            array_layout(memory.storage.get_state(self.buffer_length))
+            if memory.storage is not None
+            else None
+        )
+
+        # Slots below copied_length were already copied by save()
+        self.copied_length: int = 0
+        self.preserved: Dict[int, Dict[str, Any]] = {}
+
+    def preserve(self, idx: int) -> None:
+        if (
+            self.layout is not None
+            and self.copied_length <= idx < self.buffer_length
+            and idx not in self.preserved
         ):
-            self.memory[idx] = (priority, transition)
+            self.preserved[idx] = _copy_slots(
+                self.memory.storage.get_state(), self.layout, idx, idx + 1
+            )
+
+    def save(self, directory: str, lock: Any, chunk_size: int = 1024) -> None:
+        """
+        Writes the snapshot to directory, see save_replay_memory()
+        lock guards the memory, it is only held while one chunk of slots is copied
+        """
+        try:
+            save_replay_memory(
+                {
+                    "architecture": self.architecture,
+                    "beta": self.beta,
+                    "buffer_length": self.buffer_length,
+                    "priority": self.priority,
+                    "storage": self._save_storage(directory, lock, chunk_size),
+                },
+                directory,
+            )
+        finally:
+            with lock:
+                if self in self.memory.snapshots:
+                    self.memory.snapshots.remove(self)
+
+    def _save_storage(
+        self, directory: str, lock: Any, chunk_size: int
+    ) -> Dict[str, Any]:
+        if self.layout is None:
+            storage = ColumnarTransitionStorage(self.buffer_length)
+            for idx, transition in enumerate(self.transitions):
+                storage[idx] = transition
+            return storage.get_state()
+
+        storage_state = allocate_replay_memory(self.layout, directory)
+        for start in range(0, self.buffer_length, chunk_size):
+            end = min(start + chunk_size, self.buffer_length)
+            with lock:
+                slots = _copy_slots(
+                    self.memory.storage.get_state(), self.layout, start, end
+                )
+                preserved = [
+                    (idx, self.preserved.pop(idx))
+                    for idx in range(start, end)
+                    if idx in self.preserved
+                ]
+                self.copied_length = end
+            _write_slots(storage_state, slots, start)
+            for idx, slot in preserved:
+                _write_slots(storage_state, slot, idx)
+        return storage_state
+
+
+def get_replay_memory(
+    architecture: ReplayMemoryParameters, device: Optional[th.device] = None
+) -> ReplayMemory:
+    if architecture.sum_tree:
+        return SumTreeReplayMemory(architecture, device)
+    return ReplayMemory(architecture, device)
+
+
+def open_replay_memory(
+    directory: str, device: Optional[th.device] = None
+) -> ReplayMemory:
+    """
+    Read-only columnar memory saved by save_replay_memory()
+    Transitions stay on disk and are read when sampled: the memory can be sampled but not pushed to
+    """
+    state = load_replay_memory(directory, mmap_mode="r")
+    memory = get_replay_memory(
+        replace(
+            ReplayMemoryParameters(**state["architecture"]),
+            capacity=max(state["buffer_length"], 1),
+            columnar=True,
+        ),
+        device,
+    )
+    memory.load_state(state)
+    return memory
+
+
+def _stored_transition(storage: ColumnarTransitionStorage, idx: int) -> Transition:
+    return Transition(
+        observation=storage.observation[idx],
+        action=int(storage.action[idx]),
+        next_observation=storage.next_observation[idx],
+        reward=float(storage.reward[idx]),
+        done=bool(storage.done[idx]),
+    )
+
+
+def _copy_slots(state: Any, layout: Any, start: int, end: int) -> Any:
+    # Copies slots [start, end) of every array, trimmed to the shape it has in layout
+    if isinstance(layout, ArrayLayout):
+        return np.array(
+            state[(slice(start, end), *(slice(0, size) for size in layout.shape[1:]))]
+        )
+    if isinstance(layout, dict):
+        return {
+            key: _copy_slots(state[key], value, start, end)
+            for key, value in layout.items()
+        }
+    return layout
+
+
+def _write_slots(state: Any, slots: Any, start: int) -> None:
+    if isinstance(state, np.ndarray):
+        state[start : start + len(slots)] = slots
+    elif isinstance(state, dict):
+        for key, value in state.items():
+            _write_slots(value, slots[key], start)
@@ -0,0 +1,111 @@
+from collections import namedtuple
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch as th
+
+# Arrays of a saved state are replaced by this key, holding their .npy file relative to the directory
+ARRAY_KEY: str = "replay_memory_array"
+
+# Checkpoint entries holding this key are replay memories saved in the directory it names
+REPLAY_MEMORY_KEY: str = "replay_memory"
+
+STATE_FILE: str = "state.pt"
+
+# Shape and dtype of an array, see array_layout()
+ArrayLayout = namedtuple("ArrayLayout", ("shape", "dtype"))
+
+
+def replay_memory_reference(directory: str) -> Dict[str, str]:
+    return {REPLAY_MEMORY_KEY: directory}
+
+
+def save_replay_memory(state: Dict[str, Any], directory: str) -> None:
+    """
+    Writes ReplayMemory.get_state() to directory:
+    one contiguous .npy file per array, every other field in state.pt
+    Arrays allocated by allocate_replay_memory() in directory are already in place and only flushed
+    """
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    th.save(_save_arrays(state, directory, []), str(Path(directory, STATE_FILE)))
+
+
+def load_replay_memory(
+    directory: str, mmap_mode: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    State saved by save_replay_memory()
+    With mmap_mode="r" arrays are read-only memory maps of their file, see np.load()
+    """
+    return _load_arrays(th.load(str(Path(directory, STATE_FILE))), directory, mmap_mode)
+
+
+def array_layout(state: Any) -> Any:
+    """
+    Same structure as state with every array replaced by its ArrayLayout
+    """
+    if isinstance(state, np.ndarray) and not state.dtype.hasobject:
+        return ArrayLayout(shape=state.shape, dtype=state.dtype)
+    if isinstance(state, dict):
+        return {key: array_layout(value) for key, value in state.items()}
+    return state
+
+
+def allocate_replay_memory(layout: Any, directory: str) -> Any:
+    """
+    Same structure as layout with every ArrayLayout replaced by a writable memory map
+    of the .npy file save_replay_memory() would write it to.
+    Arrays can then be filled in place without holding the whole state in RAM.
+    """
+    return _allocate_arrays(layout, directory, [])
+
+
+def _array_file(keys: List[str]) -> str:
+    return "/".join(keys) + ".npy"
+
+
+def _save_arrays(state: Any, directory: str, keys: List[str]) -> Any:
+    if isinstance(state, np.ndarray) and not state.dtype.hasobject:
+        array_file = _array_file(keys)
+        if (
+            isinstance(state, np.memmap)
+            and Path(state.filename) == Path(directory, array_file).resolve()
+        ):
+            state.flush()
+        else:
+            Path(directory, array_file).parent.mkdir(parents=True, exist_ok=True)
+            np.save(str(Path(directory, array_file)), np.ascontiguousarray(state))
+        return {ARRAY_KEY: array_file}
+    if isinstance(state, dict):
+        return {
+            key: _save_arrays(value, directory, keys + [str(key)])
+            for key, value in state.items()
+        }
+    return state
+
+
+def _allocate_arrays(layout: Any, directory: str, keys: List[str]) -> Any:
+    if isinstance(layout, ArrayLayout):
+        array_file = Path(directory, _array_file(keys)).resolve()
+        array_file.parent.mkdir(parents=True, exist_ok=True)
+        return np.lib.format.open_memmap(
+            str(array_file), mode="w+", dtype=layout.dtype, shape=layout.shape
+        )
+    if isinstance(layout, dict):
+        return {
+            key: _allocate_arrays(value, directory, keys + [str(key)])
+            for key, value in layout.items()
+        }
+    return layout
+
+
+def _load_arrays(state: Any, directory: str, mmap_mode: Optional[str]) -> Any:
+    if isinstance(state, dict):
+        if set(state.keys()) == {ARRAY_KEY}:
+            return np.load(str(Path(directory, state[ARRAY_KEY])), mmap_mode=mmap_mode)
+        return {
+            key: _load_arrays(value, directory, mmap_mode)
+            for key, value in state.items()
+        }
+    return state
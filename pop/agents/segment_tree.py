@@ -0,0 +1,93 @@
+from typing import Callable, Union
+
+import numpy as np
+
+Indices = Union[int, np.ndarray]
+
+
+class SegmentTree(object):
+    """
+    Array-backed complete binary tree over a fixed number of leaves.
+    Node i has children 2i and 2i+1, the root is node 1 and leaves start at node capacity.
+    Every internal node stores operation(left_child, right_child).
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        operation: Callable[[np.ndarray, np.ndarray], np.ndarray],
+        neutral_element: float,
+    ) -> None:
+        # Capacity is rounded up to a power of two so that all leaves share the same depth
+        self.capacity: int = 1 << max(int(capacity) - 1, 0).bit_length()
+        self.operation = operation
+        self.neutral_element: float = neutral_element
+        self.tree: np.ndarray = np.full(
+            2 * self.capacity, neutral_element, dtype=np.float64
+        )
+
+    def __setitem__(self, idxs: Indices, values: Union[float, np.ndarray]) -> None:
+        nodes = np.atleast_1d(np.asarray(idxs, dtype=np.int64)) + self.capacity
+        self.tree[nodes] = values
+
+        # All leaves are on the same level: walk up one level at a time
+        # Recomputing parents from their children makes duplicated indices harmless
+        nodes = np.unique(nodes // 2)
+        while nodes.size > 0 and nodes[0] >= 1:
+            self.tree[nodes] = self.operation(
+                self.tree[2 * nodes], self.tree[2 * nodes + 1]
+            )
+            if nodes[0] == 1:
+                break
+            nodes = np.unique(nodes // 2)
+
+    def __getitem__(self, idxs: Indices) -> Union[float, np.ndarray]:
+        return self.tree[np.asarray(idxs, dtype=np.int64) + self.capacity]
+
+    def reduce(self) -> float:
+        return float(self.tree[1])
+
+    def clear(self) -> None:
+        self.tree.fill(self.neutral_element)
+
+
+class SumSegmentTree(SegmentTree):
+    def __init__(self, capacity: int) -> None:
+        super().__init__(capacity, np.add, 0.0)
+
+    def find_prefix_sum_index(self, prefix_sums: np.ndarray) -> np.ndarray:
+        """
+        For each prefix sum s find the highest index i such that sum(leaves[:i]) <= s.
+        The whole batch descends the tree together: O(batch_size * log(capacity)).
+        """
+        prefix_sums = np.array(prefix_sums, dtype=np.float64)
+        nodes = np.ones(prefix_sums.shape, dtype=np.int64)
+        for _ in range(self.capacity.bit_length() - 1):
+            left_children = 2 * nodes
+            left_sums = self.tree[left_children]
+            go_right = prefix_sums >= left_sums
+            prefix_sums = np.where(go_right, prefix_sums - left_sums, prefix_sums)
+            nodes = np.where(go_right, left_children + 1, left_children)
+        return nodes - self.capacity
+
+
+class MinSegmentTree(SegmentTree):
+    def __init__(self, capacity: int) -> None:
+        super().__init__(capacity, np.minimum, float("inf"))
+
+    def argmin(self) -> int:
+        # Follow the child holding the minimum, left child wins ties (same as np.argmin)
+        node = 1
+        while node < self.capacity:
+            left_child = 2 * node
+            node = (
+                left_child
+                if self.tree[left_child] <= self.tree[left_child + 1]
+                else left_child + 1
+            )
+        return node - self.capacity
+
+
+class MaxSegmentTree(SegmentTree):
+    def __init__(self, capacity: int) -> None:
+        super().__init__(capacity, np.maximum, float("-inf"))
@@ -0,0 +1,62 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from pop.agents.replay_buffer import ReplayMemory, SumTreeReplayMemory
+from pop.configs.agent_architecture import ReplayMemoryParameters
+
+ARCHITECTURE = ReplayMemoryParameters(
+    alpha=0.7, max_beta=0.4, min_beta=1.0, annihilation_rate=100, capacity=6
+)
+
+
+def _filled_memories() -> Tuple[ReplayMemory, SumTreeReplayMemory]:
+    memories = (ReplayMemory(ARCHITECTURE), SumTreeReplayMemory(ARCHITECTURE))
+    priorities: List[float] = [0.5, 2.0, 0.1, 1.5, 3.0, 0.7]
+    for memory in memories:
+        for step in range(len(priorities)):
+            memory.push(step, step % 3, step + 1, float(step), False)
+        memory.update_priorities(list(range(len(priorities))), priorities)
+        # The memory is full: the new transition evicts the lowest priority one
+        memory.push(10, 1, 11, 10.0, True)
+    return memories
+
+
+def test_sum_tree_evicts_as_list_memory():
+    memory, sum_tree_memory = _filled_memories()
+
+    assert list(sum_tree_memory.memory["priority"]) == list(memory.memory["priority"])
+    assert sum_tree_memory.memory["transition"][2].observation == 10
+    assert memory.memory["transition"][2].observation == 10
+    assert sum_tree_memory._min_priority_index() == memory._min_priority_index()
+    assert sum_tree_memory._max_priority() == memory._max_priority()
+
+
+def test_sum_tree_samples_as_list_memory():
+    memory, sum_tree_memory = _filled_memories()
+    priorities = memory.memory["priority"].astype(np.float64) ** ARCHITECTURE.alpha
+    probabilities = priorities / priorities.sum()
+
+    np.random.seed(0)
+    indices, transitions, weights = sum_tree_memory.sample(20000)
+    frequencies = np.bincount(indices, minlength=ARCHITECTURE.capacity) / 20000
+    assert np.allclose(frequencies, probabilities, atol=0.01)
+    assert all(
+        transition is sum_tree_memory.memory["transition"][idx]
+        for idx, transition in zip(indices, transitions)
+    )
+
+    # Importance sampling weights of the sampled indices match the list memory ones
+    expected_weights = (ARCHITECTURE.capacity * probabilities[indices]) ** -memory.beta
+    assert np.allclose(weights, expected_weights / expected_weights.max(), rtol=1e-4)
+
+
+def test_prefix_sums_find_the_list_index():
+    _, sum_tree_memory = _filled_memories()
+    leaves = sum_tree_memory.sum_tree[np.arange(ARCHITECTURE.capacity)]
+    prefix_sums = np.linspace(0, leaves.sum(), 101, endpoint=False)
+
+    expected = np.searchsorted(np.cumsum(leaves), prefix_sums, side="right")
+    assert list(sum_tree_memory.sum_tree.find_prefix_sum_index(prefix_sums)) == list(
+        expected
+    )
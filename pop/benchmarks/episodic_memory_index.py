@@ -0,0 +1,120 @@
+"""
+Episodic memory nearest neighbor benchmark.
+
+Compares the approximate (ivf) embedding memory with the exact one:
+latency of appending embeddings, latency of the K nearest neighbor query and recall of the K nearest neighbors.
+Embeddings are drawn from a mixture of gaussians, queries from the same mixture.
+
+Run from the repository root, with the same PYTHONPATH used for pop/main.py:
+    python -m pop.benchmarks.episodic_memory_index --size 100000 --lists 1024 --probes 8
+"""
+import argparse
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from pop.agents.exploration.embedding_memory import (
+    EmbeddingMemory,
+    get_embedding_memory,
+)
+
+
+def mixture_of_gaussians(
+    rng: np.random.Generator,
+    samples: int,
+    embedding_size: int,
+    centers: np.ndarray,
+    spread: float,
+) -> np.ndarray:
+    # -> (samples, embedding_size)
+    return (
+        centers[rng.integers(len(centers), size=samples)]
+        + spread * rng.standard_normal((samples, embedding_size))
+    ).astype(np.float32)
+
+
+def recall(approximate: np.ndarray, exact: np.ndarray) -> float:
+    # Fraction of the approximate K nearest distances which are among the exact K nearest ones
+    tolerance = 1e-4 * np.maximum(exact[:, -1:], 1)
+    return float(np.mean(approximate <= exact[:, -1:] + tolerance))
+
+
+def main(**kwargs):
+    rng = np.random.default_rng(kwargs["seed"])
+    centers = rng.standard_normal((kwargs["clusters"], kwargs["embedding_size"]))
+    embeddings = mixture_of_gaussians(
+        rng, kwargs["size"], kwargs["embedding_size"], centers, kwargs["spread"]
+    )
+    queries = mixture_of_gaussians(
+        rng, kwargs["queries"], kwargs["embedding_size"], centers, kwargs["spread"]
+    )
+
+    memories: Dict[str, EmbeddingMemory] = {
+        index: get_embedding_memory(
+            index=index,
+            size=kwargs["size"],
+            lists=kwargs["lists"],
+            probes=kwargs["probes"],
+        )
+        for index in ["exact", "ivf"]
+    }
+    append_latencies: Dict[str, float] = {}
+    query_latencies: Dict[str, List[float]] = {}
+    results: Dict[str, np.ndarray] = {}
+    for index, memory in memories.items():
+        start = time.perf_counter()
+        for embedding in embeddings:
+            memory.append(embedding)
+        append_latencies[index] = (time.perf_counter() - start) / len(embeddings)
+
+        query_latencies[index] = []
+        results[index] = np.empty((len(queries), kwargs["neighbors"]))
+        for position, query in enumerate(queries):
+            start = time.perf_counter()
+            results[index][position] = memory.k_nearest_squared_distances(
+                query, kwargs["neighbors"]
+            )[0]
+            query_latencies[index].append(time.perf_counter() - start)
+
+    print(
+        "Memory size: "
+        + str(kwargs["size"])
+        + ", embedding size: "
+        + str(kwargs["embedding_size"])
+        + ", neighbors: "
+        + str(kwargs["neighbors"])
+        + ", lists: "
+        + str(kwargs["lists"])
+        + ", probes: "
+        + str(kwargs["probes"])
+    )
+    for index in memories.keys():
+        print(
+            index.ljust(6)
+            + " append "
+            + "{:8.2f}".format(1e6 * append_latencies[index])
+            + " us, query mean "
+            + "{:8.2f}".format(1000 * np.mean(query_latencies[index]))
+            + " ms, median "
+            + "{:8.2f}".format(1000 * np.median(query_latencies[index]))
+            + " ms, recall "
+            + "{:.3f}".format(recall(results[index], results["exact"]))
+        )
+
+
+p = argparse.ArgumentParser()
+p.add_argument("--size", type=int, default=100000)
+p.add_argument("--embedding-size", type=int, default=64)
+p.add_argument("--neighbors", type=int, default=10)
+p.add_argument("--lists", type=int, default=1024)
+p.add_argument("--probes", type=int, default=8)
+p.add_argument("--clusters", type=int, default=256)
+p.add_argument("--spread", type=float, default=0.3)
+p.add_argument("--queries", type=int, default=200)
+p.add_argument("--seed", type=int, default=0)
+
+
+if __name__ == "__main__":
+    args = p.parse_args()
+    main(**vars(args))
@@ -0,0 +1,256 @@
+"""
+Learn step latency benchmark.
+
+Compares the former BaseGCNAgent.compute_loss (two dgl.batch calls, three forward passes)
+with the current one (one batched graph, one online and one target forward pass),
+both on the object replay memory and on the columnar one.
+
+Run from the repository root, with the same PYTHONPATH used for pop/main.py:
+    python -m pop.benchmarks.learn_step --architecture architectures/dpop_base.toml \
+        --feature-ranges l2rpn_sandbox_feature_ranges.json
+"""
+import argparse
+import json
+import random
+import time
+from dataclasses import replace
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import dgl
+import networkx as nx
+import numpy as np
+import torch as th
+import torch.nn as nn
+from torch import Tensor
+
+from pop.agents.base_gcn_agent import BaseGCNAgent
+from pop.agents.replay_buffer import Transition, get_replay_memory
+from pop.configs.agent_architecture import AgentArchitecture
+from pop.configs.architecture import Architecture
+
+
+class BenchmarkAgent(BaseGCNAgent):
+    """
+    Standalone agent, benchmarked without any Ray actor
+    """
+
+    @staticmethod
+    def factory(checkpoint: Dict[str, Any], **kwargs) -> "BenchmarkAgent":
+        agent = BenchmarkAgent(
+            agent_actions=checkpoint["agent_actions"],
+            node_features=checkpoint["node_features"],
+            edge_features=checkpoint["edge_features"],
+            architecture=(
+                AgentArchitecture(load_from_dict=checkpoint["architecture"])
+                if kwargs.get("architecture") is None
+                else kwargs["architecture"]
+            ),
+            training=bool(kwargs.get("training")),
+            name=checkpoint["name"],
+            device=checkpoint["device"],
+            log_dir=None,
+            tensorboard_dir=None,
+            feature_ranges=checkpoint["feature_ranges"],
+        )
+        agent.load_state(
+            optimizer_state=checkpoint["optimizer_state"],
+            q_network_state=checkpoint["q_network_state"],
+            target_network_state=checkpoint["target_network_state"],
+            memory=checkpoint["memory"],
+            exploration=checkpoint["exploration"],
+            alive_steps=checkpoint["alive_steps"],
+            train_steps=checkpoint["train_steps"],
+            learning_steps=checkpoint["learning_steps"],
+            reset_exploration=bool(kwargs.get("reset_exploration")),
+        )
+        return agent
+
+
+def legacy_compute_loss(
+    agent: BaseGCNAgent, transitions_batch: Transition, sampling_weights: Tensor
+) -> Tuple[Tensor, Tensor]:
+    observation_batch = dgl.batch(transitions_batch.observation)
+    next_observation_batch = dgl.batch(transitions_batch.next_observation)
+    actions = th.Tensor(transitions_batch.action).unsqueeze(1).type(th.int64)
+    rewards = th.Tensor(transitions_batch.reward).unsqueeze(1)
+
+    q_values = agent.q_network(observation_batch).gather(1, actions)
+    target_q_values = agent.target_network(next_observation_batch)
+    best_actions = (
+        th.argmax(agent.q_network(next_observation_batch), dim=1)
+        .unsqueeze(1)
+        .type(th.int64)
+    )
+    td_errors = rewards + agent.architecture.gamma * target_q_values.gather(
+        1, best_actions
+    )
+    loss = agent.loss_func(q_values * sampling_weights, td_errors * sampling_weights)
+    return loss, td_errors
+
+
+def legacy_learn(agent: BaseGCNAgent) -> float:
+    memory_indices, transitions, sampling_weights = agent.memory.sample(
+        agent.architecture.batch_size
+    )
+    loss, td_error = legacy_compute_loss(
+        agent, Transition(*zip(*transitions)), th.Tensor(sampling_weights)
+    )
+    agent.optimizer.zero_grad()
+    loss.backward()
+    nn.utils.clip_grad_norm_(agent.q_network.parameters(), max_norm=40)
+    agent.optimizer.step()
+    agent.memory.update_priorities(
+        memory_indices, td_error.abs().detach().numpy().flatten()
+    )
+    return loss.item()
+
+
+def random_graph(
+    agent: BaseGCNAgent,
+    feature_ranges: Dict[str, Dict[str, Tuple[float, float]]],
+    max_nodes: int,
+) -> dgl.DGLHeteroGraph:
+    graph: nx.Graph = nx.path_graph(random.randint(2, max_nodes))
+    graph.add_edges_from(
+        (u, v)
+        for u in graph.nodes
+        for v in graph.nodes
+        if u < v and random.random() < 0.2
+    )
+    for _, node_data in graph.nodes.data():
+        for feature in agent.node_features_schema:
+            node_data[feature] = random.uniform(
+                *feature_ranges["node_features"][feature]
+            )
+    for _, _, edge_data in graph.edges.data():
+        for feature in agent.edge_features_schema:
+            edge_data[feature] = random.uniform(
+                *feature_ranges["edge_features"][feature]
+            )
+    dgl_graph = BaseGCNAgent.from_networkx_to_dgl(
+        graph,
+        agent.node_features_schema,
+        agent.edge_features_schema,
+        device="cpu",
+    )
+    agent._cast_features_to_float32(dgl_graph)
+    return dgl_graph
+
+
+def time_learn_step(learn: Callable[[], Any], repetitions: int) -> List[float]:
+    learn()  # warm up
+    latencies = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        learn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main(**kwargs):
+    architecture_path = Path(kwargs["architecture"])
+    architecture = Architecture(
+        path=str(architecture_path),
+        network_architecture_implementation_folder_path=str(
+            Path(architecture_path.parents[0], "implementations")
+        ),
+        network_architecture_frame_folder_path=str(
+            Path(architecture_path.parents[0], "frames")
+        ),
+    )
+    feature_ranges = {
+        node_or_edge: {
+            feature_name: tuple(feature_range)
+            for feature_name, feature_range in features.items()
+        }
+        for node_or_edge, features in dict(
+            json.loads(Path(kwargs["feature_ranges"]).read_text())
+        ).items()
+    }
+
+    if kwargs["transitions"] < architecture.agent.batch_size:
+        # learn() does not sample before the memory holds one batch
+        raise Exception(
+            "Cannot benchmark learn steps with "
+            + str(kwargs["transitions"])
+            + " transitions, fewer than the batch size "
+            + str(architecture.agent.batch_size)
+        )
+
+    random.seed(kwargs["seed"])
+    np.random.seed(kwargs["seed"])
+    th.manual_seed(kwargs["seed"])
+
+    agent = BenchmarkAgent(
+        agent_actions=kwargs["actions"],
+        node_features=architecture.pop.node_features,
+        edge_features=architecture.pop.edge_features,
+        architecture=architecture.agent,
+        training=True,
+        name="benchmark_agent",
+        device="cpu",
+        log_dir=None,
+        tensorboard_dir=None,
+        feature_ranges=feature_ranges,
+    )
+
+    transitions = [
+        Transition(
+            observation=random_graph(agent, feature_ranges, kwargs["max_nodes"]),
+            action=random.randrange(kwargs["actions"]),
+            next_observation=random_graph(agent, feature_ranges, kwargs["max_nodes"]),
+            reward=random.random(),
+            done=False,
+        )
+        for _ in range(kwargs["transitions"])
+    ]
+
+    results: Dict[str, List[float]] = {}
+    for name, columnar, learn in [
+        ("before (object memory)", False, lambda: legacy_learn(agent)),
+        ("after (object memory)", False, agent.learn),
+        ("after (columnar memory)", True, agent.learn),
+    ]:
+        agent.memory = get_replay_memory(
+            replace(
+                architecture.agent.replay_memory,
+                capacity=len(transitions),
+                columnar=columnar,
+            ),
+            agent.device,
+        )
+        for transition in transitions:
+            agent.memory.push(*transition)
+        results[name] = time_learn_step(learn, kwargs["repetitions"])
+
+    print(
+        "Batch size: "
+        + str(architecture.agent.batch_size)
+        + ", repetitions: "
+        + str(kwargs["repetitions"])
+    )
+    for name, latencies in results.items():
+        print(
+            name.ljust(25)
+            + " mean "
+            + "{:8.2f}".format(1000 * np.mean(latencies))
+            + " ms, median "
+            + "{:8.2f}".format(1000 * np.median(latencies))
+            + " ms"
+        )
+
+
+p = argparse.ArgumentParser()
+p.add_argument("--architecture", type=str, required=True)
+p.add_argument("--feature-ranges", type=str, required=True)
+p.add_argument("--actions", type=int, default=10)
+p.add_argument("--max-nodes", type=int, default=10)
+p.add_argument("--transitions", type=int, default=1000)
+p.add_argument("--repetitions", type=int, default=50)
+p.add_argument("--seed", type=int, default=0)
+
+
+if __name__ == "__main__":
+    args = p.parse_args()
+    main(**vars(args))
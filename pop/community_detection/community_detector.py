@@ -1,17 +1,177 @@
 from random import Random, sample
-from typing import List, Set, Tuple, Optional, FrozenSet
+from typing import Dict, List, Set, Tuple, Optional, FrozenSet
 
 import networkx as nx
 import networkx.linalg as nx_linalg
 from networkx.algorithms.community.quality import NotAPartition
 import numpy as np
+import pylru
 from pop.community_detection.louvain import louvain_communities
-from pop.community_detection.power_supply_modularity import belong_to_same_community
 
 
 Community = FrozenSet[int]
 
 
+class CommunityIndex:
+    """
+    Node to community index over a partition of a graph.
+    Community aggregates are computed on first use and reused afterwards.
+    """
+
+    def __init__(self, graph: nx.Graph, communities: List[Set[int]]) -> None:
+        self.graph: nx.Graph = graph
+        self.communities: List[Set[int]] = communities
+        self.node_to_community: Dict[int, int] = {}
+        for community_id, community in enumerate(communities):
+            for node in community:
+                self.node_to_community.setdefault(node, community_id)
+
+        self._degrees: Dict[int, int] = {}
+        self._coherences: Dict[int, int] = {}
+        self._edges: Optional[int] = None
+        self._position: Optional[Dict[int, int]] = None
+
+    def community_id(self, node: int) -> int:
+        if node not in self.node_to_community:
+            raise Exception("Could not find " + str(node) + " in any community")
+        return self.node_to_community[node]
+
+    def get_community(self, node: int) -> Set[int]:
+        return self.communities[self.community_id(node)]
+
+    def same_community(self, node1: int, node2: int) -> bool:
+        community = self.node_to_community.get(node1)
+        return community is not None and community == self.node_to_community.get(node2)
+
+    def community_degree(self, community_id: int) -> int:
+        if community_id not in self._degrees:
+            self._degrees[community_id] = CommunityDetector.community_degree(
+                self.graph, self.communities[community_id]
+            )
+        return self._degrees[community_id]
+
+    def community_coherence(self, community_id: int) -> int:
+        # Same value as CommunityDetector.community_coherence(): the self loops of the community
+        if community_id not in self._coherences:
+            self._coherences[community_id] = sum(
+                self.graph.edges[node, node].get("weight", 1)
+                for node in self.communities[community_id]
+                if self.graph.has_edge(node, node)
+            )
+        return self._coherences[community_id]
+
+    @property
+    def edges(self) -> int:
+        if self._edges is None:
+            self._edges = len(self.graph.edges)
+        return self._edges
+
+    @property
+    def position(self) -> Dict[int, int]:
+        # Built once for the graph, see incident_edges()
+        if self._position is None:
+            self._position = node_positions(self.graph)
+        return self._position
+
+    def next_snapshot(
+        self,
+        graph: nx.Graph,
+        communities: List[FrozenSet[int]],
+        added_edges: Set[Tuple[int, int]],
+        removed_edges: Set[Tuple[int, int]],
+    ) -> "CommunityIndex":
+        """
+        Index of a partition of the next snapshot of the graph, given the edge_changes() between them.
+        Aggregates of the communities left untouched by the changed edges are carried over,
+        the others are computed on first use.
+        """
+        index = CommunityIndex(graph, communities)
+        if self._edges is not None:
+            index._edges = self._edges + len(added_edges) - len(removed_edges)
+
+        changed_nodes: Set[int] = {
+            node for edge in added_edges.union(removed_edges) for node in edge[:2]
+        }
+        for community_id, community in enumerate(communities):
+            if not community or not changed_nodes.isdisjoint(community):
+                continue
+            old_community_id: Optional[int] = self.node_to_community.get(
+                next(iter(community))
+            )
+            if (
+                old_community_id is None
+                or self.communities[old_community_id] != community
+            ):
+                continue
+            if old_community_id in self._degrees:
+                index._degrees[community_id] = self._degrees[old_community_id]
+            if old_community_id in self._coherences:
+                index._coherences[community_id] = self._coherences[old_community_id]
+        return index
+
+
+def node_positions(graph: nx.Graph) -> Dict[int, int]:
+    return {node: i for i, node in enumerate(graph.nodes)}
+
+
+def edge_changes(
+    graph_t: nx.Graph, graph_t1: nx.Graph
+) -> Tuple[Set[Tuple[int, int]], Set[Tuple[int, int]]]:
+    """
+    Same as (set(graph_t1.edges - graph_t.edges), set(graph_t.edges - graph_t1.edges))
+    Undirected graphs are compared node by node, only nodes whose neighbors changed are visited.
+    """
+    if graph_t.is_directed() or graph_t.is_multigraph() or graph_t1.is_multigraph():
+        return set(graph_t1.edges - graph_t.edges), set(graph_t.edges - graph_t1.edges)
+    return _missing_edges(graph_t1, graph_t), _missing_edges(graph_t, graph_t1)
+
+
+def _missing_edges(graph: nx.Graph, other: nx.Graph) -> Set[Tuple[int, int]]:
+    # Edges of graph missing from other, oriented as graph.edges reports them
+    missing_edges: Set[Tuple[int, int]] = set()
+    position: Optional[Dict[int, int]] = None
+    # adjacency() yields plain dictionaries: their keys are compared without a Python loop
+    other_adjacency: Dict[int, Dict[int, dict]] = dict(other.adjacency())
+    for node, neighbors in graph.adjacency():
+        other_neighbors = other_adjacency.get(node, {})
+        if neighbors.keys() == other_neighbors.keys():
+            continue
+        if position is None:
+            position = node_positions(graph)
+        # An edge is reported by its extremity which comes first in the node order
+        missing_edges.update(
+            (node, neighbor)
+            for neighbor in neighbors.keys() - other_neighbors.keys()
+            if position[node] <= position[neighbor]
+        )
+    return missing_edges
+
+
+def incident_edges(
+    graph: nx.Graph, node: int, position: Optional[Dict[int, int]] = None
+) -> List[Tuple[int, int]]:
+    """
+    Same as [e for e in graph.edges if node in e and e[0] != e[1]]
+    without going through every edge of the graph.
+    position is node_positions(graph), pass it when calling this for several nodes.
+    """
+    if position is None:
+        position = node_positions(graph)
+    neighbors = [neighbor for neighbor in graph.adj[node] if neighbor != node]
+    # An edge is reported by its extremity which comes first in the node order
+    return [
+        (neighbor, node)
+        for neighbor in sorted(
+            (neighbor for neighbor in neighbors if position[neighbor] < position[node]),
+            key=position.__getitem__,
+        )
+    ] + [
+        (node, neighbor)
+        for neighbor in neighbors
+        if position[neighbor] > position[node]
+    ]
+
+
 class CommunityDetector:
     def __init__(
         self,
@@ -19,12 +179,18 @@ class CommunityDetector:
         resolution: float = 1.0,
         threshold: float = 1e-6,
         enable_power_supply_modularity=False,
+        index_cache_size: int = 4,
     ) -> None:
         self.resolution: float = resolution
         self.threshold: float = threshold
         self.seed: int = seed
         self.enable_power_supply_modularity: bool = enable_power_supply_modularity
 
+        # id(partition) -> (partition, index) for the partitions returned by dynamo()
+        # Each is handed back as comm_t of the next snapshot, whose intermediate phase reuses its index
+        # One partition per environment acting at once is alive
+        self.indexes: pylru.lrucache = pylru.lrucache(size=index_cache_size)
+
     @staticmethod
     def community_coherence(graph: nx.Graph, community: Set[int]) -> int:
         adjacency_matrix = nx_linalg.adjacency_matrix(graph)
@@ -42,7 +208,14 @@ class CommunityDetector:
         raise Exception("Could not find " + str(node) + " in any community")
 
     def initialize_intermediate_community_structure(
-        self, graph_t: nx.Graph, graph_t1: nx.Graph, comm_t: List[Set[int]]
+        self,
+        graph_t: nx.Graph,
+        graph_t1: nx.Graph,
+        comm_t: List[Set[int]],
+        index: Optional[CommunityIndex] = None,
+        changed_edges: Optional[
+            Tuple[Set[Tuple[int, int]], Set[Tuple[int, int]]]
+        ] = None,
     ) -> Tuple[Set[Set[int]], Set[Tuple[int, int]]]:
         """
         Takes C_t, community structure at time t, and modifies it by selecting singletons and two-vertices
@@ -51,6 +224,8 @@ class CommunityDetector:
         :param graph_t: graph at previous timestep
         :param graph_t1: current graph
         :param comm_t: community structure at previous timestep
+        :param index: CommunityIndex of comm_t over graph_t, built if not given
+        :param changed_edges: edge_changes(graph_t, graph_t1), computed if not given
         :return
         - C_1: a set of communities to be separated into singleton communities
         - C_2: a set of two-vertices communities to be created
@@ -58,37 +233,37 @@ class CommunityDetector:
         singleton_communities: set = set()  # C1
         two_vertices_communities: set = set()  # C2
 
-        added_edges: set = set(graph_t1.edges - graph_t.edges)
-        removed_edges: set = set(graph_t.edges - graph_t1.edges)
+        if changed_edges is None:
+            changed_edges = edge_changes(graph_t, graph_t1)
+        added_edges, removed_edges = changed_edges
 
         added_nodes: set = set(graph_t1.nodes - graph_t.nodes)
         removed_nodes: set = set(graph_t.nodes - graph_t1.nodes)
+        changed_nodes: set = removed_nodes.union(added_nodes)
+
+        # Every lookup below only touches the communities around the changed edges
+        if index is None:
+            index = CommunityIndex(graph_t, comm_t)
+        position_t1: Optional[Dict[int, int]] = None
 
         for edge in added_edges.union(removed_edges):
             for k in edge:
                 if k in removed_nodes:
-                    singleton_communities.add(frozenset(self.get_community(k, comm_t)))
-                    for old_edge in [
-                        e
-                        for e in graph_t.edges
-                        if ((e[0] == k or e[1] == k) and e[0] != e[1])
-                    ]:
+                    singleton_communities.add(frozenset(index.get_community(k)))
+                    for old_edge in incident_edges(graph_t, k, index.position):
                         singleton_communities.add(
                             frozenset(
-                                self.get_community(
-                                    old_edge[1] if old_edge[1] != k else old_edge[0],
-                                    comm_t,
+                                index.get_community(
+                                    old_edge[1] if old_edge[1] != k else old_edge[0]
                                 )
                             )
                         )
                 if k in added_nodes:
                     singleton_communities.add(frozenset({k}))
 
-                    new_edges = [
-                        e
-                        for e in graph_t1.edges
-                        if ((e[0] == k or e[1] == k) and e[0] != e[1])
-                    ]
+                    if position_t1 is None:
+                        position_t1 = node_positions(graph_t1)
+                    new_edges = incident_edges(graph_t1, k, position_t1)
                     if new_edges:
                         # new_edges may be empty and induce an exception
                         # sampling is used to handle the unweighted case
@@ -97,58 +272,46 @@ class CommunityDetector:
                     for new_edge in new_edges:
                         singleton_communities.add(
                             frozenset(
-                                self.get_community(
-                                    new_edge[1] if new_edge[1] != k else new_edge[0],
-                                    comm_t,
+                                index.get_community(
+                                    new_edge[1] if new_edge[1] != k else new_edge[0]
                                 )
                             )
                         )
-            if edge[0] not in removed_nodes.union(added_nodes) and edge[
-                1
-            ] not in removed_nodes.union(added_nodes):
+            if edge[0] not in changed_nodes and edge[1] not in changed_nodes:
                 if edge in removed_edges:
-                    if belong_to_same_community(edge[0], edge[1], comm_t):
+                    if index.same_community(edge[0], edge[1]):
                         singleton_communities.add(
-                            frozenset(self.get_community(edge[0], comm_t))
+                            frozenset(index.get_community(edge[0]))
                         )  # edge[0] and edge[1] belong to same community
                         for extremity in edge:
                             for neighbor in graph_t.neighbors(extremity):
                                 singleton_communities.add(
-                                    frozenset(self.get_community(neighbor, comm_t))
+                                    frozenset(index.get_community(neighbor))
                                 )
 
                 if edge in added_edges:
-                    if belong_to_same_community(edge[0], edge[1], comm_t):
+                    if index.same_community(edge[0], edge[1]):
                         two_vertices_communities.add(edge)
                         singleton_communities.add(
-                            frozenset(self.get_community(edge[0], comm_t))
+                            frozenset(index.get_community(edge[0]))
                         )
                     else:
-                        edge_origin_community = self.get_community(edge[0], comm_t)
-                        edge_extremity_community = self.get_community(edge[1], comm_t)
+                        edge_origin_community = index.community_id(edge[0])
+                        edge_extremity_community = index.community_id(edge[1])
                         delta_w = 1  # we deal only with unweighted edges
-                        merged_community = set.union(
-                            edge_origin_community,
-                            edge_extremity_community,
-                        )
-                        coherence_0 = self.community_coherence(
-                            graph_t, edge_origin_community
-                        )
-                        coherence_1 = self.community_coherence(
-                            graph_t, edge_extremity_community
-                        )
-                        coherence_merged = self.community_coherence(
-                            graph_t, merged_community
+                        coherence_0 = index.community_coherence(edge_origin_community)
+                        coherence_1 = index.community_coherence(
+                            edge_extremity_community
                         )
+                        # Communities are disjoint, the coherence of their union is the sum
+                        coherence_merged = coherence_0 + coherence_1
 
-                        degree_0 = self.community_degree(graph_t, edge_origin_community)
-                        degree_1 = self.community_degree(
-                            graph_t, edge_extremity_community
-                        )
+                        degree_0 = index.community_degree(edge_origin_community)
+                        degree_1 = index.community_degree(edge_extremity_community)
 
                         coherence_delta = coherence_0 + coherence_1 - coherence_merged
                         full_degree = degree_0 + degree_1
-                        m = len(graph_t.edges)
+                        m = index.edges
 
                         delta_1 = 2 * m - coherence_delta - full_degree
                         delta_2 = m * coherence_delta + degree_0 * degree_1
@@ -156,9 +319,11 @@ class CommunityDetector:
                         if 2 * delta_w + delta_1 > np.sqrt(
                             delta_1**2 + 4 * delta_2**2
                         ):
-                            singleton_communities.add(frozenset(edge_origin_community))
                             singleton_communities.add(
-                                frozenset(edge_extremity_community)
+                                frozenset(comm_t[edge_origin_community])
+                            )
+                            singleton_communities.add(
+                                frozenset(comm_t[edge_extremity_community])
                             )
                             two_vertices_communities.add(edge)
 
@@ -179,7 +344,7 @@ class CommunityDetector:
           community structure until the modularity gain is negligible
         """
         if not comm_t and not graph_t1:
-            return [
+            communities = [
                 frozenset(community)
                 for community in louvain_communities(
                     graph_t,
@@ -193,16 +358,38 @@ class CommunityDetector:
                     beta=beta,
                 )
             ]
+            self.indexes[id(communities)] = (
+                communities,
+                CommunityIndex(graph_t, communities),
+            )
+            return communities
         if (not comm_t and graph_t1) or (comm_t and not graph_t1):
             raise Exception(
                 "comm_t and graph_t1 must be either both None or both not None"
             )
 
+        # comm_t returned by the last dynamo() call is a partition of its graph_t1, that is graph_t
+        index: Optional[CommunityIndex] = None
+        if id(comm_t) in self.indexes:
+            cached_comm_t, cached_index = self.indexes[id(comm_t)]
+            if (
+                cached_comm_t is comm_t
+                and len(cached_index.graph) == len(graph_t)
+                and cached_index.graph.number_of_edges() == graph_t.number_of_edges()
+            ):
+                index = cached_index
+
         comm_t = [set(community) for community in comm_t]
+        if index is None:
+            index = CommunityIndex(graph_t, comm_t)
+        # Shared by both phases and by the index of the next snapshot
+        changed_edges = edge_changes(graph_t, graph_t1)
         (
             singleton_communities,
             two_vertices_communities,
-        ) = self.initialize_intermediate_community_structure(graph_t, graph_t1, comm_t)
+        ) = self.initialize_intermediate_community_structure(
+            graph_t, graph_t1, comm_t, index, changed_edges
+        )
         comm_t1: List[Set[int]] = [community.copy() for community in comm_t]
 
         comm_t1 = list(
@@ -219,17 +406,14 @@ class CommunityDetector:
                     # in which a singleton community of a non-existing node would be added otherwise
                     comm_t1.append({node})
 
-        comm_t1 = list(
-            filter(
-                lambda community: all(
-                    [
-                        comm[0] not in community and comm[1] not in community
-                        for comm in two_vertices_communities
-                    ]
-                ),
-                comm_t1,
-            ),
-        )
+        two_vertices_nodes: Set[int] = {
+            node for comm in two_vertices_communities for node in comm[:2]
+        }
+        comm_t1 = [
+            community
+            for community in comm_t1
+            if two_vertices_nodes.isdisjoint(community)
+        ]
 
         # Here we deal with a case in which two intersecting two-vertices communities exists e.g. (8, 13), (12, 13)
         # Which would yield an overlapping community structure (not admissible in this context)
@@ -246,12 +430,11 @@ class CommunityDetector:
 
         # Isolated nodes must be manually added
         # Once added they are carried through so we must avoid re-
+        assigned_nodes: Set[int] = set().union(*comm_t1)
         for isolated_node in nx.isolates(graph_t1):
-            node_community = [
-                community for community in comm_t1 if isolated_node in community
-            ]
-            if not node_community:
+            if isolated_node not in assigned_nodes:
                 comm_t1.append({isolated_node})
+                assigned_nodes.add(isolated_node)
 
         # Isolated nodes must be manually removed too
         for isolated_node in filter(
@@ -259,24 +442,11 @@ class CommunityDetector:
         ):
             comm_t1.remove({isolated_node})
 
-        for node in graph_t1.nodes:
-            node_community = [community for community in comm_t1 if node in community]
-            if len(node_community) > 1:
-                largest_community = node_community[
-                    np.argmax([len(community) for community in node_community])
-                ]
-                node_community.remove(largest_community)
-                comm_t1 = [
-                    community
-                    for community in comm_t1
-                    if community not in node_community
-                ]
-
-        return [
+        communities = [
             frozenset(community)
             for community in louvain_communities(
                 graph_t1,
-                comm_t1,
+                self.remove_overlaps(graph_t1, comm_t1),
                 weight=None,
                 resolution=self.resolution,
                 threshold=self.threshold,
@@ -286,3 +456,51 @@ class CommunityDetector:
                 beta=beta,
             )
         ]
+        self.indexes[id(communities)] = (
+            communities,
+            index.next_snapshot(graph_t1, communities, *changed_edges),
+        )
+        return communities
+
+    @staticmethod
+    def remove_overlaps(graph: nx.Graph, communities: List[Set[int]]) -> List[Set[int]]:
+        """
+        A node found in several communities is kept in the largest one,
+        the other communities containing it are dropped.
+        """
+        node_to_communities: Dict[int, List[int]] = {}
+        for community_id, community in enumerate(communities):
+            for node in community:
+                node_to_communities.setdefault(node, []).append(community_id)
+        kept = [True] * len(communities)
+
+        for node in graph.nodes:
+            node_community = [
+                community_id
+                for community_id in node_to_communities.get(node, [])
+                if kept[community_id]
+            ]
+            if len(node_community) > 1:
+                largest_community = node_community[
+                    np.argmax([len(communities[i]) for i in node_community])
+                ]
+                # Communities equal to one of the others are dropped, as with list.remove()
+                node_community.remove(
+                    next(
+                        i
+                        for i in node_community
+                        if communities[i] == communities[largest_community]
+                    )
+                )
+                for community_id in node_to_communities[node]:
+                    if kept[community_id] and any(
+                        communities[community_id] == communities[i]
+                        for i in node_community
+                    ):
+                        kept[community_id] = False
+
+        return [
+            community
+            for community_id, community in enumerate(communities)
+            if kept[community_id]
+        ]
@@ -1,12 +1,143 @@
 # Adapted from networkx implementation
-from collections import deque, defaultdict
-from typing import List, Set
+from collections import deque
+from typing import Dict, Hashable, List, NamedTuple, Optional, Set, Tuple
 
 import networkx as nx
-from networkx.algorithms.community import modularity
+import numpy as np
+from networkx.algorithms.community.quality import NotAPartition
 from pop.community_detection.power_supply_modularity import power_supply_modularity
 
 
+class LouvainGraph(NamedTuple):
+    """
+    Weighted graph in CSR format over the integer nodes 0..num_nodes-1.
+    Neighbours of each node are stored in the adjacency order of the networkx graph
+    the original implementation would have built, so that ties are broken the same way.
+    """
+
+    indptr: np.ndarray
+    indices: np.ndarray
+    weights: np.ndarray
+    # Original nodes merged into each node
+    nodes: List[Set[Hashable]]
+    is_directed: bool
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.indptr) - 1
+
+    def out_degrees(self) -> np.ndarray:
+        # -> (nodes)
+        rows = np.repeat(np.arange(self.num_nodes), np.diff(self.indptr))
+        degrees = np.zeros(self.num_nodes)
+        np.add.at(degrees, rows, self.weights)
+        if not self.is_directed:
+            # Self loops count twice as in networkx
+            self_loops = rows == self.indices
+            np.add.at(degrees, rows[self_loops], self.weights[self_loops])
+        return degrees
+
+    def in_degrees(self) -> np.ndarray:
+        # -> (nodes)
+        if not self.is_directed:
+            return self.out_degrees()
+        degrees = np.zeros(self.num_nodes)
+        np.add.at(degrees, self.indices, self.weights)
+        return degrees
+
+    def degrees(self) -> np.ndarray:
+        # -> (nodes)
+        if not self.is_directed:
+            return self.out_degrees()
+        return self.out_degrees() + self.in_degrees()
+
+    def size(self) -> float:
+        # Same as networkx.Graph.size(weight="weight")
+        return sum(self.degrees().tolist()) / 2
+
+    def edges(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Edges in the networkx iteration order, each undirected edge once
+        # -> (edges), (edges), (edges)
+        rows = np.repeat(np.arange(self.num_nodes), np.diff(self.indptr))
+        keep = (
+            np.ones(len(rows), dtype=bool) if self.is_directed else self.indices >= rows
+        )
+        return rows[keep], self.indices[keep], self.weights[keep]
+
+
+def _build_louvain_graph(
+    num_nodes: int,
+    src: np.ndarray,
+    dst: np.ndarray,
+    weights: np.ndarray,
+    nodes: List[Set[Hashable]],
+    is_directed: bool,
+) -> LouvainGraph:
+    """
+    Same graph as adding the weighted edges one by one to an empty networkx graph,
+    summing the weights of repeated edges.
+    """
+    edges = len(src)
+    if is_directed:
+        event_src, event_dst = src, dst
+        event_edge = np.arange(edges)
+        pair_key = src * num_nodes + dst
+    else:
+        # Each edge adds the neighbour to both extremities, self loops only once
+        event_src = np.stack((src, dst), axis=1).ravel()
+        event_dst = np.stack((dst, src), axis=1).ravel()
+        event_edge = np.repeat(np.arange(edges), 2)
+        not_repeated = np.ones(2 * edges, dtype=bool)
+        not_repeated[1::2] = src != dst
+        event_src = event_src[not_repeated]
+        event_dst = event_dst[not_repeated]
+        event_edge = event_edge[not_repeated]
+        pair_key = np.minimum(src, dst) * num_nodes + np.maximum(src, dst)
+
+    # Repeated edges sum their weights in insertion order
+    pair_keys, edge_pair = np.unique(pair_key, return_inverse=True)
+    pair_weights = np.zeros(len(pair_keys))
+    np.add.at(pair_weights, edge_pair, weights)
+
+    # A neighbour is placed at the end of the adjacency the first time it is added
+    _, first_event = np.unique(event_src * num_nodes + event_dst, return_index=True)
+    adjacency_order = np.lexsort((first_event, event_src[first_event]))
+    neighbour_event = first_event[adjacency_order]
+
+    return LouvainGraph(
+        indptr=np.concatenate(
+            ([0], np.cumsum(np.bincount(event_src, minlength=num_nodes)))
+        )
+        if len(neighbour_event) == 0
+        else np.concatenate(
+            (
+                [0],
+                np.cumsum(np.bincount(event_src[neighbour_event], minlength=num_nodes)),
+            )
+        ),
+        indices=event_dst[neighbour_event],
+        weights=pair_weights[edge_pair[event_edge[neighbour_event]]],
+        nodes=nodes,
+        is_directed=is_directed,
+    )
+
+
+def _louvain_graph_from_networkx(G, weight) -> Tuple[LouvainGraph, Dict[Hashable, int]]:
+    node_position: Dict[Hashable, int] = {node: i for i, node in enumerate(G)}
+    edges = list(G.edges(data=weight, default=1))
+    return (
+        _build_louvain_graph(
+            len(node_position),
+            np.array([node_position[u] for u, _, _ in edges], dtype=np.int64),
+            np.array([node_position[v] for _, v, _ in edges], dtype=np.int64),
+            np.array([wt for _, _, wt in edges], dtype=np.float64),
+            [{node} for node in node_position.keys()],
+            G.is_directed(),
+        ),
+        node_position,
+    )
+
+
 def louvain_communities(
     G,
     partition: List[Set[int]],
@@ -47,20 +178,26 @@ def louvain_partitions(
 ):
 
     partition = partition
-    if enable_power_supply_modularity:
-        mod = power_supply_modularity(G, partition, alpha, beta)
-    else:
-        mod = modularity(G, partition, resolution=resolution, weight=weight)
+    if not _is_partition(G, partition):
+        raise NotAPartition(G, partition)
     is_directed = G.is_directed()
     if G.is_multigraph():
-        graph = _convert_multigraph(G, weight, is_directed)
+        graph, node_position = _louvain_graph_from_networkx(
+            _convert_multigraph(G, weight, is_directed), "weight"
+        )
+    else:
+        graph, node_position = _louvain_graph_from_networkx(G, weight)
+    if enable_power_supply_modularity:
+        mod = power_supply_modularity(G, partition, alpha, beta)
     else:
-        graph = G.__class__()
-        graph.add_nodes_from(G)
-        graph.add_weighted_edges_from(G.edges(data=weight, default=1))
+        mod = _modularity(
+            graph,
+            [[node_position[node] for node in part] for part in partition],
+            resolution=resolution,
+        )
 
-    m = graph.size(weight="weight")
-    graph = _gen_graph(graph, partition)
+    m = graph.size()
+    graph = _gen_graph(graph, partition, node_position)
     partition, inner_partition, improvement = _one_level(
         graph, m, partition, resolution, is_directed, seed
     )
@@ -70,9 +207,7 @@ def louvain_partitions(
         if enable_power_supply_modularity:
             new_mod = power_supply_modularity(G, inner_partition, alpha, beta)
         else:
-            new_mod = modularity(
-                graph, inner_partition, resolution=resolution, weight="weight"
-            )
+            new_mod = _modularity(graph, inner_partition, resolution=resolution)
         if new_mod - mod <= threshold:
             return
         mod = new_mod
@@ -82,11 +217,13 @@ def louvain_partitions(
         )
 
 
-def _one_level(G, m, partition, resolution=1, is_directed=False, seed=None):
+def _one_level(
+    G: LouvainGraph, m, partition, resolution=1, is_directed=False, seed=None
+):
     """Calculate one level of the Louvain partitions tree
     Parameters
     ----------
-    G : NetworkX Graph/DiGraph
+    G : LouvainGraph
         The graph from which to detect communities
     m : number
         The size of the graph `G`.
@@ -100,36 +237,84 @@ def _one_level(G, m, partition, resolution=1, is_directed=False, seed=None):
         Indicator of random number generation state.
         See :ref:`Randomness<randomness>`.
     """
-    node2com = {u: i for i, u in enumerate(G.nodes())}
-    inner_partition = [{u} for u in G.nodes()]
-    if is_directed:
-        in_degrees = dict(G.in_degree(weight="weight"))
-        out_degrees = dict(G.out_degree(weight="weight"))
-        Stot_in = [deg for deg in in_degrees.values()]
-        Stot_out = [deg for deg in out_degrees.values()]
-    else:
-        degrees = dict(G.degree(weight="weight"))
-        Stot = [deg for deg in degrees.values()]
-    nbrs = {u: {v: data["weight"] for v, data in G[u].items() if v != u} for u in G}
-    rand_nodes = list(G.nodes)
+    inner_partition = [{u} for u in range(G.num_nodes)]
+    rand_nodes = list(range(G.num_nodes))
     seed.shuffle(rand_nodes)
+    moves = _move_nodes(
+        G.indptr.tolist(),
+        G.indices.tolist(),
+        G.weights.tolist(),
+        G.out_degrees().tolist(),
+        G.in_degrees().tolist(),
+        rand_nodes,
+        m,
+        resolution,
+        is_directed,
+    )
+    # Moves are replayed in order so that the sets are built as in networkx
+    for u, old_com, best_com in moves:
+        com = G.nodes[u]
+        partition[old_com].difference_update(com)
+        inner_partition[old_com].remove(u)
+        partition[best_com].update(com)
+        inner_partition[best_com].add(u)
+    improvement = len(moves) > 0
+    partition = list(filter(len, partition))
+    inner_partition = list(filter(len, inner_partition))
+    return partition, inner_partition, improvement
+
+
+def _move_nodes(
+    indptr,
+    indices,
+    weights,
+    out_degrees,
+    in_degrees,
+    rand_nodes,
+    m,
+    resolution,
+    is_directed,
+) -> List[Tuple[int, int, int]]:
+    """Local moving phase of Louvain on flat CSR sequences.
+    Only scalar loops over flat sequences are used so that the function can be JIT compiled.
+    Returns the moves (node, old community, new community) in the order they happened.
+    """
+    num_nodes = len(out_degrees)
+    node2com = list(range(num_nodes))
+    Stot_out = list(out_degrees)
+    Stot_in = list(in_degrees)
+    # Neighbour community weights, communities are kept in order of appearance
+    weights2com = [0.0] * num_nodes
+    seen = [False] * num_nodes
+    nbr_coms = [0] * num_nodes
+    moves = []
     nb_moves = 1
-    improvement = False
     while nb_moves > 0:
         nb_moves = 0
         for u in rand_nodes:
             best_mod = 0
             best_com = node2com[u]
-            weights2com = _neighbor_weights(nbrs[u], node2com)
+            nb_nbr_coms = 0
+            for i in range(indptr[u], indptr[u + 1]):
+                v = indices[i]
+                if v == u:
+                    continue
+                com = node2com[v]
+                if not seen[com]:
+                    seen[com] = True
+                    weights2com[com] = 0.0
+                    nbr_coms[nb_nbr_coms] = com
+                    nb_nbr_coms += 1
+                weights2com[com] += weights[i]
+            out_degree = out_degrees[u]
+            in_degree = in_degrees[u]
+            Stot_out[best_com] -= out_degree
             if is_directed:
-                in_degree = in_degrees[u]
-                out_degree = out_degrees[u]
                 Stot_in[best_com] -= in_degree
-                Stot_out[best_com] -= out_degree
-            else:
-                degree = degrees[u]
-                Stot[best_com] -= degree
-            for nbr_com, wt in weights2com.items():
+            for i in range(nb_nbr_coms):
+                nbr_com = nbr_coms[i]
+                wt = weights2com[nbr_com]
+                seen[nbr_com] = False
                 if is_directed:
                     gain = (
                         wt
@@ -141,62 +326,71 @@ def _one_level(G, m, partition, resolution=1, is_directed=False, seed=None):
                         / m
                     )
                 else:
-                    gain = 2 * wt - resolution * (Stot[nbr_com] * degree) / m
+                    gain = 2 * wt - resolution * (Stot_out[nbr_com] * out_degree) / m
                 if gain > best_mod:
                     best_mod = gain
                     best_com = nbr_com
+            Stot_out[best_com] += out_degree
             if is_directed:
                 Stot_in[best_com] += in_degree
-                Stot_out[best_com] += out_degree
-            else:
-                Stot[best_com] += degree
             if best_com != node2com[u]:
-                com = G.nodes[u].get("nodes", {u})
-                partition[node2com[u]].difference_update(com)
-                inner_partition[node2com[u]].remove(u)
-                partition[best_com].update(com)
-                inner_partition[best_com].add(u)
-                improvement = True
+                moves.append((u, node2com[u], best_com))
                 nb_moves += 1
                 node2com[u] = best_com
-    partition = list(filter(len, partition))
-    inner_partition = list(filter(len, inner_partition))
-    return partition, inner_partition, improvement
-
-
-def _neighbor_weights(nbrs, node2com):
-    """Calculate weights between node and its neighbor communities.
-    Parameters
-    ----------
-    nbrs : dictionary
-           Dictionary with nodes' neighbours as keys and their edge weight as value.
-    node2com : dictionary
-           Dictionary with all graph's nodes as keys and their community index as value.
-    """
-    weights = defaultdict(float)
-    for nbr, wt in nbrs.items():
-        weights[node2com[nbr]] += wt
-    return weights
+    return moves
 
 
-def _gen_graph(G, partition):
+def _gen_graph(
+    G: LouvainGraph,
+    partition,
+    node_position: Optional[Dict[Hashable, int]] = None,
+) -> LouvainGraph:
     """Generate a new graph based on the partitions of a given graph"""
-    H = G.__class__()
-    node2com = {}
+    node2com = np.zeros(G.num_nodes, dtype=np.int64)
+    nodes: List[Set[Hashable]] = []
     for i, part in enumerate(partition):
-        nodes = set()
+        com_nodes = set()
         for node in part:
-            node2com[node] = i
-            nodes.update(G.nodes[node].get("nodes", {node}))
-        H.add_node(i, nodes=nodes)
-
-    for node1, node2, wt in G.edges(data=True):
-        wt = wt["weight"]
-        com1 = node2com[node1]
-        com2 = node2com[node2]
-        temp = H.get_edge_data(com1, com2, {"weight": 0})["weight"]
-        H.add_edge(com1, com2, **{"weight": wt + temp})
-    return H
+            position = node if node_position is None else node_position[node]
+            node2com[position] = i
+            com_nodes.update(G.nodes[position])
+        nodes.append(com_nodes)
+
+    src, dst, weights = G.edges()
+    return _build_louvain_graph(
+        len(partition), node2com[src], node2com[dst], weights, nodes, G.is_directed
+    )
+
+
+def _modularity(G: LouvainGraph, communities, resolution=1) -> float:
+    """Same as networkx modularity(G, communities, resolution, weight="weight")"""
+    out_degrees = G.out_degrees()
+    in_degrees = G.in_degrees()
+    if G.is_directed:
+        m = sum(out_degrees.tolist())
+        norm = 1 / m**2
+    else:
+        deg_sum = sum(out_degrees.tolist())
+        m = deg_sum / 2
+        norm = 1 / deg_sum**2
+
+    node2com = np.zeros(G.num_nodes, dtype=np.int64)
+    for i, community in enumerate(communities):
+        node2com[list(community)] = i
+    src, dst, weights = G.edges()
+    internal = node2com[src] == node2com[dst]
+    L_c = np.zeros(len(communities))
+    np.add.at(L_c, node2com[src[internal]], weights[internal])
+    out_degree_sum = np.zeros(len(communities))
+    np.add.at(out_degree_sum, node2com, out_degrees)
+    in_degree_sum = np.zeros(len(communities))
+    np.add.at(in_degree_sum, node2com, in_degrees)
+    return sum((L_c / m - resolution * out_degree_sum * in_degree_sum * norm).tolist())
+
+
+def _is_partition(G, partition) -> bool:
+    nodes = [node for community in partition for node in community]
+    return len(nodes) == len(G) and set(nodes) == set(G.nodes)
 
 
 def _convert_multigraph(G, weight, is_directed):
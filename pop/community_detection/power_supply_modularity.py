@@ -1,6 +1,7 @@
 import networkx as nx
 import numpy as np
-from typing import Tuple, List, Set
+import pylru
+from typing import Hashable, Tuple, List, Set
 
 
 def belong_to_same_community(node1: int, node2: int, communities: List[Set[int]]):
@@ -16,107 +17,158 @@ def compute_reactance(graph: nx.Graph, edge: Tuple[int, int]):
     return reactive_power / current_flow**2
 
 
+class GridArrays:
+    """
+    Edge attributes of a graph as arrays.
+    Matrices are indexed by node position in graph.nodes, edges follow graph.edges.
+    """
+
+    def __init__(self, graph: nx.Graph):
+        self.nodes: List[int] = list(graph.nodes)
+        node_position = {node: position for position, node in enumerate(self.nodes)}
+        edges = list(graph.edges.data())
+        self.edges: List[Tuple[int, int]] = [(u, v) for u, v, _ in edges]
+        # -> (edges)
+        self.u: np.ndarray = np.array(
+            [node_position[u] for u, _, _ in edges], dtype=np.int64
+        )
+        self.v: np.ndarray = np.array(
+            [node_position[v] for _, v, _ in edges], dtype=np.int64
+        )
+        self.reactive_power: np.ndarray = np.array(
+            [data["q_or"] + data["q_ex"] for _, _, data in edges], dtype=np.float64
+        )
+        self.current_flow: np.ndarray = np.array(
+            [data["a_or"] + data["a_ex"] for _, _, data in edges], dtype=np.float64
+        )
+        self.rho: np.ndarray = np.array(
+            [data["rho"] for _, _, data in edges], dtype=np.float64
+        )
+        self.connected: bool = nx.is_connected(graph)
+
+    def key(self) -> Hashable:
+        return (
+            tuple(self.nodes),
+            tuple(self.edges),
+            self.reactive_power.tobytes(),
+            self.current_flow.tobytes(),
+            self.rho.tobytes(),
+        )
+
+    @property
+    def admittance(self) -> np.ndarray:
+        # -> (edges)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return 1 / (self.reactive_power / self.current_flow**2)
+
+    def admittance_matrix(self) -> np.ndarray:
+        # -> (nodes, nodes)
+        matrix = np.zeros((len(self.nodes), len(self.nodes)))
+        matrix[self.u, self.v] = self.admittance
+        matrix[self.v, self.u] = self.admittance
+        return matrix
+
+    def line_admittance_matrix(self) -> np.ndarray:
+        # -> (edges, nodes)
+        matrix = np.zeros((len(self.edges), len(self.nodes)))
+        matrix[np.arange(len(self.edges)), self.u] = self.admittance
+        matrix[np.arange(len(self.edges)), self.v] = -self.admittance
+        return matrix
+
+    def susceptance_matrix(self) -> np.ndarray:
+        # Weighted Laplacian: degrees on the diagonal, minus admittances elsewhere
+        # -> (nodes, nodes)
+        admittance_matrix = self.admittance_matrix()
+        return np.diag(admittance_matrix.sum(axis=1)) - admittance_matrix
+
+    def nodal_admittance_matrices(self) -> np.ndarray:
+        # One matrix per slack node: the slack row and column only keep their diagonal entry
+        # -> (slack nodes, nodes, nodes)
+        nodes = len(self.nodes)
+        matrices = np.repeat(self.susceptance_matrix()[None], nodes, axis=0)
+        slack = np.arange(nodes)
+        diagonal = matrices[slack, slack, slack]
+        matrices[slack, slack, :] = 0
+        matrices[slack, :, slack] = 0
+        matrices[slack, slack, slack] = diagonal
+        return matrices
+
+    def inverse_nodal_admittance_matrices(self) -> np.ndarray:
+        # -> (slack nodes, nodes, nodes)
+        if not self.connected:
+            return np.linalg.pinv(self.nodal_admittance_matrices())
+
+        # A single factorization serves every slack node:
+        # inverse of the Laplacian grounded at s = X_ab - X_as - X_sb + X_ss with X = pinv(Laplacian)
+        susceptance = self.susceptance_matrix()
+        x = np.linalg.pinv(susceptance)
+        x_diagonal = np.diag(x)
+        inverses = (
+            x[None, :, :] - x.T[:, :, None] - x[:, None, :] + x_diagonal[:, None, None]
+        )
+        slack = np.arange(len(self.nodes))
+        inverses[slack, slack, :] = 0
+        inverses[slack, :, slack] = 0
+        with np.errstate(divide="ignore"):
+            inverses[slack, slack, slack] = 1 / np.diag(susceptance)
+        return inverses
+
+
 def compute_admittance_matrix(graph: nx.Graph):
-    return np.array(
-        [
-            [
-                0 if (i, j) not in graph.edges else 1 / compute_reactance(graph, (i, j))
-                for i in graph.nodes
-            ]
-            for j in graph.nodes
-        ]
-    )
+    return GridArrays(graph).admittance_matrix()
 
 
 def compute_line_admittance_matrix(graph: nx.Graph):
-    return np.array(
-        [
-            [
-                1 / compute_reactance(graph, edge)
-                if node == edge[0]
-                else -1 / compute_reactance(graph, edge)
-                if node == edge[1]
-                else 0
-                for node in graph.nodes
-            ]
-            for edge in graph.edges
-        ]
-    )
+    return GridArrays(graph).line_admittance_matrix()
 
 
 def compute_nodal_admittance_matrix(graph: nx.Graph, slack_node: int):
     # We assume that reactance is far larger than resistance
     # Thus we ignore resistance when computing admittance
+    grid = GridArrays(graph)
+    return grid.nodal_admittance_matrices()[grid.nodes.index(slack_node)]
 
-    return np.array(
-        [
-            [
-                sum(
-                    [
-                        (1 / compute_reactance(graph, (i, neighbor)))
-                        if neighbor > i
-                        else (1 / compute_reactance(graph, (neighbor, i)))
-                        for neighbor in list(graph.neighbors(i))
-                    ]
-                )
-                if i == j
-                else 0
-                if (i, j) not in graph.edges or i == slack_node or j == slack_node
-                else (-1 / compute_reactance(graph, (i, j)))
-                for i in graph.nodes
-            ]
-            for j in graph.nodes
-        ]
+
+def _power_transfer_distribution_factor(grid: GridArrays) -> np.ndarray:
+    # -> (edges, nodes, slack nodes)
+    return np.einsum(
+        "en,snm->ems",
+        grid.line_admittance_matrix(),
+        grid.inverse_nodal_admittance_matrices(),
     )
 
 
 def compute_power_transfer_distribution_factor(graph: nx.Graph):
-    if not nx.is_connected(graph):
-        nodal_admittances = [
-            np.linalg.pinv(compute_nodal_admittance_matrix(graph, node))
-            for node in graph.nodes
-        ]
-    else:
-        nodal_admittances = [
-            np.linalg.inv(compute_nodal_admittance_matrix(graph, node))
-            for node in graph.nodes
-        ]
-    line_admittance_matrix = compute_line_admittance_matrix(graph)
-    return np.stack(
-        [
-            np.matmul(line_admittance_matrix, nodal_admittance_matrix)
-            for nodal_admittance_matrix in nodal_admittances
-        ],
-        axis=2,
-    )
+    return _power_transfer_distribution_factor(GridArrays(graph))
+
+
+def _power_transmission_capacity(grid: GridArrays) -> np.ndarray:
+    ptdf = _power_transfer_distribution_factor(grid)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        powerflow_limit = grid.current_flow / grid.rho
+        # -> (slack nodes, nodes, edges)
+        capacities = (
+            powerflow_limit[None, None, :] / np.linalg.norm(ptdf, axis=0).T[:, :, None]
+        )
+    # Same as the builtin min(): a leading nan is kept, later ones are skipped
+    with np.errstate(invalid="ignore"):
+        minimum = np.nanmin(np.where(np.isnan(capacities), np.inf, capacities), axis=-1)
+    return np.where(np.isnan(capacities[:, :, 0]), np.nan, minimum)
 
 
 def compute_power_transmission_capacity(graph: nx.Graph):
-    ptdf = compute_power_transfer_distribution_factor(graph)
-    powerflow_limit = np.array(
-        [
-            (graph.edges[edge]["a_or"] + graph.edges[edge]["a_ex"])
-            / graph.edges[edge]["rho"]
-            for edge in graph.edges
-        ]
-    )
-    return np.array(
-        [
-            [min(powerflow_limit / np.linalg.norm(ptdf[:, i, j])) for i in graph.nodes]
-            for j in graph.nodes
-        ]
-    )
+    return _power_transmission_capacity(GridArrays(graph))
 
 
-def compute_electrical_coupling_strength(
-    graph: nx.Graph, alpha: float = 0.5, beta: float = 0.5
-):
-    power_transmission_capacity = compute_power_transmission_capacity(graph)
+def _electrical_coupling_strength(
+    grid: GridArrays, alpha: float, beta: float
+) -> np.ndarray:
+    power_transmission_capacity = _power_transmission_capacity(grid)
     normalized_power_transmission_capacity = power_transmission_capacity / np.mean(
         power_transmission_capacity
     )
 
-    admittance_matrix = compute_admittance_matrix(graph)
+    admittance_matrix = grid.admittance_matrix()
     normalized_admittance_matrix = admittance_matrix / np.mean(admittance_matrix)
 
     return np.sqrt(
@@ -125,24 +177,68 @@ def compute_electrical_coupling_strength(
     )
 
 
+def compute_electrical_coupling_strength(
+    graph: nx.Graph, alpha: float = 0.5, beta: float = 0.5
+):
+    return _electrical_coupling_strength(GridArrays(graph), alpha, beta)
+
+
+class ElectricalCouplingStrength:
+    """
+    Electrical coupling strength matrices cached by graph state.
+    Louvain evaluates the modularity of many partitions of the same graph,
+    the matrix is computed once for all of them.
+    """
+
+    def __init__(self, cache_size: int = 8):
+        # (graph state, alpha, beta) -> ecs
+        self.cache: pylru.lrucache = pylru.lrucache(size=cache_size)
+
+    def __call__(
+        self, graph: nx.Graph, alpha: float = 0.5, beta: float = 0.5
+    ) -> np.ndarray:
+        grid = GridArrays(graph)
+        key = (grid.key(), alpha, beta)
+        if key not in self.cache:
+            self.cache[key] = _electrical_coupling_strength(grid, alpha, beta)
+        return self.cache[key]
+
+    def modularity(
+        self,
+        graph: nx.Graph,
+        community: List[Set[int]],
+        alpha: float = 0.5,
+        beta: float = 0.5,
+    ) -> float:
+        ecs = self(graph, alpha, beta)
+        total_ecs = 2 * np.sum(ecs)  # we will only use this formulation
+
+        # -> (nodes, communities)
+        node_position = {node: position for position, node in enumerate(graph.nodes)}
+        membership = np.zeros((len(node_position), len(community)))
+        for community_id, nodes in enumerate(community):
+            membership[
+                [node_position[node] for node in nodes if node in node_position],
+                community_id,
+            ] = 1
+        # -> (nodes, nodes)
+        same_community = (membership @ membership.T) > 0
+
+        # Each pair contributes ecs_ij / T - (ecs_i. / T) * (ecs_j. / T), summed over all nodes
+        return np.sum(
+            (len(node_position) * ecs / total_ecs - (ecs @ ecs.T) / total_ecs**2)[
+                same_community
+            ]
+        )
+
+
+electrical_coupling_strength = ElectricalCouplingStrength()
+
+
 def power_supply_modularity(
     graph: nx.Graph,
     community: List[Set[int]],
     alpha: float = 0.5,
     beta: float = 0.5,
 ):
-    ecs = compute_electrical_coupling_strength(graph, alpha, beta)
-    total_ecs = 2 * np.sum(ecs)  # we will only use this formulation
-    return np.sum(
-        [
-            [
-                (
-                    ecs[i, j] / total_ecs
-                    - (ecs[i, :] / total_ecs) * (ecs[j, :] / total_ecs)
-                )
-                * int(belong_to_same_community(i, j, community))
-                for i in graph.nodes
-            ]
-            for j in graph.nodes
-        ]
-    )
+    return electrical_coupling_strength.modularity(graph, community, alpha, beta)
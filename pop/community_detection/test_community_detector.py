@@ -0,0 +1,62 @@
+import random
+from typing import List
+
+import networkx as nx
+import pytest
+
+from pop.community_detection.community_detector import (
+    CommunityDetector,
+    edge_changes,
+)
+
+
+def _snapshots(nodes: int, steps: int, seed: int) -> List[nx.Graph]:
+    rng = random.Random(seed)
+    graph = nx.connected_watts_strogatz_graph(nodes, 4, 0.1, seed=seed)
+    snapshots = [graph]
+    for _ in range(steps):
+        graph = graph.copy()
+        edges = list(graph.edges)
+        for _ in range(2):
+            if rng.random() < 0.5:
+                graph.remove_edge(*edges.pop(rng.randrange(len(edges))))
+            else:
+                graph.add_edge(*rng.sample(list(graph.nodes), 2))
+        snapshots.append(graph)
+    return snapshots
+
+
+def test_edge_changes_match_edge_views():
+    graph_t = nx.gnp_random_graph(40, 0.1, seed=0)
+    graph_t.add_edges_from([(3, 3), (7, 7)])
+    graph_t1 = graph_t.copy()
+    graph_t1.remove_edges_from(list(graph_t.edges)[::7] + [(3, 3)])
+    graph_t1.add_edges_from([(0, 39), (39, 1), (12, 12), (40, 2), (41, 40)])
+    graph_t1.remove_nodes_from([5, 17])
+
+    added_edges, removed_edges = edge_changes(graph_t, graph_t1)
+    assert added_edges == set(graph_t1.edges - graph_t.edges)
+    assert removed_edges == set(graph_t.edges - graph_t1.edges)
+    assert edge_changes(graph_t, graph_t.copy()) == (set(), set())
+
+
+@pytest.mark.parametrize("nodes,steps", [(14, 60), (60, 30)])
+def test_carried_index_gives_the_same_communities(nodes: int, steps: int):
+    snapshots = _snapshots(nodes, steps, nodes)
+
+    def run(fresh_detector: bool) -> List[List[frozenset]]:
+        random.seed(0)
+        detector = CommunityDetector(0)
+        communities = detector.dynamo(snapshots[0])
+        history = [communities]
+        for graph_t, graph_t1 in zip(snapshots, snapshots[1:]):
+            if fresh_detector:
+                detector = CommunityDetector(0)
+            # Graphs are handed back as copies, as BasePOP does with old_graph
+            communities = detector.dynamo(
+                graph_t=graph_t.copy(), graph_t1=graph_t1, comm_t=communities
+            )
+            history.append(communities)
+        return history
+
+    assert run(fresh_detector=False) == run(fresh_detector=True)
@@ -0,0 +1,176 @@
+import random
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from pop.community_detection.louvain import (
+    _convert_multigraph,
+    _louvain_graph_from_networkx,
+    _modularity,
+    louvain_communities,
+)
+
+
+def _weighted_graph(directed: bool) -> nx.Graph:
+    graph = nx.gnp_random_graph(60, 0.08, seed=3, directed=directed)
+    rng = np.random.default_rng(3)
+    for u, v in graph.edges:
+        graph.edges[u, v]["weight"] = float(rng.uniform(0.5, 2.0))
+    return graph
+
+
+def _multigraph() -> nx.MultiGraph:
+    graph = nx.MultiGraph(nx.karate_club_graph())
+    graph.add_edges_from([(0, 1), (5, 6), (5, 6), (32, 33)], weight=1.5)
+    return graph
+
+
+GRAPHS = {
+    "karate_club": nx.karate_club_graph,
+    "weighted": lambda: _weighted_graph(False),
+    "directed": lambda: _weighted_graph(True),
+    "multigraph": _multigraph,
+}
+
+
+def _networkx_one_level(
+    G: nx.Graph, m: float, partition: List[Set[int]], is_directed: bool, seed
+) -> Tuple[List[Set[int]], List[Set[int]], bool]:
+    # One Louvain level on networkx graphs, as computed before the CSR arrays
+    node2com = {u: i for i, u in enumerate(G.nodes())}
+    inner_partition = [{u} for u in G.nodes()]
+    in_degrees = dict((G.in_degree if is_directed else G.degree)(weight="weight"))
+    out_degrees = dict((G.out_degree if is_directed else G.degree)(weight="weight"))
+    Stot_in, Stot_out = list(in_degrees.values()), list(out_degrees.values())
+    nbrs = {u: {v: data["weight"] for v, data in G[u].items() if v != u} for u in G}
+    rand_nodes = list(G.nodes)
+    seed.shuffle(rand_nodes)
+    improvement, nb_moves = False, 1
+    while nb_moves > 0:
+        nb_moves = 0
+        for u in rand_nodes:
+            best_mod, best_com = 0, node2com[u]
+            weights2com: Dict[int, float] = defaultdict(float)
+            for nbr, wt in nbrs[u].items():
+                weights2com[node2com[nbr]] += wt
+            Stot_out[best_com] -= out_degrees[u]
+            if is_directed:
+                Stot_in[best_com] -= in_degrees[u]
+            for nbr_com, wt in weights2com.items():
+                if is_directed:
+                    gain = (
+                        wt
+                        - (
+                            out_degrees[u] * Stot_in[nbr_com]
+                            + in_degrees[u] * Stot_out[nbr_com]
+                        )
+                        / m
+                    )
+                else:
+                    gain = 2 * wt - (Stot_out[nbr_com] * out_degrees[u]) / m
+                if gain > best_mod:
+                    best_mod, best_com = gain, nbr_com
+            Stot_out[best_com] += out_degrees[u]
+            if is_directed:
+                Stot_in[best_com] += in_degrees[u]
+            if best_com != node2com[u]:
+                com = G.nodes[u].get("nodes", {u})
+                partition[node2com[u]].difference_update(com)
+                inner_partition[node2com[u]].remove(u)
+                partition[best_com].update(com)
+                inner_partition[best_com].add(u)
+                improvement = True
+                nb_moves += 1
+                node2com[u] = best_com
+    partition = list(filter(len, partition))
+    inner_partition = list(filter(len, inner_partition))
+    return partition, inner_partition, improvement
+
+
+def _networkx_gen_graph(G: nx.Graph, partition: List[Set[int]]) -> nx.Graph:
+    H = G.__class__()
+    node2com = {}
+    for i, part in enumerate(partition):
+        nodes = set()
+        for node in part:
+            node2com[node] = i
+            nodes.update(G.nodes[node].get("nodes", {node}))
+        H.add_node(i, nodes=nodes)
+    for node1, node2, wt in G.edges(data="weight"):
+        com1, com2 = node2com[node1], node2com[node2]
+        temp = H.get_edge_data(com1, com2, {"weight": 0})["weight"]
+        H.add_edge(com1, com2, weight=wt + temp)
+    return H
+
+
+def _networkx_louvain(
+    G: nx.Graph, partition: List[Set[int]], seed, threshold: float = 0.0000001
+) -> List[Set[int]]:
+    is_directed = G.is_directed()
+    mod = nx.community.modularity(G, partition)
+    if G.is_multigraph():
+        graph = _convert_multigraph(G, "weight", is_directed)
+    else:
+        graph = G.__class__()
+        graph.add_nodes_from(G)
+        graph.add_weighted_edges_from(G.edges(data="weight", default=1))
+    m = graph.size(weight="weight")
+    graph = _networkx_gen_graph(graph, partition)
+    partition, inner_partition, _ = _networkx_one_level(
+        graph, m, partition, is_directed, seed
+    )
+    while True:
+        new_mod = nx.community.modularity(graph, inner_partition)
+        if new_mod - mod <= threshold:
+            return partition
+        mod = new_mod
+        graph = _networkx_gen_graph(graph, inner_partition)
+        partition, inner_partition, improvement = _networkx_one_level(
+            graph, m, partition, is_directed, seed
+        )
+        if not improvement:
+            return partition
+
+
+def _initial_partitions(graph: nx.Graph) -> List[List[Set[int]]]:
+    nodes = sorted(graph.nodes)
+    return [
+        [{node} for node in nodes],
+        # Communities carried over from a previous snapshot, as passed by dynamo
+        [set(nodes[start : start + 4]) for start in range(0, len(nodes), 4)],
+    ]
+
+
+def _sorted(communities: List[Set[int]]) -> List[List[int]]:
+    return sorted(sorted(community) for community in communities)
+
+
+@pytest.mark.parametrize("name", GRAPHS)
+@pytest.mark.parametrize("seed", [0, 1, 7])
+def test_louvain_matches_networkx_levels(name: str, seed: int):
+    graph = GRAPHS[name]()
+    for partition in _initial_partitions(graph):
+        communities = louvain_communities(
+            graph, [set(part) for part in partition], seed=random.Random(seed)
+        )
+        expected = _networkx_louvain(
+            graph, [set(part) for part in partition], random.Random(seed)
+        )
+        assert _sorted(communities) == _sorted(expected)
+
+
+@pytest.mark.parametrize("name", GRAPHS)
+def test_modularity_matches_networkx(name: str):
+    graph = GRAPHS[name]()
+    if graph.is_multigraph():
+        graph = _convert_multigraph(graph, "weight", graph.is_directed())
+    for communities in _initial_partitions(graph):
+        louvain_graph, node_position = _louvain_graph_from_networkx(graph, "weight")
+        modularity = _modularity(
+            louvain_graph,
+            [[node_position[node] for node in community] for community in communities],
+        )
+        assert modularity == pytest.approx(nx.community.modularity(graph, communities))
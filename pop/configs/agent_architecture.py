@@ -48,6 +48,10 @@ class EpisodicMemoryParameters(ExplorationParameters):
     maximum_similarity: float
     random_network_distiller: RandomNetworkDistillerArchitecture
     inverse_model: InverseModelArchitecture
+    index: str  # "exact" or "ivf" (approximate nearest neighbors)
+    index_lists: int  # ivf only
+    index_probes: int  # ivf only
+    batched: bool  # intrinsic rewards computed and models trained on minibatches at learn time
 
     @staticmethod
     def get_method() -> str:
@@ -70,6 +74,10 @@ class EpisodicMemoryParameters(ExplorationParameters):
         object.__setattr__(
             self, "exploration_bonus_limit", d["exploration_bonus_limit"]
         )
+        object.__setattr__(self, "index", d.get("index", "exact"))
+        object.__setattr__(self, "index_lists", d.get("index_lists", 1024))
+        object.__setattr__(self, "index_probes", d.get("index_probes", 8))
+        object.__setattr__(self, "batched", d.get("batched", False))
         object.__setattr__(
             self, "inverse_model", InverseModelArchitecture(**d["inverse_model"])
         )
@@ -126,6 +134,8 @@ class ReplayMemoryParameters:
     min_beta: float
     annihilation_rate: int
     capacity: int
+    sum_tree: bool = False
+    columnar: bool = False
 
 
 @dataclass(frozen=True)
@@ -143,6 +153,8 @@ class AgentArchitecture:
     huber_loss_delta: float
     batch_size: int
     intrinsic_reward_relevance: float = 0
+    asynchronous_learning: bool = False  # learn steps run in a background thread
+    max_pending_learn_steps: int = 4  # steps block once this many learn steps wait
 
     def __init__(
         self,
@@ -243,6 +255,14 @@ class AgentArchitecture:
                 "intrinsic_reward_relevance",
                 agent_dict["intrinsic_reward_relevance"],
             )
+        if agent_dict.get("asynchronous_learning"):
+            object.__setattr__(
+                self, "asynchronous_learning", agent_dict["asynchronous_learning"]
+            )
+        if agent_dict.get("max_pending_learn_steps"):
+            object.__setattr__(
+                self, "max_pending_learn_steps", agent_dict["max_pending_learn_steps"]
+            )
 
     @staticmethod
     def _parse_network_architectures(
@@ -34,6 +34,12 @@ class POPArchitecture:
     generator_storage_only: bool = False
     remove_no_action: bool = False
     manager_remove_no_action: bool = False
+    agents_per_pool: int = 0  # 0 hosts every agent in its own Ray actor
+    agent_ensemble: bool = False  # batched forward pass over pooled agents
+    # Factored action spaces are cached in this directory, None disables the cache
+    action_space_cache_dir: Optional[str] = None
+    factorization_processes: int = 1  # actions are classified in a process pool if > 1
+    vectorized_factorization: bool = False  # classify actions from their vectors
 
 
 @dataclass(frozen=True)
@@ -62,6 +62,7 @@ class TrainingParameters:
     local: bool = False
     pre_train: bool = False
     chronics: Union[int, str] = -1
+    rollout_workers: int = 1
 
 
 @dataclass(frozen=True)
@@ -71,6 +72,7 @@ class EvaluationParameters:
     generate_grid2viz_data: str
     compute_score: str
     score: str = "2022"
+    processes: int = 1
 
 
 @dataclass(frozen=True)
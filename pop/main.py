@@ -4,6 +4,7 @@ import logging
 import os
 import random
 import warnings
+from functools import partial
 from pathlib import Path
 from typing import Optional, Union
 
@@ -32,12 +33,14 @@ from grid2op.Reward import (
 from grid2op.Runner import Runner
 from grid2op.utils import ScoreL2RPN2022, ScoreL2RPN2020
 
-from pop.multiagent_system.base_pop import train
+from pop.multiagent_system.base_pop import train, train_with_rollout_workers
 from pop.multiagent_system.dpop import DPOP
 from pop.constants import PER_PROCESS_GPU_MEMORY_FRACTION
 import re
 
 from pop.multiagent_system.expert_pop import ExpertPop
+from pop.multiagent_system.frozen_pop import FrozenExpertPop, FrozenPOP
+from pop.multiagent_system.rollout_workers import RolloutWorkers
 from lightsim2grid import LightSimBackend
 
 logging.getLogger("lightning").addHandler(logging.NullHandler())
@@ -134,8 +137,10 @@ def evaluate(
     if not Path(path_save).exists():
         Path(path_save).mkdir(parents=True, exist_ok=False)
 
-    os.environ[Runner.FORCE_SEQUENTIAL] = "1"
-    nb_process = 1
+    if not isinstance(agent, (FrozenPOP, FrozenExpertPop, DoNothingAgent)):
+        # Ray actor handles cannot be copied into the Runner processes, see DPOP.freeze()
+        os.environ[Runner.FORCE_SEQUENTIAL] = "1"
+        nb_process = 1
 
     if config.evaluation.compute_score:
         csv_path = Path(
@@ -151,7 +156,7 @@ def evaluate(
         score = score_func(
             env, nb_scenario=nb_episode, verbose=2, nb_process_stats=nb_process
         )
-        agent_score = score.get(agent)
+        agent_score = score.get(agent, nb_process=nb_process)
         agent_score_df = pd.DataFrame(agent_score).transpose()
         agent_score_df.columns = ["all_scores", "ts_survived", "total_ts"]
         agent_score_df.to_csv(csv_path)
@@ -165,6 +170,24 @@ def evaluate(
         )
 
 
+def make_training_environment(
+    name: str, difficulty: Union[int, str], reward: str
+) -> BaseEnv:
+    # Module level so that rollout workers can build their own copy
+    rewards = {
+        "Episode Duration": EpisodeDurationReward(per_timestep=1 / 20),
+        "Flat": FlatReward(per_timestep=5),
+        "DQNReward": DQNReward(per_step=1),
+    }
+    return grid2op.make(
+        name + "_train80",
+        chronics_class=MultifolderWithCache,
+        difficulty=difficulty,
+        reward_class=rewards[reward],
+        backend=LightSimBackend(),
+    )
+
+
 def fix_seed(env_train: BaseEnv, env_val: BaseEnv, seed: int = 0):
     env_train.seed(seed)
     env_val.seed(seed)
@@ -189,12 +212,6 @@ def main(**kwargs):
         + " with difficulty "
         + str(config.environment.difficulty)
     )
-    reward = {
-        "Episode Duration": EpisodeDurationReward(per_timestep=1 / 20),
-        "Flat": FlatReward(per_timestep=5),
-        "DQNReward": DQNReward(per_step=1),
-    }
-
     # reward_class = (
     # CombinedReward
     # if list(config.environment.reward.reward_components.items())[0][0]
@@ -203,13 +220,13 @@ def main(**kwargs):
     # )
 
     # Train Environment
-    env_train = grid2op.make(
-        config.environment.name + "_train80",
-        chronics_class=MultifolderWithCache,
+    make_env_train = partial(
+        make_training_environment,
+        name=config.environment.name,
         difficulty=config.environment.difficulty,
-        reward_class=reward[config.environment.reward],
-        backend=LightSimBackend(),
+        reward=config.environment.reward,
     )
+    env_train = make_env_train()
 
     # if reward_class == CombinedScaledReward:
     #    set_reward(env_train, config)
@@ -306,12 +323,26 @@ def main(**kwargs):
         )
         # yappi.set_clock_type("cpu")
         # yappi.start(builtins=True)
-        train(
-            env_train,
-            iterations=config.training.steps - agent.train_steps,
-            dpop=agent,
-            save_frequency=config.training.save_frequency,
-        )
+        if config.training.rollout_workers > 1:
+            train_with_rollout_workers(
+                RolloutWorkers(
+                    make_env_train,
+                    observation_space=env_train.observation_space,
+                    chronics=[str(path) for path in kept],
+                    workers=config.training.rollout_workers,
+                    seed=config.reproducibility.seed,
+                ),
+                iterations=config.training.steps - agent.train_steps,
+                dpop=agent,
+                save_frequency=config.training.save_frequency,
+            )
+        else:
+            train(
+                env_train,
+                iterations=config.training.steps - agent.train_steps,
+                dpop=agent,
+                save_frequency=config.training.save_frequency,
+            )
         # stats = yappi.get_func_stats()
         # stats.save("yappi_out", type="callgrind")
     else:
@@ -319,9 +350,12 @@ def main(**kwargs):
         evaluate(
             config=config,
             env=env_val,
-            agent=agent,
+            agent=agent.freeze()
+            if config.evaluation.processes > 1 and not config.model.do_nothing
+            else agent,
             path_save=config.evaluation.evaluation_dir,
             nb_episode=config.evaluation.episodes,
+            nb_process=config.evaluation.processes,
             sequential=True,
             do_nothing=config.model.do_nothing,
             score2020=True if config.evaluation.score == "2020" else False,
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import grid2op
+import numpy as np
+from grid2op.Action import BaseAction
+from grid2op.Environment import BaseEnv
+
+Substation = int
+
+
+class ActionSpaceCache:
+    """
+    Content addressed on-disk cache of factored action spaces.
+    Entries are keyed on the environment (name and parameters, which depend on the difficulty),
+    the grid2op version and the factorization flags.
+    Each entry is a .npz file holding the vectorized actions of every substation and the action lookup array.
+    """
+
+    version: int = 1
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir: Path = Path(cache_dir)
+
+    def key(self, env: BaseEnv, **factorization_flags: Any) -> str:
+        description = {
+            "version": self.version,
+            "grid2op": grid2op.__version__,
+            "environment": env.name,
+            "parameters": env.parameters.to_dict(),
+            "action_size": int(env.action_space.size()),
+            "n_sub": int(env.n_sub),
+            "factorization": factorization_flags,
+        }
+        return hashlib.sha256(
+            json.dumps(description, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return Path(self.cache_dir, key + ".npz")
+
+    def load(
+        self, env: BaseEnv, key: str
+    ) -> Optional[Tuple[Dict[Substation, List[BaseAction]], np.ndarray]]:
+        if not self.path(key).exists():
+            return None
+        with np.load(str(self.path(key))) as entry:
+            substations = entry["substations"]
+            action_vectors = entry["action_vectors"]
+            lookup_array = entry["lookup_array"]
+
+        substation_to_action_space: Dict[Substation, List[BaseAction]] = {
+            substation: [] for substation in range(env.n_sub)
+        }
+        for substation, action_vector in zip(substations.tolist(), action_vectors):
+            substation_to_action_space[substation].append(
+                env.action_space.from_vect(action_vector, check_legit=False)
+            )
+        return substation_to_action_space, lookup_array
+
+    def save(
+        self,
+        key: str,
+        substation_to_action_space: Dict[Substation, List[BaseAction]],
+        lookup_array: np.ndarray,
+    ):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # -> (actions), (actions, action size)
+        substations = np.array(
+            [
+                substation
+                for substation, action_space in substation_to_action_space.items()
+                for _ in action_space
+            ],
+            dtype=np.int64,
+        )
+        action_vectors = np.stack(
+            [
+                action.to_vect()
+                for action_space in substation_to_action_space.values()
+                for action in action_space
+            ]
+        )
+
+        # Written to a temporary file first so that concurrent jobs never read a partial entry
+        temporary_path = Path(self.cache_dir, key + "." + str(os.getpid()) + ".tmp.npz")
+        np.savez_compressed(
+            str(temporary_path),
+            substations=substations,
+            action_vectors=action_vectors,
+            lookup_array=lookup_array,
+        )
+        os.replace(temporary_path, self.path(key))
@@ -1,3 +1,4 @@
+import copy
 import itertools
 from pathlib import Path
 import time
@@ -19,6 +20,7 @@ from grid2op.Environment import BaseEnv
 from grid2op.Observation import BaseObservation
 from tqdm import tqdm
 
+from pop.agents.agent_pool import AgentPool
 from pop.agents.loggable_module import LoggableModule
 from pop.agents.manager import Manager
 from pop.agents.ray_gcn_agent import RayGCNAgent
@@ -26,24 +28,59 @@ from pop.agents.ray_shallow_gcn_agent import RayShallowGCNAgent
 from pop.community_detection.community_detector import Community, CommunityDetector
 from pop.configs.architecture import Architecture
 from pop.multiagent_system.action_detector import ActionDetector
+from pop.multiagent_system.action_space_cache import ActionSpaceCache
 from pop.multiagent_system.fixed_set import FixedSet
+from pop.multiagent_system.manager_history_index import ManagerHistoryIndex
+from pop.multiagent_system.observation_graph import (
+    ObservationConverter,
+    ObservationGraph,
+)
 from pop.multiagent_system.space_factorization import (
     EncodedAction,
     HashableAction,
+    ObservationFactorizer,
     Substation,
+    build_action_lookup_array,
+    community_encoded_actions,
     factor_action_space,
     generate_redispatching_action_space,
-    factor_observation,
-    split_graph_into_communities,
+    lookup_local_actions,
+    manager_masks,
+    split_graph_with_actions,
+    summarize_graph,
 )
+from pop.networks.checkpoint_shards import ManifestCommitter, shard_reference
 from pop.networks.serializable_module import SerializableModule
 from pop.multiagent_system.dictatorship_penalizer import DictatorshipPenalizer
 
 from pop.multiagent_system.reward_distributor import Incentivizer
+from pop.multiagent_system.rollout_workers import RolloutWorkers
 import random
 
 
 class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
+    # Attributes set by my_act() and step() which only describe the ongoing episode
+    episode_state_attributes: List[str] = [
+        "alive_steps",
+        "old_graph",
+        "communities",
+        "community_to_manager",
+        "factored_observation",
+        "substation_to_local_action",
+        "sub_graphs",
+        "substation_to_encoded_action",
+        "community_to_substation",
+        "summarized_graph",
+        "chosen_node",
+        "chosen_action",
+        "chosen_community",
+        # Loop detection, incentives and dictatorship penalties follow each episode on their own
+        "action_detector",
+        "agent_incentives",
+        "manager_incentives",
+        "manager_dictatorship_penalties",
+    ]
+
     def __init__(
         self,
         env: BaseEnv,
@@ -86,6 +123,17 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
         # Node and edge features
         self.env = env
 
+        # Ego graph structures are cached per topology
+        self.observation_factorizer: ObservationFactorizer = ObservationFactorizer(
+            node_features=self.node_features,
+            edge_features=self.edge_features,
+            device=str(self.device),
+            radius=self.architecture.pop.agent_neighbourhood_radius,
+        )
+
+        # Each observation is converted to a graph once, however many times it is used
+        self.observation_converter: ObservationConverter = ObservationConverter()
+
         # Training or Evaluation
         self.training = training
 
@@ -117,54 +165,99 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
 
         # Agents
         self.action_lookup_table: Optional[Dict[HashableAction, int]] = None
+        self.action_lookup_array: Optional[np.ndarray] = None
         self.substation_to_action_converter: Optional[Dict[Substation, IdToAct]] = None
         self.substation_to_agent: Optional[
             Dict[Substation, Union[RayGCNAgent, RayShallowGCNAgent]]
         ] = None
+        self.agent_pools: Optional[List[AgentPool]] = None
+        self.substation_to_pool: Optional[Dict[Substation, AgentPool]] = None
+        self.pooled_agent_names: Dict[Substation, str] = {}
 
         # Action Space Initialization
-        if self.architecture.pop.generator_storage_only:
-            (
-                substation_to_action_space,
-                self.action_lookup_table,
-            ) = generate_redispatching_action_space(
-                self.env, self.architecture.pop.actions_per_generator
+        action_space_cache: Optional[ActionSpaceCache] = None
+        cached_action_space = None
+        if self.architecture.pop.action_space_cache_dir is not None:
+            action_space_cache = ActionSpaceCache(
+                self.architecture.pop.action_space_cache_dir
             )
-        else:
-
-            substation_to_action_space, self.action_lookup_table = factor_action_space(
-                env.observation_space,
-                self.converter,
-                self.env.n_sub,
+            action_space_cache_key = action_space_cache.key(
+                env,
+                converter_actions=len(self.converter.all_actions),
                 composite_actions=self.architecture.pop.composite_actions,
                 generator_storage_only=self.architecture.pop.generator_storage_only,
                 remove_no_action=self.architecture.pop.remove_no_action,
+                actions_per_generator=self.architecture.pop.actions_per_generator,
             )
+            cached_action_space = action_space_cache.load(env, action_space_cache_key)
+
+        if cached_action_space is not None:
+            print("Loading factored action space from cache")
+            substation_to_action_space, self.action_lookup_array = cached_action_space
+        else:
+            if self.architecture.pop.generator_storage_only:
+                (
+                    substation_to_action_space,
+                    self.action_lookup_table,
+                ) = generate_redispatching_action_space(
+                    self.env, self.architecture.pop.actions_per_generator
+                )
+            else:
+
+                (
+                    substation_to_action_space,
+                    self.action_lookup_table,
+                ) = factor_action_space(
+                    env.observation_space,
+                    self.converter,
+                    self.env.n_sub,
+                    composite_actions=self.architecture.pop.composite_actions,
+                    generator_storage_only=self.architecture.pop.generator_storage_only,
+                    remove_no_action=self.architecture.pop.remove_no_action,
+                    processes=self.architecture.pop.factorization_processes,
+                    vectorized=self.architecture.pop.vectorized_factorization,
+                )
 
         self.substation_to_action_converter = self._get_substation_to_agent_mapping(
             substation_to_action_space
         )
 
+        if cached_action_space is None:
+            # -> (substations, max local actions)
+            self.action_lookup_array = build_action_lookup_array(
+                self.substation_to_action_converter, self.action_lookup_table
+            )
+            if action_space_cache is not None:
+                action_space_cache.save(
+                    action_space_cache_key,
+                    substation_to_action_space,
+                    self.action_lookup_array,
+                )
+
         self.log_action_space_size(agent_converters=self.substation_to_action_converter)
 
-        self.substation_to_agent = {
-            sub_id: RayGCNAgent.remote(
-                agent_actions=len(action_space),
-                architecture=self.architecture.agent,
-                node_features=self.node_features,
-                edge_features=self.edge_features,
-                name="agent_" + str(sub_id) + "_" + self.name,
-                training=self.training,
-                device=self.device,
-                feature_ranges=feature_ranges,
-            )
-            if len(action_space) > 1
-            else RayShallowGCNAgent(
-                name="agent_" + str(sub_id) + "_" + self.name,
-                device=self.device,
-            )
-            for sub_id, action_space in substation_to_action_space.items()
-        }
+        if self.architecture.pop.agents_per_pool > 0:
+            # Agents are co-located in pools, each pool is a single Ray actor
+            self._initialize_agent_pools(substation_to_action_space)
+        else:
+            self.substation_to_agent = {
+                sub_id: RayGCNAgent.remote(
+                    agent_actions=len(action_space),
+                    architecture=self.architecture.agent,
+                    node_features=self.node_features,
+                    edge_features=self.edge_features,
+                    name="agent_" + str(sub_id) + "_" + self.name,
+                    training=self.training,
+                    device=self.device,
+                    feature_ranges=feature_ranges,
+                )
+                if len(action_space) > 1
+                else RayShallowGCNAgent(
+                    name="agent_" + str(sub_id) + "_" + self.name,
+                    device=self.device,
+                )
+                for sub_id, action_space in substation_to_action_space.items()
+            }
         # Managers
         self.manager_feature_ranges = {
             "node_features": {
@@ -185,8 +278,12 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
         }
         self.community_to_manager: Optional[Dict[Community, Manager]] = None
         self.managers_history: Dict[Manager, FixedSet] = {}
+        self.managers_history_index: ManagerHistoryIndex = ManagerHistoryIndex()
         self.manager_initialization_threshold: int = 1
 
+        # Commits the manifest of sharded checkpoints in the background, see save_sharded()
+        self.checkpoint_committer: ManifestCommitter = ManifestCommitter()
+
         # Community Detector Initialization
         self.community_detector = CommunityDetector(
             seed,
@@ -194,28 +291,13 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
         )
         self.communities: Optional[List[Community]] = None
 
-        self.action_detector: ActionDetector = ActionDetector(
-            loop_length=self.architecture.pop.disabled_action_loops_length,
-            penalty_value=self.architecture.pop.repeated_action_penalty,
-            repeatable_actions=[0],
-        )
-
-        if self.architecture.pop.incentives:
-            self.agent_incentives: Incentivizer = Incentivizer(
-                {
-                    substation: len(action_converter.all_actions)
-                    for substation, action_converter in self.substation_to_action_converter.items()
-                },
-                **self.architecture.pop.incentives
-            )
-            self.manager_incentives: Incentivizer = Incentivizer(
-                {}, **self.architecture.pop.incentives
-            )
-
-        if self.architecture.pop.dictatorship_penalty:
-            self.manager_dictatorship_penalties: Dict[
-                Manager, DictatorshipPenalizer
-            ] = {}
+        self.action_detector: ActionDetector
+        self.agent_incentives: Optional[Incentivizer]
+        self.manager_incentives: Optional[Incentivizer]
+        self.manager_dictatorship_penalties: Optional[
+            Dict[Manager, DictatorshipPenalizer]
+        ]
+        self.set_episode_state(self._new_episode_controllers())
 
     @abstractmethod
     def get_action(
@@ -226,6 +308,15 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
         """
         ...
 
+    def get_actions(
+        self, observations: List[dgl.DGLHeteroGraph]
+    ) -> List[Tuple[int, Optional[float]]]:
+        """
+        Same as get_action() for the observations of several environments
+        Children may override this to answer every observation at once
+        """
+        return [self.get_action(observation) for observation in observations]
+
     def _extra_step(
         self,
         action: int,
@@ -243,6 +334,83 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
         """
         pass
 
+    def get_episode_state(self) -> Dict[str, Any]:
+        """
+        State of the ongoing episode, used by my_act() and step()
+        When training on several environments, each one has its own episode state
+        """
+        return {
+            attribute: getattr(self, attribute)
+            for attribute in self.episode_state_attributes
+        }
+
+    def set_episode_state(self, episode_state: Dict[str, Any]):
+        for attribute, value in episode_state.items():
+            setattr(self, attribute, value)
+
+        # Managers may have been created while another environment was acting
+        self._register_managers()
+
+    def new_episode_state(self) -> Dict[str, Any]:
+        return {
+            **{attribute: None for attribute in self.episode_state_attributes},
+            "alive_steps": 0,
+            **self._new_episode_controllers(),
+        }
+
+    def _new_episode_controllers(self) -> Dict[str, Any]:
+        """
+        Loop detector, incentives and dictatorship penalties of a new episode state
+        Managers are added by _register_managers()
+        """
+        return {
+            "action_detector": ActionDetector(
+                loop_length=self.architecture.pop.disabled_action_loops_length,
+                penalty_value=self.architecture.pop.repeated_action_penalty,
+                repeatable_actions=[0],
+            ),
+            "agent_incentives": Incentivizer(
+                {
+                    substation: len(action_converter.all_actions)
+                    for substation, action_converter in self.substation_to_action_converter.items()
+                },
+                **self.architecture.pop.incentives
+            )
+            if self.architecture.pop.incentives
+            else None,
+            "manager_incentives": Incentivizer({}, **self.architecture.pop.incentives)
+            if self.architecture.pop.incentives
+            else None,
+            "manager_dictatorship_penalties": {}
+            if self.architecture.pop.dictatorship_penalty
+            else None,
+        }
+
+    def _register_managers(self):
+        """
+        Adds the managers missing from the incentives and dictatorship penalties of the current episode state
+        """
+        for manager in self.managers_history.keys():
+            if (
+                self.manager_incentives is not None
+                and manager not in self.manager_incentives.agent_actions
+            ):
+                # TODO: find a way to model manager importance, for now they are all the same
+                # TODO: care that manager importance may change with time due to dynamic community structure
+                self.manager_incentives.add_agent(manager, 1)
+
+            if (
+                self.manager_dictatorship_penalties is not None
+                and manager not in self.manager_dictatorship_penalties
+            ):
+                self.manager_dictatorship_penalties[manager] = DictatorshipPenalizer(
+                    choice_to_ranking={
+                        substation: len(action_converter.all_actions)
+                        for substation, action_converter in self.substation_to_action_converter.items()
+                    },
+                    **self.architecture.pop.dictatorship_penalty
+                )
+
     def my_act(
         self,
         transformed_observation: Tuple[
@@ -256,150 +424,274 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
         By calling act(observation) you are actually calling my_act(convert_obs(observation))
         This method is inherited from AgentWithConverter from Grid2Op
         """
-
-        graph: nx.Graph
-        self.factored_observation, graph = transformed_observation
-
-        self.log_graph(graph, self.train_steps)
-
-        # Update Communities
-        # At each episode the community detection algorithm is reset by setting old_graph to None
-        self.communities, self.community_to_manager = (
-            self._update_communities(graph)
-            if self.old_graph is None
-            else self._update_communities(self.old_graph, graph)
+        (encoded_action,), (episode_state,) = self.my_act_batch(
+            [transformed_observation], [reward], [done], [self.get_episode_state()]
         )
+        self.set_episode_state(episode_state)
+        return encoded_action
+
+    def my_act_batch(
+        self,
+        transformed_observations: List[
+            Tuple[Dict[Substation, Optional[dgl.DGLHeteroGraph]], nx.Graph]
+        ],
+        rewards: List[float],
+        dones: List[bool],
+        episode_states: List[Dict[str, Any]],
+    ) -> Tuple[List[EncodedAction], List[Dict[str, Any]]]:
+        """
+        Same as my_act() for several environments, each one with its own episode state.
+        Agents, managers and the head manager are queried once for all the environments
+        and answer with one batched forward pass each.
+        Returns the action and the new episode state of every environment.
+        """
+        episode_states = list(episode_states)
+        graphs: List[nx.Graph] = []
+        for env, (factored_observation, graph) in enumerate(transformed_observations):
+            self.set_episode_state(episode_states[env])
+            self.factored_observation = factored_observation
+
+            self.log_graph(graph, self.train_steps)
+
+            # Update Communities
+            # At each episode the community detection algorithm is reset by setting old_graph to None
+            self.communities, self.community_to_manager = (
+                self._update_communities(graph)
+                if self.old_graph is None
+                else self._update_communities(self.old_graph, graph)
+            )
 
-        self.old_graph = graph.copy()
+            self.old_graph = graph.copy()
+            episode_states[env] = self.get_episode_state()
+            graphs.append(graph)
 
         # Actions retrieved are encoded with local agent converters
         # need to be remapped to the global converter
-        (
-            self.substation_to_local_action,
-            substation_to_q_values,
-        ) = self._get_agent_actions(self.factored_observation)
-
-        # Split graph into communities
-        (
-            self.sub_graphs,
-            self.substation_to_encoded_action,
-        ) = self._compute_managers_sub_graphs(
-            graph=graph, substation_to_local_action=self.substation_to_local_action
+        agent_answers: List[
+            Tuple[Dict[Substation, int], Optional[Dict[Substation, float]]]
+        ] = self._get_agent_actions_batch(
+            [episode_state["factored_observation"] for episode_state in episode_states]
         )
 
+        for env, graph in enumerate(graphs):
+            self.set_episode_state(episode_states[env])
+            self.substation_to_local_action = agent_answers[env][0]
+
+            # Split graph into communities
+            (
+                self.sub_graphs,
+                self.substation_to_encoded_action,
+            ) = self._compute_managers_sub_graphs(
+                graph=graph, substation_to_local_action=self.substation_to_local_action
+            )
+            episode_states[env] = self.get_episode_state()
+
         # Managers chooses the best substation for each community they handle
-        self.community_to_substation, community_to_q_values = self._get_manager_actions(
-            graph,
-            self.sub_graphs,
-            self.substation_to_encoded_action,
-            self.communities,
-            self.community_to_manager,
+        manager_answers: List[
+            Tuple[
+                Dict[Community, Substation],
+                Optional[Dict[Community, float]],
+                Optional[Dict[Community, th.Tensor]],
+            ]
+        ] = self._get_manager_actions_batch(
+            graphs,
+            [episode_state["sub_graphs"] for episode_state in episode_states],
+            [
+                episode_state["substation_to_encoded_action"]
+                for episode_state in episode_states
+            ],
+            [episode_state["communities"] for episode_state in episode_states],
+            [episode_state["community_to_manager"] for episode_state in episode_states],
         )
 
-        # Build a summarized graph by mapping communities to supernode
-        self.summarized_graph = self._compute_summarized_graph(
-            graph=graph,
-            sub_graphs=self.sub_graphs,
-            substation_to_encoded_action=self.substation_to_encoded_action,
-            community_to_substation=self.community_to_substation,
-        )
+        for env, graph in enumerate(graphs):
+            self.set_episode_state(episode_states[env])
+            self.community_to_substation = manager_answers[env][0]
+
+            # Build a summarized graph by mapping communities to supernode
+            self.summarized_graph = self._compute_summarized_graph(
+                graph=graph,
+                sub_graphs=self.sub_graphs,
+                substation_to_encoded_action=self.substation_to_encoded_action,
+                community_to_substation=self.community_to_substation,
+                community_to_embedding=manager_answers[env][2],
+            )
+            episode_states[env] = self.get_episode_state()
 
         # The head manager chooses the best action from every community given the summarized graph
-        self.chosen_node, chosen_node_q_value = self.get_action(self.summarized_graph)
-        chosen_node_features = self.summarized_graph.ndata[
-            self.architecture.pop.head_manager_embedding_name
-        ][self.chosen_node]
-        self.chosen_action = int(chosen_node_features[-1].item())
-        self.chosen_community = frozenset(
-            [
-                idx
-                for idx, one_hot in enumerate(
-                    chosen_node_features[-(1 + self.env.n_sub * 2) : -1].tolist()
+        head_manager_answers: List[Tuple[int, Optional[float]]] = self.get_actions(
+            [episode_state["summarized_graph"] for episode_state in episode_states]
+        )
+
+        # Names and exploration logs are the same for every environment
+        (
+            manager_to_name,
+            manager_explorations,
+            agent_names,
+            agent_explorations,
+        ) = self._get_names_and_explorations(
+            list(
+                dict.fromkeys(
+                    manager
+                    for episode_state in episode_states
+                    for manager in episode_state["community_to_manager"].values()
                 )
-                if one_hot == 1
-            ]
+            )
         )
 
+        encoded_actions: List[EncodedAction] = []
+        for env in range(len(graphs)):
+            self.set_episode_state(episode_states[env])
+            _, community_to_q_values, _ = manager_answers[env]
+            substation_to_q_values = agent_answers[env][1]
+
+            self.chosen_node, chosen_node_q_value = head_manager_answers[env]
+            chosen_node_features = self.summarized_graph.ndata[
+                self.architecture.pop.head_manager_embedding_name
+            ][self.chosen_node]
+            self.chosen_action = int(chosen_node_features[-1].item())
+            self.chosen_community = frozenset(
+                [
+                    idx
+                    for idx, one_hot in enumerate(
+                        chosen_node_features[-(1 + self.env.n_sub * 2) : -1].tolist()
+                    )
+                    if one_hot == 1
+                ]
+            )
+
+            community_to_names: Dict[Community, str] = {
+                community: manager_to_name[manager]
+                for community, manager in self.community_to_manager.items()
+            }
+
+            if self.action_detector.is_repeated(self.chosen_action):
+                self.chosen_action = 0
+
+            # Log to Tensorboard
+            self.log_system_behaviour(
+                best_action=self.chosen_action,
+                head_manager_action=self.chosen_node,
+                head_manager_q_value=chosen_node_q_value,
+                manager_actions={
+                    community: (action, community_to_names[community])
+                    for community, action in self.community_to_substation.items()
+                },
+                manager_q_values={
+                    community: (action, community_to_names[community])
+                    for community, action in community_to_q_values.items()
+                }
+                if community_to_q_values
+                else None,
+                agent_actions={
+                    agent_names[sub]: action
+                    for sub, action in self.substation_to_local_action.items()
+                },
+                agent_q_values={
+                    agent_names[sub]: q_value
+                    for sub, q_value in substation_to_q_values.items()
+                }
+                if substation_to_q_values
+                else None,
+                manager_explorations={
+                    manager_to_name[manager]: manager_explorations[manager]
+                    for manager in self.community_to_manager.values()
+                },
+                agent_explorations=agent_explorations,
+                train_steps=self.train_steps,
+            )
+
+            if not self.training:
+                self.train_steps += 1
+
+            encoded_actions.append(self.chosen_action)
+            episode_states[env] = self.get_episode_state()
+
+        return encoded_actions, episode_states
+
+    def _get_names_and_explorations(
+        self, managers: List[Manager]
+    ) -> Tuple[
+        Dict[Manager, str],
+        Dict[Manager, Dict[str, Any]],
+        Dict[Substation, str],
+        Dict[str, Dict[str, Any]],
+    ]:
+        """
+        Logged names and exploration logs of the given managers and of every agent
+        """
         manager_names: List[str] = ray.get(
-            [
-                manager.get_name.remote()
-                for manager in list(self.community_to_manager.values())
-            ]
+            [manager.get_name.remote() for manager in managers]
         )
-        manager_names: List[str] = [
-            "_".join(name.split("_")[0:2]) for name in manager_names
-        ]
-        community_to_names: Dict[Community, str] = {
-            community: manager_names[idx]
-            for idx, community in enumerate(list(self.community_to_manager.keys()))
+        manager_to_name: Dict[Manager, str] = {
+            manager: "_".join(name.split("_")[0:2])
+            for manager, name in zip(managers, manager_names)
         }
+        manager_explorations: Dict[Manager, Dict[str, Any]] = dict(
+            zip(
+                managers,
+                ray.get(
+                    [manager.get_exploration_logs.remote() for manager in managers]
+                ),
+            )
+        )
 
-        agent_names: Dict[Substation, str] = {
-            sub: "_".join(ray.get(agent.get_name.remote()).split("_")[0:2])
+        remote_agents: Dict[Substation, ClientActorHandle] = {
+            sub: agent
             for sub, agent in self.substation_to_agent.items()
             if type(agent) is ClientActorHandle
         }
-
-        if self.action_detector.is_repeated(self.chosen_action):
-            self.chosen_action = 0
-
-        # Log to Tensorboard
-        self.log_system_behaviour(
-            best_action=self.chosen_action,
-            head_manager_action=self.chosen_node,
-            head_manager_q_value=chosen_node_q_value,
-            manager_actions={
-                community: (action, community_to_names[community])
-                for community, action in self.community_to_substation.items()
-            },
-            manager_q_values={
-                community: (action, community_to_names[community])
-                for community, action in community_to_q_values.items()
-            }
-            if community_to_q_values
-            else None,
-            agent_actions={
-                agent_names[sub]: action
-                for sub, action in self.substation_to_local_action.items()
-            },
-            agent_q_values={
-                agent_names[sub]: q_value
-                for sub, q_value in substation_to_q_values.items()
-            }
-            if substation_to_q_values
-            else None,
-            manager_explorations={
-                name: exploration_state
-                for name, exploration_state in zip(
-                    manager_names,
-                    ray.get(
-                        [
-                            manager.get_exploration_logs.remote()
-                            for manager in self.community_to_manager.values()
-                        ]
-                    ),
-                )
-            },
-            agent_explorations={
-                name: exploration_state
-                for name, exploration_state in zip(
-                    agent_names.values(),
-                    ray.get(
-                        [
-                            agent.get_exploration_logs.remote()
-                            for agent in self.substation_to_agent.values()
-                            if type(agent) is ClientActorHandle
-                        ]
-                    ),
+        agent_names: Dict[Substation, str] = {
+            sub: "_".join(name.split("_")[0:2])
+            for sub, name in zip(
+                remote_agents.keys(),
+                ray.get([agent.get_name.remote() for agent in remote_agents.values()]),
+            )
+        }
+        agent_explorations: Dict[str, Dict[str, Any]] = {
+            name: exploration_state
+            for name, exploration_state in zip(
+                agent_names.values(),
+                ray.get(
+                    [
+                        agent.get_exploration_logs.remote()
+                        for agent in remote_agents.values()
+                    ]
+                ),
+            )
+        }
+        if self.agent_pools is not None:
+            # Pooled agent names are fixed at pool creation
+            # Exploration logs take one call per pool
+            agent_names.update(
+                {
+                    sub: "_".join(name.split("_")[0:2])
+                    for sub, name in self.pooled_agent_names.items()
+                }
+            )
+            for pool_exploration_logs in ray.get(
+                [pool.get_exploration_logs.remote() for pool in self.agent_pools]
+            ):
+                agent_explorations.update(
+                    {
+                        agent_names[sub]: exploration_state
+                        for sub, exploration_state in pool_exploration_logs.items()
+                    }
                 )
-            },
-            train_steps=self.train_steps,
-        )
 
-        if not self.training:
-            self.train_steps += 1
+        return manager_to_name, manager_explorations, agent_names, agent_explorations
 
-        return self.chosen_action
+    def set_rollout_environments(self, environments: int) -> None:
+        """
+        Sizes the observation and community index caches for that many environments acting at once,
+        see train_with_rollout_workers()
+        """
+        # The current and the next observation of every environment are converted during one tick
+        self.observation_converter = ObservationConverter(
+            cache_size=max(4, 2 * environments)
+        )
+        # Each environment hands its last partition back to the community detector
+        self.community_detector.indexes.size(max(4, environments))
 
     def convert_obs(
         self, observation: BaseObservation
@@ -412,18 +704,14 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
         """
 
         # Observation as a "normal graph"
-        observation_graph: nx.Graph = observation.as_networkx()
+        observation_graph: ObservationGraph = self.observation_converter(observation)
 
         # Observation is factored for each agent by taking the ego_graph of each substation
-        factored_observation: Dict[Substation, dgl.DGLHeteroGraph] = factor_observation(
-            obs_graph=observation_graph,
-            node_features=self.node_features,
-            edge_features=self.edge_features,
-            device=str(self.device),
-            radius=self.architecture.pop.agent_neighbourhood_radius,
-        )
+        factored_observation: Dict[
+            Substation, dgl.DGLHeteroGraph
+        ] = self.observation_factorizer(observation_graph)
 
-        return factored_observation, observation_graph
+        return factored_observation, observation_graph.to_networkx()
 
     def step(
         self,
@@ -571,24 +859,21 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
         else:
 
             # Normal graph of the next_observation
-            next_graph: nx.Graph = next_observation.as_networkx()
+            next_observation_graph: ObservationGraph = self.observation_converter(
+                next_observation
+            )
+            next_graph: nx.Graph = next_observation_graph.to_networkx()
 
             # Community structure is updated and managers are assigned to the new communities
             # By taking the most similar communities wrt the old mappings
             next_communities, next_community_to_manager = self._update_communities(
-                observation.as_networkx(), next_graph
+                self.observation_converter(observation).to_networkx(), next_graph
             )
 
             # Factor next_observation for each agent
             next_factored_observation: Dict[
                 Substation, Optional[dgl.DGLHeteroGraph]
-            ] = factor_observation(
-                obs_graph=next_graph,
-                node_features=self.node_features,
-                edge_features=self.edge_features,
-                device=str(self.device),
-                radius=self.architecture.pop.agent_neighbourhood_radius,
-            )
+            ] = self.observation_factorizer(next_observation_graph)
 
             # Query agents for action
             next_substation_to_local_actions, _ = self._get_agent_actions(
@@ -658,12 +943,19 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
         Children may use this as a starting point for reporting system state
         """
 
-        agents_state: List[Dict[str, Any]] = [
-            ray.get(agent.get_state.remote())
+        agents_state: Dict[Substation, Dict[str, Any]] = {
+            sub_id: ray.get(agent.get_state.remote())
             if type(agent) is ClientActorHandle
             else agent.get_state()
-            for _, agent in self.substation_to_agent.items()
-        ]
+            for sub_id, agent in self.substation_to_agent.items()
+        }
+        if self.agent_pools is not None:
+            # Pooled agents are saved exactly as standalone ones
+            # So that checkpoints can be loaded with or without pools
+            for pool_state in ray.get(
+                [pool.get_state.remote() for pool in self.agent_pools]
+            ):
+                agents_state.update(pool_state)
 
         managers_state: List[Dict[str, Any]] = ray.get(
             [manager.get_state.remote() for manager in self.managers_history.keys()]
@@ -672,18 +964,18 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
             [manager.get_name.remote() for manager in self.managers_history.keys()]
         )
         return {
-            "agents_state": {
-                sub_id: agent_state
-                for sub_id, agent_state in zip(
-                    list(self.substation_to_agent.keys()), agents_state
-                )
-            },
+            "agents_state": agents_state,
             "managers_state": {
                 manager_name: (state, self.managers_history[manager])
                 for manager, manager_name, state in zip(
                     list(self.managers_history.keys()), managers_name, managers_state
                 )
             },
+            **self._get_system_state(),
+        }
+
+    def _get_system_state(self) -> Dict[str, Any]:
+        return {
             "node_features": self.node_features,
             "edge_features": self.edge_features,
             "train_steps": self.train_steps,
@@ -698,6 +990,109 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
             "device": str(self.device),
         }
 
+    def save(self) -> None:
+        self.save_sharded(self._next_checkpoint_file())
+
+    def save_sharded(
+        self, checkpoint_file: str, extra_state: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """
+        Same checkpoint as get_state() written off the training loop.
+        Each agent and manager writes its own shard in the background,
+        the driver only writes the manifest: the system state where agent and manager states
+        are references to their shard, stored in a directory next to checkpoint_file.
+        The manifest is committed atomically once every shard is written,
+        interrupted checkpoints have no manifest and are never loaded.
+        """
+        # One checkpoint at a time, so that the shards of an actor are written in order
+        self.checkpoint_committer.wait()
+
+        shards_directory = Path(checkpoint_file).with_name(
+            Path(checkpoint_file).stem + "_shards"
+        )
+        shards_directory.mkdir(parents=True, exist_ok=True)
+        manifest, shard_requests, shards_written = self._save_shards(shards_directory)
+        if extra_state is not None:
+            manifest.update(extra_state)
+
+        def all_shards_written() -> bool:
+            # Polled only once every actor has started writing its shard
+            ray.get(shard_requests)
+            return all(ray.get([written.remote() for written in shards_written]))
+
+        self.checkpoint_committer.commit(
+            manifest, checkpoint_file, str(shards_directory), all_shards_written
+        )
+
+    def wait_for_checkpoint(self) -> None:
+        self.checkpoint_committer.wait()
+
+    def _save_shards(
+        self, shards_directory: Path
+    ) -> Tuple[Dict[str, Any], List[ray.ObjectRef], List[Any]]:
+        """
+        Starts writing the shard of every agent and manager
+        Returns the manifest, the pending shard requests
+        and the remote methods telling whether the shards are written
+        Children may extend the manifest with their own shards
+        """
+
+        def shard(file_name: str) -> Tuple[str, Dict[str, str]]:
+            return (
+                str(Path(shards_directory, file_name)),
+                shard_reference(str(Path(shards_directory.name, file_name))),
+            )
+
+        shard_requests: List[ray.ObjectRef] = []
+        shards_written: List[Any] = []
+
+        agents_state: Dict[Substation, Dict[str, Any]] = {}
+        for sub_id, agent in self.substation_to_agent.items():
+            if isinstance(agent, RayShallowGCNAgent):
+                # No-action agents have no network to save
+                agents_state[sub_id] = agent.get_state()
+                continue
+            shard_file, agents_state[sub_id] = shard("agent_" + str(sub_id) + ".pt")
+            shard_requests.append(agent.save_shard.remote(shard_file))
+            shards_written.append(agent.shard_written)
+
+        if self.agent_pools is not None:
+            for pool in self.agent_pools:
+                substation_to_shard_file: Dict[Substation, str] = {}
+                for sub_id, sub_pool in self.substation_to_pool.items():
+                    if sub_pool is pool:
+                        shard_file, agents_state[sub_id] = shard(
+                            "agent_" + str(sub_id) + ".pt"
+                        )
+                        substation_to_shard_file[sub_id] = shard_file
+                shard_requests.append(pool.save_shards.remote(substation_to_shard_file))
+                shards_written.append(pool.shards_written)
+
+        managers: List[Manager] = list(self.managers_history.keys())
+        managers_name: List[str] = ray.get(
+            [manager.get_name.remote() for manager in managers]
+        )
+        managers_state: Dict[str, Tuple[Dict[str, str], FixedSet]] = {}
+        for manager, manager_name in zip(managers, managers_name):
+            shard_file, reference = shard(manager_name + ".pt")
+            shard_requests.append(manager.save_shard.remote(shard_file))
+            shards_written.append(manager.shard_written)
+            # Histories keep changing while the manifest waits for the shards
+            managers_state[manager_name] = (
+                reference,
+                copy.deepcopy(self.managers_history[manager]),
+            )
+
+        return (
+            {
+                "agents_state": agents_state,
+                "managers_state": managers_state,
+                **copy.deepcopy(self._get_system_state()),
+            },
+            shard_requests,
+            shards_written,
+        )
+
     def _get_substation_to_agent_mapping(
         self, substation_to_action_space: Dict[Substation, List[int]]
     ) -> Dict[int, IdToAct]:
@@ -727,45 +1122,164 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
         """
         Query each agent for 1 action
         """
+        return self._get_agent_actions_batch([factored_observation])[0]
+
+    def _get_agent_actions_batch(
+        self, factored_observations: List[Dict[Substation, dgl.DGLHeteroGraph]]
+    ) -> List[Tuple[Dict[Substation, int], Optional[Dict[Substation, float]]]]:
+        """
+        Query each agent for 1 action in each environment
+        Every agent answers the observations of all environments in one call
+        """
         # Observations are None in case the neighbourhood is empty (e.g. isolated nodes)
         # In such case no_action (id = 0) is selected
         # Each agent returns an action for its associated Substation
 
         if self.pre_train:
-            return {substation: 0 for substation in factored_observation.keys()}, None
+            return [
+                ({substation: 0 for substation in factored_observation.keys()}, None)
+                for factored_observation in factored_observations
+            ]
+
+        # Observations of each substation, in environment order
+        substation_to_observations: Dict[Substation, List[dgl.DGLHeteroGraph]] = {}
+        for factored_observation in factored_observations:
+            for sub_id, observation in factored_observation.items():
+                substation_to_observations.setdefault(sub_id, []).append(observation)
+
+        remote_substations: List[Substation] = [
+            sub
+            for sub in substation_to_observations.keys()
+            if type(self.substation_to_agent.get(sub)) is ClientActorHandle
+        ]
+        pool_to_observations: Dict[
+            AgentPool, Dict[Substation, List[dgl.DGLHeteroGraph]]
+        ] = self._group_by_pool(substation_to_observations)
 
-        actions_taken = ray.get(
+        # One promise per standalone agent, one promise per pool
+        answers = ray.get(
             [
-                self.substation_to_agent[sub_id].take_action.remote(observation)
-                for sub_id, observation in factored_observation.items()
-                if type(self.substation_to_agent[sub_id]) is ClientActorHandle
+                self.substation_to_agent[sub_id].take_actions.remote(
+                    substation_to_observations[sub_id]
+                )
+                for sub_id in remote_substations
+            ]
+            + [
+                pool.take_actions.remote(observations)
+                for pool, observations in pool_to_observations.items()
             ]
         )
 
-        actions, q_values = zip(*actions_taken)
+        substation_to_actions_taken: Dict[Substation, List[Tuple[int, float]]] = dict(
+            zip(remote_substations, answers[: len(remote_substations)])
+        )
+        for pool_actions_taken in answers[len(remote_substations) :]:
+            substation_to_actions_taken.update(pool_actions_taken)
 
-        return {
-            sub_id: action
-            for sub_id, action in zip(
-                [
-                    sub
-                    for sub in factored_observation.keys()
-                    if type(self.substation_to_agent[sub]) is ClientActorHandle
-                ],
-                actions,
+        # Answers of each substation are consumed in environment order
+        substation_to_answers = {
+            sub_id: iter(actions_taken)
+            for sub_id, actions_taken in substation_to_actions_taken.items()
+        }
+        agent_actions: List[
+            Tuple[Dict[Substation, int], Optional[Dict[Substation, float]]]
+        ] = []
+        for factored_observation in factored_observations:
+            substation_to_action_taken: Dict[Substation, Tuple[int, float]] = {
+                sub_id: next(substation_to_answers[sub_id])
+                for sub_id in factored_observation.keys()
+                if sub_id in substation_to_answers
+            }
+            agent_actions.append(
+                (
+                    {
+                        sub_id: action
+                        for sub_id, (action, _) in substation_to_action_taken.items()
+                    },
+                    {
+                        sub_id: q_value
+                        for sub_id, (_, q_value) in substation_to_action_taken.items()
+                    },
+                )
             )
-        }, {
-            sub_id: q_value
-            for sub_id, q_value in zip(
-                [
-                    sub
-                    for sub in factored_observation.keys()
-                    if type(self.substation_to_agent[sub]) is ClientActorHandle
-                ],
-                q_values,
+        return agent_actions
+
+    def _group_by_pool(
+        self, substation_to_value: Dict[Substation, Any]
+    ) -> Dict[AgentPool, Dict[Substation, Any]]:
+        pool_to_values: Dict[AgentPool, Dict[Substation, Any]] = {}
+        if self.substation_to_pool is None:
+            return pool_to_values
+        for sub_id, value in substation_to_value.items():
+            if sub_id in self.substation_to_pool:
+                pool_to_values.setdefault(self.substation_to_pool[sub_id], {})[
+                    sub_id
+                ] = value
+        return pool_to_values
+
+    def _initialize_agent_pools(
+        self, substation_to_action_space: Dict[Substation, List[int]]
+    ) -> None:
+        """
+        Split substation agents into pools of agents_per_pool agents
+        Agents with at most one action stay local as in the unpooled case
+        """
+        pooled_substations: List[Substation] = [
+            sub_id
+            for sub_id, action_space in substation_to_action_space.items()
+            if len(action_space) > 1
+        ]
+        self.pooled_agent_names = {
+            sub_id: "agent_" + str(sub_id) + "_" + self.name
+            for sub_id in pooled_substations
+        }
+        self.substation_to_agent = {
+            sub_id: RayShallowGCNAgent(
+                name="agent_" + str(sub_id) + "_" + self.name,
+                device=self.device,
             )
+            for sub_id, action_space in substation_to_action_space.items()
+            if len(action_space) <= 1
         }
 
+        pool_size: int = self.architecture.pop.agents_per_pool
+        self.agent_pools = []
+        self.substation_to_pool = {}
+        for first_sub in range(0, len(pooled_substations), pool_size):
+            pool_substations = pooled_substations[first_sub : first_sub + pool_size]
+            pool = AgentPool.remote(
+                {
+                    sub_id: dict(
+                        agent_actions=len(substation_to_action_space[sub_id]),
+                        architecture=self.architecture.agent,
+                        node_features=self.node_features,
+                        edge_features=self.edge_features,
+                        name=self.pooled_agent_names[sub_id],
+                        training=self.training,
+                        device=self.device,
+                        feature_ranges=self.feature_ranges,
+                    )
+                    for sub_id in pool_substations
+                },
+                ensemble=self.architecture.pop.agent_ensemble,
+            )
+            self.agent_pools.append(pool)
+            self.substation_to_pool.update(
+                {sub_id: pool for sub_id in pool_substations}
+            )
+
+    def load_agent_pools_state(
+        self,
+        agents_state: Dict[Substation, Dict[str, Any]],
+        reset_exploration: bool = False,
+    ) -> None:
+        ray.get(
+            [
+                pool.load_state.remote(pool_agents_state, reset_exploration)
+                for pool, pool_agents_state in self._group_by_pool(agents_state).items()
+            ]
+        )
+
     def _get_manager_actions(
         self,
         graph: nx.Graph,
@@ -773,52 +1287,124 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
         substation_to_encoded_action: Dict[Substation, EncodedAction],
         communities: List[Community],
         community_to_manager: Dict[Community, Manager],
-    ) -> Tuple[Dict[Community, Substation], Optional[Dict[Community, float]]]:
+    ) -> Tuple[
+        Dict[Community, Substation],
+        Optional[Dict[Community, float]],
+        Optional[Dict[Community, th.Tensor]],
+    ]:
         """
         Query one action per community
+        Together with the Q value and the community embedding computed by the same manager forward pass
+        """
+        return self._get_manager_actions_batch(
+            [graph],
+            [community_to_sub_graphs_dict],
+            [substation_to_encoded_action],
+            [communities],
+            [community_to_manager],
+        )[0]
+
+    def _get_manager_actions_batch(
+        self,
+        graphs: List[nx.Graph],
+        community_to_sub_graphs_dicts: List[Dict[Community, dgl.DGLHeteroGraph]],
+        substation_to_encoded_actions: List[Dict[Substation, EncodedAction]],
+        communities_list: List[List[Community]],
+        community_to_managers: List[Dict[Community, Manager]],
+    ) -> List[
+        Tuple[
+            Dict[Community, Substation],
+            Optional[Dict[Community, float]],
+            Optional[Dict[Community, th.Tensor]],
+        ]
+    ]:
+        """
+        Same as _get_manager_actions() in each environment
+        Every manager answers the communities it handles in all environments in one call
         """
         if self.pre_train:
-            return {
-                community: random.sample(community, 1)[0]
-                for community in community_to_sub_graphs_dict.keys()
-            }, None
+            return [
+                (
+                    {
+                        community: random.sample(community, 1)[0]
+                        for community in community_to_sub_graphs_dict.keys()
+                    },
+                    None,
+                    None,
+                )
+                for community_to_sub_graphs_dict in community_to_sub_graphs_dicts
+            ]
 
         # Managers are queried for an action
         # Each manager chooses one action for each community she handles
 
-        enabled_nodes = [
-            node
-            for community in communities
-            for node in community
-            if not self.architecture.pop.manager_remove_no_action
-            or len(
-                self.substation_to_action_converter[
-                    graph.nodes[node]["sub_id"]
-                ].all_actions
+        substation_to_actions: Dict[Substation, int] = {
+            substation: len(action_converter.all_actions)
+            for substation, action_converter in self.substation_to_action_converter.items()
+        }
+        # (environment, community) handled by each manager, with its sub graph and mask
+        manager_to_queries: Dict[
+            Manager, List[Tuple[int, Community, dgl.DGLHeteroGraph, frozenset]]
+        ] = {}
+        for env, (graph, communities) in enumerate(zip(graphs, communities_list)):
+            community_to_mask: Dict[Community, frozenset] = manager_masks(
+                graph,
+                communities,
+                substation_to_actions,
+                self.architecture.pop.manager_remove_no_action,
             )
-            > 1
+            for community in communities:
+                manager_to_queries.setdefault(
+                    community_to_managers[env][community], []
+                ).append(
+                    (
+                        env,
+                        community,
+                        community_to_sub_graphs_dicts[env][community],
+                        community_to_mask[community],
+                    )
+                )
+
+        answers = ray.get(
+            [
+                manager.take_actions_with_embedding.remote(
+                    transformed_observations=[
+                        sub_graph for _, _, sub_graph, _ in queries
+                    ],
+                    masks=[mask for _, _, _, mask in queries],
+                )
+                for manager, queries in manager_to_queries.items()
+            ]
+        )
+
+        env_to_answers: List[Dict[Community, Tuple[int, float, th.Tensor]]] = [
+            {} for _ in graphs
         ]
+        for queries, manager_answers in zip(manager_to_queries.values(), answers):
+            for (env, community, _, _), answer in zip(queries, manager_answers):
+                env_to_answers[env][community] = answer
 
-        actions, q_values = zip(
-            *ray.get(
-                [
-                    community_to_manager[community].take_action.remote(
-                        transformed_observation=community_to_sub_graphs_dict[community],
-                        mask=frozenset(
-                            [node for node in community if node in enabled_nodes]
-                            if set(community).intersection(set(enabled_nodes))
-                            else [list(community)[0]]
-                        ),
-                    )
+        return [
+            (
+                {
+                    community: graph.nodes.data()[community_answers[community][0]][
+                        "sub_id"
+                    ]
                     for community in communities
-                ],
+                },
+                {
+                    community: community_answers[community][1]
+                    for community in communities
+                },
+                {
+                    community: community_answers[community][2]
+                    for community in communities
+                },
             )
-        )
-
-        return {
-            community: graph.nodes.data()[action]["sub_id"]
-            for community, action in zip(communities, actions)
-        }, {community: q_value for community, q_value in zip(communities, q_values)}
+            for graph, communities, community_answers in zip(
+                graphs, communities_list, env_to_answers
+            )
+        ]
 
     def _compute_managers_sub_graphs(
         self,
@@ -826,34 +1412,20 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
         substation_to_local_action: Dict[Substation, int],
         new_communities: Optional[List[Community]] = None,
     ) -> Tuple[Dict[Community, dgl.DGLHeteroGraph], Dict[Substation, EncodedAction]]:
-        substation_to_encoded_action: Dict[Substation, EncodedAction] = {
-            sub_id: self._lookup_local_action(
-                self.substation_to_action_converter[sub_id].all_actions[local_action]
-            )
-            for sub_id, local_action in substation_to_local_action.items()
-        }
+        substation_to_encoded_action: Dict[
+            Substation, EncodedAction
+        ] = lookup_local_actions(self.action_lookup_array, substation_to_local_action)
 
         # Each agent is assigned to its chosen action
-        nx.set_node_attributes(
-            graph,
-            {
-                node_id: {
-                    "action": substation_to_encoded_action[node_data["sub_id"]]
-                    if substation_to_encoded_action.get(node_data["sub_id"])
-                    else 0,
-                }
-                for node_id, node_data in graph.nodes.data()
-            },
-        )
-
         return (
-            split_graph_into_communities(
+            split_graph_with_actions(
                 graph=graph,
-                node_features=self.node_features + ["action"],
-                edge_features=self.edge_features,
+                substation_to_encoded_action=substation_to_encoded_action,
                 communities=self.communities
                 if new_communities is None
                 else new_communities,
+                node_features=self.node_features,
+                edge_features=self.edge_features,
                 device=str(self.device),
             ),
             substation_to_encoded_action,
@@ -867,21 +1439,20 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
         community_to_substation: Dict[Community, Substation],
         new_communities: Optional[List[Community]] = None,
         new_community_to_manager_dict: Optional[Dict[Community, Manager]] = None,
+        community_to_embedding: Optional[Dict[Community, th.Tensor]] = None,
     ):
         # The graph is summarized by contracting every community in 1 supernode
         # And storing the embedding of each manager in each supernode as node feature
         # Together with the action chosen by the manager
         return self._summarize_graph(
             graph,
-            {
-                community: substation_to_encoded_action[substation]
-                if substation_to_encoded_action.get(substation)
-                else 0
-                for community, substation in community_to_substation.items()
-            },
+            community_encoded_actions(
+                community_to_substation, substation_to_encoded_action
+            ),
             sub_graphs,
             new_communities=new_communities,
             new_community_to_manager_dict=new_community_to_manager_dict,
+            community_to_embedding=community_to_embedding,
         ).to(self.device)
 
     @staticmethod
@@ -922,28 +1493,11 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
                 for idx in range(len(new_communities))
             ]
 
-            if self.architecture.pop.incentives:
-                # TODO: find a way to model manager importance, for now they are all the same
-                # TODO: care that manager importance may change with time due to dynamic community structure
-                for manager in managers:
-                    self.manager_incentives.add_agent(manager, 1)
-
-            if self.architecture.pop.dictatorship_penalty:
-                for manager in managers:
-                    self.manager_dictatorship_penalties[
-                        manager
-                    ] = DictatorshipPenalizer(
-                        choice_to_ranking={
-                            substation: len(action_converter.all_actions)
-                            for substation, action_converter in self.substation_to_action_converter.items()
-                        },
-                        **self.architecture.pop.dictatorship_penalty
-                    )
-
             self.managers_history = {
                 manager: FixedSet(int(self.architecture.pop.manager_history_size))
                 for manager in managers
             }
+            self._register_managers()
             return {
                 community: manager
                 for community, manager in zip(new_communities, managers)
@@ -954,15 +1508,9 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
                     (
                         community,
                         max(
-                            [
-                                max(
-                                    [
-                                        self._jaccard_distance(old_community, community)
-                                        for old_community in community_history
-                                    ]
-                                )
-                                for manager, community_history in self.managers_history.items()
-                            ]
+                            self.managers_history_index.max_jaccard(
+                                self.managers_history, community
+                            ).values()
                         ),
                     )
                     for community in new_communities
@@ -983,20 +1531,7 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
                 self.managers_history[manager] = FixedSet(
                     int(self.architecture.pop.manager_history_size)
                 )
-                if self.architecture.pop.incentives:
-                    # TODO: find a way to model manager importance, for now they are all the same
-                    self.manager_incentives.add_agent(manager, 1)
-
-                if self.architecture.pop.dictatorship_penalty:
-                    self.manager_dictatorship_penalties[
-                        manager
-                    ] = DictatorshipPenalizer(
-                        choice_to_ranking={
-                            substation: len(action_converter.all_actions)
-                            for substation, action_converter in self.substation_to_action_converter.items()
-                        },
-                        **self.architecture.pop.dictatorship_penalties
-                    )
+                self._register_managers()
 
                 return {most_distant_community: manager}
             else:
@@ -1029,25 +1564,21 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
         ] = self._initialize_new_manager(new_communities)
 
         for community, manager in updated_community_to_manager_dict.items():
-            self.managers_history[manager].add(community)
+            self.managers_history_index.add(self.managers_history, manager, community)
 
         for new_community in filter(
             lambda x: x not in updated_community_to_manager_dict.keys(), new_communities
         ):
-            manager_to_jaccard_dict = {
-                manager: max(
-                    [
-                        self._jaccard_distance(old_community, new_community)
-                        for old_community in communities
-                    ]
-                )
-                for manager, communities in self.managers_history.items()
-            }
+            manager_to_jaccard_dict = self.managers_history_index.max_jaccard(
+                self.managers_history, new_community
+            )
             updated_community_to_manager_dict[new_community] = max(
                 manager_to_jaccard_dict, key=manager_to_jaccard_dict.get
             )
-            self.managers_history[updated_community_to_manager_dict[new_community]].add(
-                new_community
+            self.managers_history_index.add(
+                self.managers_history,
+                updated_community_to_manager_dict[new_community],
+                new_community,
             )
 
         return new_communities, updated_community_to_manager_dict
@@ -1209,6 +1740,9 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
             if sub in selected_substations
         }
 
+        # Pooled agents are stepped with one call per pool
+        pooled_transitions: Dict[Substation, Dict[str, Any]] = {}
+
         if done:
             for sub_id, observation in factored_observation.items():
                 if sub_id in subs_to_agent_to_step.keys():
@@ -1224,6 +1758,19 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
                             stop_decay=stop_decay[sub_id],
                         )
                     )
+                elif (
+                    sub_id in self.pooled_agent_names and sub_id in selected_substations
+                ):
+                    pooled_transitions[sub_id] = dict(
+                        observation=observation,
+                        action=actions[sub_id],
+                        reward=reward + incentives[sub_id]
+                        if incentives is not None
+                        else reward,
+                        next_observation=dgl.DGLGraph(),
+                        done=done,
+                        stop_decay=stop_decay[sub_id],
+                    )
         else:
             for sub_id, observation in factored_observation.items():
                 next_observation: Optional[
@@ -1248,15 +1795,41 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
                         )
                     )
                     substations.append(sub_id)
+                elif (
+                    next_observation is not None
+                    and sub_id in self.pooled_agent_names
+                    and sub_id in selected_substations
+                ):
+                    pooled_transitions[sub_id] = dict(
+                        observation=observation,
+                        action=actions[sub_id],
+                        reward=reward + incentives[sub_id]
+                        if incentives is not None
+                        else reward,
+                        next_observation=next_observation,
+                        done=done,
+                        stop_decay=stop_decay[sub_id],
+                    )
 
         # Step the agents
-        losses, rewards = zip(*ray.get(step_promises))
+        pool_step_promises = [
+            pool.step.remote(transitions)
+            for pool, transitions in self._group_by_pool(pooled_transitions).items()
+        ]
+        step_answers = ray.get(step_promises)
         names = ray.get(
             [
                 subs_to_agent_to_step[substation].get_name.remote()
                 for substation in substations
             ]
         )
+        for pool_step_answers in ray.get(pool_step_promises):
+            for sub_id, step_answer in pool_step_answers.items():
+                step_answers.append(step_answer)
+                if not done:
+                    substations.append(sub_id)
+                    names.append(self.pooled_agent_names[sub_id])
+        losses, rewards = zip(*step_answers)
         self.log_step(
             losses=losses,
             implicit_rewards=[full_reward - reward for full_reward in rewards],
@@ -1267,9 +1840,6 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
             else None,
         )
 
-    def _lookup_local_action(self, action: BaseAction):
-        return self.action_lookup_table[HashableAction(action)]
-
     def _summarize_graph(
         self,
         graph: nx.Graph,
@@ -1277,6 +1847,7 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
         sub_graphs: Dict[Community, dgl.DGLHeteroGraph],
         new_communities: Optional[List[Community]] = None,
         new_community_to_manager_dict: Optional[Dict[Community, Manager]] = None,
+        community_to_embedding: Optional[Dict[Community, th.Tensor]] = None,
     ) -> dgl.DGLHeteroGraph:
 
         current_community_to_manager_dict = (
@@ -1285,63 +1856,38 @@ class BasePOP(AgentWithConverter, SerializableModule, LoggableModule):
             else new_community_to_manager_dict
         )
 
-        node_attribute_dict = {}
-        for community, sub_graph in sub_graphs.items():
-            node_embeddings = ray.get(
-                current_community_to_manager_dict[community].get_node_embeddings.remote(
-                    sub_graph
-                )
-            )
-            sub_graphs[community].ndata["node_embeddings"] = node_embeddings
-            for node in community:
-                node_attribute_dict[node] = {
-                    "embedding": dgl.mean_nodes(
-                        sub_graphs[community], "node_embeddings"
-                    )
-                    .squeeze()
-                    .detach(),
-                }
-            del sub_graphs[community].ndata["node_embeddings"]
+        communities = self.communities if new_communities is None else new_communities
 
-        nx.set_node_attributes(
-            graph,
-            node_attribute_dict,
-        )
+        if community_to_embedding is None:
+            # Embeddings were not computed together with the manager actions
+            # Every manager is queried at once
+            community_to_node_embeddings = ray.get(
+                [
+                    current_community_to_manager_dict[
+                        community
+                    ].get_node_embeddings.remote(sub_graph)
+                    for community, sub_graph in sub_graphs.items()
+                ]
+            )
+            community_to_embedding = {}
+            for (community, sub_graph), node_embeddings in zip(
+                sub_graphs.items(), community_to_node_embeddings
+            ):
+                sub_graph.ndata["node_embeddings"] = node_embeddings
+                community_to_embedding[community] = (
+                    dgl.mean_nodes(sub_graph, "node_embeddings").squeeze().detach()
+                )
+                del sub_graph.ndata["node_embeddings"]
 
         # Graph is summarized by contracting communities into supernodes
-        # Manager action is assigned to each supernode
-        summarized_graph: nx.graph = graph
-        for community in (
-            self.communities if new_communities is None else new_communities
-        ):
-            community_list = list(community)
-            for node in community_list[1:]:
-                summarized_graph = nx.contracted_nodes(
-                    summarized_graph, community_list[0], node
-                )
-            summarized_graph.nodes[community_list[0]][
-                self.architecture.pop.head_manager_embedding_name
-            ] = th.cat(
-                (
-                    th.sigmoid(summarized_graph.nodes[community_list[0]]["embedding"]),
-                    th.tensor(
-                        [
-                            1 if substation in community else 0
-                            for substation in range(self.env.n_sub * 2)
-                        ]
-                    ).to(self.device),
-                    th.tensor([manager_actions[community]]).to(self.device),
-                ),
-                dim=-1,
-            ).squeeze()
-
-        # The summarized graph is returned in DGL format
-        # Each supernode has the action chosen by its community manager
-        # And the contracted embedding
-        return dgl.from_networkx(
-            summarized_graph.to_directed(),
-            node_attrs=[self.architecture.pop.head_manager_embedding_name],
-            device=self.device,
+        return summarize_graph(
+            graph,
+            communities,
+            manager_actions,
+            community_to_embedding,
+            n_sub=self.env.n_sub,
+            embedding_name=self.architecture.pop.head_manager_embedding_name,
+            device=str(self.device),
         )
 
 
@@ -1394,4 +1940,83 @@ def train(
     print("\nSaving\n")
     dpop.writer.close()
     dpop.save()
+    dpop.wait_for_checkpoint()
+    ray.shutdown()
+
+
+def train_with_rollout_workers(
+    workers: RolloutWorkers,
+    iterations: int,
+    dpop: BasePOP,
+    save_frequency: int = 3600,
+):
+    """
+    Same as train() with one environment per rollout worker.
+    Every environment keeps its own episode state while agents and managers are shared:
+    their replay memories receive the transitions of every environment.
+    """
+    training_step: int = 0
+    dpop.set_rollout_environments(len(workers))
+    observations: List[BaseObservation] = workers.reset()
+    episode_states: List[Dict[str, Any]] = [
+        dpop.new_episode_state() for _ in range(len(workers))
+    ]
+    rewards: List[float] = [workers.reward_range[0]] * len(workers)
+    dones: List[bool] = [False] * len(workers)
+
+    last_save_time = time.time()
+    print(
+        "Collecting experience from "
+        + str(len(workers))
+        + " environments, model will be checkpointed every "
+        + str(save_frequency)
+        + " seconds"
+    )
+    with tqdm(total=iterations - training_step) as pbar:
+        while training_step < iterations:
+            # Agents, managers and the head manager answer every environment at once
+            encoded_actions, episode_states = dpop.my_act_batch(
+                [dpop.convert_obs(observation) for observation in observations],
+                rewards,
+                dones,
+                episode_states,
+            )
+            actions: List[BaseAction] = [
+                dpop.convert_act(encoded_action) for encoded_action in encoded_actions
+            ]
+
+            # Environments are simulated in parallel
+            for worker, (
+                next_observation,
+                reward,
+                done,
+                reset_observation,
+            ) in enumerate(workers.step(actions)):
+                dpop.set_episode_state(episode_states[worker])
+                dpop.step(
+                    action=encoded_actions[worker],
+                    observation=observations[worker],
+                    reward=reward,
+                    next_observation=next_observation,
+                    done=done,
+                )
+                episode_states[worker] = dpop.get_episode_state()
+                rewards[worker], dones[worker] = reward, done
+                observations[worker] = reset_observation if done else next_observation
+                if done:
+                    dpop.writer.flush()
+
+            training_step += len(workers)
+            pbar.update(len(workers))
+
+            if time.time() - last_save_time >= save_frequency:
+                print("Saving Checkpoint")
+                dpop.save()
+                last_save_time = time.time()
+
+    print("\nSaving\n")
+    workers.close()
+    dpop.writer.close()
+    dpop.save()
+    dpop.wait_for_checkpoint()
     ray.shutdown()
@@ -1,3 +1,5 @@
+import copy
+from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
 import dgl
@@ -9,19 +11,30 @@ from grid2op.Environment import BaseEnv
 from ray.util.client import ray
 from tqdm import tqdm
 
+from pop.agents.frozen_agent import FrozenAgent
 from pop.agents.manager import Manager
 from pop.agents.ray_gcn_agent import RayGCNAgent
 from pop.agents.ray_shallow_gcn_agent import RayShallowGCNAgent
 from pop.community_detection.community_detector import Community
 from pop.configs.architecture import Architecture
 from pop.multiagent_system.base_pop import BasePOP
-from pop.multiagent_system.space_factorization import EncodedAction, Substation
+from pop.multiagent_system.frozen_pop import FrozenPOP
+from pop.multiagent_system.space_factorization import (
+    EncodedAction,
+    Substation,
+    head_manager_mask,
+)
+from pop.networks.checkpoint_shards import shard_reference
 import random
 
 from pop.multiagent_system.dictatorship_penalizer import DictatorshipPenalizer
 
 
 class DPOP(BasePOP):
+    episode_state_attributes: List[str] = BasePOP.episode_state_attributes + [
+        "dictatorship_penalty"
+    ]
+
     def __init__(
         self,
         env: BaseEnv,
@@ -88,25 +101,42 @@ class DPOP(BasePOP):
                 "node_features": {**sub_ranges, **embedding_ranges, **action_ranges}
             },
         )
-        if self.architecture.pop.dictatorship_penalty:
-            self.dictatorship_penalty = DictatorshipPenalizer(
+
+    def _new_episode_controllers(self) -> Dict[str, Any]:
+        return {
+            **super()._new_episode_controllers(),
+            # The head manager is penalized for choosing the same community over and over
+            "dictatorship_penalty": DictatorshipPenalizer(
                 {choice: 1 for choice in range(self.env.n_sub)},
                 **self.architecture.pop.dictatorship_penalty
             )
+            if self.architecture.pop.dictatorship_penalty
+            else None,
+        }
 
     def get_action(self, graph: dgl.DGLHeteroGraph) -> Tuple[int, Optional[float]]:
+        return self.get_actions([graph])[0]
+
+    def get_actions(
+        self, graphs: List[dgl.DGLHeteroGraph]
+    ) -> List[Tuple[int, Optional[float]]]:
         if self.pre_train:
-            return random.sample(list(range(graph.num_nodes())), 1)[0], None
+            return [
+                (random.sample(list(range(graph.num_nodes())), 1)[0], None)
+                for graph in graphs
+            ]
         else:
-            mask = [
-                node
-                for node in range(graph.num_nodes())
-                if not self.architecture.pop.manager_remove_no_action
-                or graph.ndata["embedding_community_action"][node][-1].item() != 0
+            masks = [
+                head_manager_mask(
+                    graph,
+                    self.architecture.pop.head_manager_embedding_name,
+                    self.architecture.pop.manager_remove_no_action,
+                )
+                for graph in graphs
             ]
 
-            chosen_node, q_value = ray.get(
-                self.head_manager.take_action.remote(graph, mask=mask)
+            actions_taken = ray.get(
+                self.head_manager.take_actions.remote(graphs, masks=masks)
             )
 
         self.log_exploration(
@@ -115,7 +145,7 @@ class DPOP(BasePOP):
             self.train_steps,
         )
 
-        return int(chosen_node), q_value
+        return [(int(chosen_node), q_value) for chosen_node, q_value in actions_taken]
 
     def _extra_step(
         self,
@@ -144,7 +174,11 @@ class DPOP(BasePOP):
                 )
             )
         else:
-            next_community_to_substation, _ = self._get_manager_actions(
+            (
+                next_community_to_substation,
+                _,
+                next_community_to_embedding,
+            ) = self._get_manager_actions(
                 next_graph,
                 next_sub_graphs,
                 next_substation_to_encoded_action,
@@ -159,6 +193,7 @@ class DPOP(BasePOP):
                 next_community_to_substation,
                 new_communities=next_communities,
                 new_community_to_manager_dict=next_community_to_manager,
+                community_to_embedding=next_community_to_embedding,
             )
 
             loss, full_reward = ray.get(
@@ -185,6 +220,93 @@ class DPOP(BasePOP):
         state["head_manager_state"] = ray.get(self.head_manager.get_state.remote())
         return state
 
+    def _save_shards(
+        self, shards_directory: Path
+    ) -> Tuple[Dict[str, Any], List[Any], List[Any]]:
+        manifest, shard_requests, shards_written = super()._save_shards(
+            shards_directory
+        )
+        shard_requests.append(
+            self.head_manager.save_shard.remote(
+                str(Path(shards_directory, "head_manager.pt"))
+            )
+        )
+        shards_written.append(self.head_manager.shard_written)
+        manifest["head_manager_state"] = shard_reference(
+            str(Path(shards_directory.name, "head_manager.pt"))
+        )
+        return manifest, shard_requests, shards_written
+
+    def freeze(self, device: str = "cpu") -> FrozenPOP:
+        """
+        Inference-only copy of the system with no Ray actor, see FrozenPOP.
+        Networks are moved to device: CUDA is not available in the forked processes of a Runner.
+        """
+        if not self.managers_history:
+            raise Exception(
+                "Cannot freeze " + self.name + " before its managers are initialized"
+            )
+
+        # Agents with at most one action always choose no-action and are not exported
+        remote_substations: List[Substation] = [
+            substation
+            for substation, agent in self.substation_to_agent.items()
+            if not isinstance(agent, RayShallowGCNAgent)
+        ]
+        agents_state: Dict[Substation, Dict[str, Any]] = dict(
+            zip(
+                remote_substations,
+                ray.get(
+                    [
+                        self.substation_to_agent[
+                            substation
+                        ].get_inference_state.remote()
+                        for substation in remote_substations
+                    ]
+                ),
+            )
+        )
+        if self.agent_pools is not None:
+            for pool_state in ray.get(
+                [pool.get_inference_state.remote() for pool in self.agent_pools]
+            ):
+                agents_state.update(pool_state)
+
+        managers: List[Manager] = list(self.managers_history.keys())
+        managers_state: List[Dict[str, Any]] = ray.get(
+            [manager.get_inference_state.remote() for manager in managers]
+        )
+
+        return FrozenPOP(
+            action_space=self.env.action_space,
+            all_actions=self.action_space.all_actions,
+            architecture=self.architecture,
+            n_sub=self.env.n_sub,
+            node_features=self.node_features,
+            edge_features=self.edge_features,
+            seed=self.seed,
+            substation_to_agent={
+                substation: FrozenAgent.from_state(state, device=device)
+                for substation, state in agents_state.items()
+            },
+            substation_to_actions={
+                substation: len(action_converter.all_actions)
+                for substation, action_converter in self.substation_to_action_converter.items()
+            },
+            action_lookup_array=self.action_lookup_array,
+            managers=[
+                FrozenAgent.from_state(state, device=device) for state in managers_state
+            ],
+            managers_history={
+                manager_index: copy.deepcopy(self.managers_history[manager])
+                for manager_index, manager in enumerate(managers)
+            },
+            head_manager=FrozenAgent.from_state(
+                ray.get(self.head_manager.get_inference_state.remote()), device=device
+            ),
+            device=device,
+        )
+
     @staticmethod
     def factory(
         checkpoint: Dict[str, Any],
@@ -219,21 +341,31 @@ class DPOP(BasePOP):
         dpop.train_steps = checkpoint["train_steps"] if training else 0
         dpop.edge_features = checkpoint["edge_features"]
         dpop.node_features = checkpoint["node_features"]
+        dpop.observation_factorizer.edge_features = dpop.edge_features
+        dpop.observation_factorizer.node_features = dpop.node_features
         dpop.manager_initialization_threshold = checkpoint[
             "manager_initialization_threshold"
         ]
         dpop.community_update_steps = checkpoint["community_update_steps"]
-        dpop.substation_to_agent = {
-            sub_id: RayGCNAgent.load(
-                checkpoint=agent_state,
-                training=training,
-                reset_exploration=reset_exploration,
-                architecture=architecture.agent if architecture is not None else None,
+        if dpop.agent_pools is not None:
+            # Pools are already in place, only the agents state is loaded
+            dpop.load_agent_pools_state(
+                checkpoint["agents_state"], reset_exploration=reset_exploration
             )
-            if "optimizer_state" in list(agent_state.keys())
-            else RayShallowGCNAgent.load(checkpoint=agent_state)
-            for sub_id, agent_state in tqdm(checkpoint["agents_state"].items())
-        }
+        else:
+            dpop.substation_to_agent = {
+                sub_id: RayGCNAgent.load(
+                    checkpoint=agent_state,
+                    training=training,
+                    reset_exploration=reset_exploration,
+                    architecture=architecture.agent
+                    if architecture is not None
+                    else None,
+                )
+                if "optimizer_state" in list(agent_state.keys())
+                else RayShallowGCNAgent.load(checkpoint=agent_state)
+                for sub_id, agent_state in tqdm(checkpoint["agents_state"].items())
+            }
         print("Loading Managers")
         dpop.managers_history = {
             Manager.load(
@@ -246,21 +378,10 @@ class DPOP(BasePOP):
                 checkpoint["managers_state"].items()
             )
         }
+        dpop.managers_history_index.rebuild(dpop.managers_history)
         # TODO: managers here are treated as equal, they may be not
 
-        if dpop.architecture.pop.incentives:
-            for manager in dpop.managers_history.keys():
-                dpop.manager_incentives.add_agent(manager, 1)
-
-        if dpop.architecture.pop.dictatorship_penalty:
-            for manager in dpop.managers_history.keys():
-                dpop.manager_dictatorship_penalties[manager] = DictatorshipPenalizer(
-                    choice_to_ranking={
-                        substation: len(action_converter.all_actions)
-                        for substation, action_converter in dpop.substation_to_action_converter.items()
-                    },
-                    **dpop.architecture.pop.dictatorship_penalty
-                )
+        dpop._register_managers()
 
         print("Loading Head Manager")
         dpop.head_manager = Manager.load(
@@ -1,10 +1,12 @@
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
+from grid2op.Action import BaseAction
 from grid2op.Agent.agentWithConverter import AgentWithConverter
 from grid2op.Environment.BaseEnv import BaseEnv
 from grid2op.Agent.recoPowerlineAgent import RecoPowerlineAgent
 from grid2op.Observation.baseObservation import BaseObservation
 from pop.configs.architecture import Architecture
 from pop.multiagent_system.dpop import DPOP
+from pop.multiagent_system.frozen_pop import FrozenExpertPop
 from pop.multiagent_system.space_factorization import EncodedAction
 from pop.networks.serializable_module import SerializableModule
 
@@ -45,6 +47,66 @@ class ExpertPop(SerializableModule, AgentWithConverter):
         self.pop.writer.add_text("Expert Action", str(action), self.expert_steps)
         return action
 
+    def my_act_batch(
+        self,
+        observations: List[BaseObservation],
+        rewards: List[float],
+        dones: List[bool],
+        episode_states: List[Dict[str, Any]],
+    ) -> Tuple[List[BaseAction], List[Dict[str, Any]]]:
+        """
+        Same as my_act() for several environments, each one with its own episode state.
+        The wrapped system acts at once for every environment which needs it, see BasePOP.my_act_batch()
+        """
+        episode_states = list(episode_states)
+        actions: List[Optional[BaseAction]] = [None] * len(observations)
+        expert_steps: List[int] = []
+        pop_environments: List[int] = []
+        for env, (observation, reward) in enumerate(zip(observations, rewards)):
+            self.expert_steps += 1
+            expert_steps.append(self.expert_steps)
+            reconnection_action = self.greedy_reconnect_agent.act(observation, reward)
+
+            if reconnection_action.impact_on_objects()["has_impact"]:
+                # If there is some powerline to reconnect do it
+                step_dpop = False
+                actions[env] = reconnection_action
+
+            elif not self.expert_only and max(observation.rho) > self.safe_max_rho:
+                # If there is some powerline overloaded ask the agent what to do
+                step_dpop = True
+                pop_environments.append(env)
+
+            else:
+                # else do nothing
+                step_dpop = False
+                actions[env] = self.pop.env.action_space({})
+
+            episode_states[env] = {**episode_states[env], "step_dpop": step_dpop}
+
+        if pop_environments:
+            encoded_actions, pop_episode_states = self.pop.my_act_batch(
+                [self.pop.convert_obs(observations[env]) for env in pop_environments],
+                [rewards[env] for env in pop_environments],
+                [dones[env] for env in pop_environments],
+                [episode_states[env]["pop"] for env in pop_environments],
+            )
+            for env, encoded_action, pop_episode_state in zip(
+                pop_environments, encoded_actions, pop_episode_states
+            ):
+                actions[env] = self.pop.convert_act(encoded_action)
+                actions[env].limit_curtail_storage(
+                    observations[env], margin=self.curtail_storage_limit
+                )
+                episode_states[env] = {"step_dpop": True, "pop": pop_episode_state}
+
+        for action, expert_step in zip(actions, expert_steps):
+            self.pop.writer.add_text("Expert Action", str(action), expert_step)
+        return actions, episode_states
+
+    def set_rollout_environments(self, environments: int) -> None:
+        self.pop.set_rollout_environments(environments)
+
     def convert_act(self, action):
         return action
 
@@ -75,6 +137,36 @@ class ExpertPop(SerializableModule, AgentWithConverter):
         state["expert_steps"] = self.expert_steps
         return state
 
+    def save(self) -> None:
+        # Same sharded checkpoint as the wrapped system, with the expert steps in the manifest
+        self.pop.save_sharded(
+            self._next_checkpoint_file(), {"expert_steps": self.expert_steps}
+        )
+
+    def wait_for_checkpoint(self) -> None:
+        self.pop.wait_for_checkpoint()
+
+    def get_episode_state(self) -> Dict[str, Any]:
+        return {
+            "step_dpop": getattr(self, "step_dpop", False),
+            "pop": self.pop.get_episode_state(),
+        }
+
+    def set_episode_state(self, episode_state: Dict[str, Any]):
+        self.step_dpop = episode_state["step_dpop"]
+        self.pop.set_episode_state(episode_state["pop"])
+
+    def new_episode_state(self) -> Dict[str, Any]:
+        return {"step_dpop": False, "pop": self.pop.new_episode_state()}
+
+    def freeze(self, device: str = "cpu") -> FrozenExpertPop:
+        return FrozenExpertPop(
+            self.pop.freeze(device),
+            safe_max_rho=self.safe_max_rho,
+            curtail_storage_limit=self.curtail_storage_limit,
+            expert_only=self.expert_only,
+        )
+
     @property
     def episodes(self):
         return self.pop.episodes
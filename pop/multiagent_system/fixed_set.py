@@ -24,5 +24,12 @@ class FixedSet(AbstractSet):
     def __str__(self):
         return set(self.cache.keys()).__str__()
 
-    def add(self, x: object):
-        self.cache[x] = None
+    def add(self, x: object) -> Optional[object]:
+        # Returns the least recently added element evicted to make room for x, if any
+        evicted = []
+        self.cache.callback = lambda key, _: evicted.append(key)
+        try:
+            self.cache[x] = None
+        finally:
+            self.cache.callback = None
+        return evicted[0] if evicted else None
@@ -0,0 +1,281 @@
+import copy
+from typing import Any, Dict, List, Optional, Tuple
+
+import dgl
+import networkx as nx
+import numpy as np
+import torch as th
+from grid2op.Action import ActionSpace, BaseAction
+from grid2op.Agent import AgentWithConverter, BaseAgent, RecoPowerlineAgent
+from grid2op.Converter import IdToAct
+from grid2op.Observation import BaseObservation
+
+from pop.agents.frozen_agent import FrozenAgent
+from pop.community_detection.community_detector import Community, CommunityDetector
+from pop.configs.architecture import Architecture
+from pop.multiagent_system.action_detector import ActionDetector
+from pop.multiagent_system.fixed_set import FixedSet
+from pop.multiagent_system.manager_history_index import ManagerHistoryIndex
+from pop.multiagent_system.observation_graph import (
+    ObservationConverter,
+    ObservationGraph,
+)
+from pop.multiagent_system.space_factorization import (
+    EncodedAction,
+    ObservationFactorizer,
+    Substation,
+    community_encoded_actions,
+    head_manager_mask,
+    lookup_local_actions,
+    manager_masks,
+    split_graph_with_actions,
+    summarize_graph,
+)
+
+# Managers are identified by their position in FrozenPOP.managers
+ManagerIndex = int
+
+
+class FrozenPOP(AgentWithConverter):
+    """
+    Inference-only export of a trained DPOP, built by DPOP.freeze().
+    Agents, managers and the head manager are FrozenAgents holding plain torch modules,
+    there is no Ray actor: a FrozenPOP can be copied into the processes of a grid2op Runner.
+    Every episode starts from the exported manager histories with no community detected yet,
+    so that the actions taken in an episode do not depend on the episodes played before by the same process.
+    No manager is created: each community is handled by the exported manager with the most similar history.
+    """
+
+    def __init__(
+        self,
+        action_space: ActionSpace,
+        all_actions: List[BaseAction],
+        architecture: Architecture,
+        n_sub: int,
+        node_features: List[str],
+        edge_features: List[str],
+        seed: int,
+        substation_to_agent: Dict[Substation, FrozenAgent],
+        substation_to_actions: Dict[Substation, int],
+        action_lookup_array: np.ndarray,
+        managers: List[FrozenAgent],
+        managers_history: Dict[ManagerIndex, FixedSet],
+        head_manager: FrozenAgent,
+        device: str = "cpu",
+    ):
+        # The converter reuses the actions enumerated by the exported system
+        AgentWithConverter.__init__(
+            self, action_space, IdToAct, all_actions=all_actions
+        )
+
+        self.architecture: Architecture = architecture
+        self.n_sub: int = n_sub
+        self.node_features: List[str] = node_features
+        self.edge_features: List[str] = edge_features
+        self.device: th.device = th.device(device)
+
+        self.substation_to_agent: Dict[Substation, FrozenAgent] = substation_to_agent
+        # Number of local actions of each substation
+        self.substation_to_actions: Dict[Substation, int] = substation_to_actions
+        # -> (substations, max local actions)
+        self.action_lookup_array: np.ndarray = action_lookup_array
+        self.managers: List[FrozenAgent] = managers
+        self.exported_managers_history: Dict[ManagerIndex, FixedSet] = managers_history
+        self.head_manager: FrozenAgent = head_manager
+
+        self.observation_converter: ObservationConverter = ObservationConverter()
+        self.observation_factorizer: ObservationFactorizer = ObservationFactorizer(
+            node_features=node_features,
+            edge_features=edge_features,
+            device=device,
+            radius=architecture.pop.agent_neighbourhood_radius,
+        )
+        self.community_detector: CommunityDetector = CommunityDetector(
+            seed,
+            enable_power_supply_modularity=architecture.pop.enable_power_supply_modularity,
+        )
+        self.managers_history_index: ManagerHistoryIndex = ManagerHistoryIndex()
+        self.reset(None)
+
+    def reset(self, observation: Optional[BaseObservation]):
+        """
+        Called by the Runner at the beginning of each episode
+        """
+        self.old_graph: Optional[nx.Graph] = None
+        self.communities: Optional[List[Community]] = None
+        self.community_to_manager: Optional[Dict[Community, ManagerIndex]] = None
+        self.managers_history: Dict[ManagerIndex, FixedSet] = copy.deepcopy(
+            self.exported_managers_history
+        )
+        self.managers_history_index.rebuild(self.managers_history)
+        self.action_detector: ActionDetector = ActionDetector(
+            loop_length=self.architecture.pop.disabled_action_loops_length,
+            penalty_value=self.architecture.pop.repeated_action_penalty,
+            repeatable_actions=[0],
+        )
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Cached observations cannot be pickled
+        state = self.__dict__.copy()
+        state["observation_converter"] = ObservationConverter()
+        return state
+
+    def convert_obs(
+        self, observation: BaseObservation
+    ) -> Tuple[Dict[Substation, dgl.DGLHeteroGraph], nx.Graph]:
+        observation_graph: ObservationGraph = self.observation_converter(observation)
+        return (
+            self.observation_factorizer(observation_graph),
+            observation_graph.to_networkx(),
+        )
+
+    def my_act(
+        self,
+        transformed_observation: Tuple[
+            Dict[Substation, Optional[dgl.DGLHeteroGraph]], nx.Graph
+        ],
+        reward: float,
+        done=False,
+    ) -> EncodedAction:
+        """
+        Same action as DPOP.my_act() when not training
+        """
+        factored_observation, graph = transformed_observation
+
+        self.communities, self.community_to_manager = self._update_communities(graph)
+        self.old_graph = graph.copy()
+
+        # Agents choose one local action for their substation
+        substation_to_encoded_action: Dict[
+            Substation, EncodedAction
+        ] = lookup_local_actions(
+            self.action_lookup_array,
+            {
+                substation: self.substation_to_agent[substation].take_action(
+                    observation
+                )[0]
+                for substation, observation in factored_observation.items()
+                if substation in self.substation_to_agent
+            },
+        )
+        sub_graphs: Dict[Community, dgl.DGLHeteroGraph] = split_graph_with_actions(
+            graph=graph,
+            substation_to_encoded_action=substation_to_encoded_action,
+            communities=self.communities,
+            node_features=self.node_features,
+            edge_features=self.edge_features,
+            device=str(self.device),
+        )
+
+        # Managers choose one substation for each community
+        community_to_mask = manager_masks(
+            graph,
+            self.communities,
+            self.substation_to_actions,
+            self.architecture.pop.manager_remove_no_action,
+        )
+        community_to_substation: Dict[Community, Substation] = {}
+        community_to_embedding: Dict[Community, th.Tensor] = {}
+        for community in self.communities:
+            manager = self.managers[self.community_to_manager[community]]
+            manager_action, _, embedding = manager.take_action_with_embedding(
+                sub_graphs[community], mask=community_to_mask[community]
+            )
+            community_to_substation[community] = graph.nodes[manager_action]["sub_id"]
+            community_to_embedding[community] = embedding
+
+        # The head manager chooses one community given the summarized graph
+        embedding_name = self.architecture.pop.head_manager_embedding_name
+        summarized_graph = summarize_graph(
+            graph,
+            self.communities,
+            community_encoded_actions(
+                community_to_substation, substation_to_encoded_action
+            ),
+            community_to_embedding,
+            n_sub=self.n_sub,
+            embedding_name=embedding_name,
+            device=str(self.device),
+        )
+        chosen_node, _ = self.head_manager.take_action(
+            summarized_graph,
+            mask=head_manager_mask(
+                summarized_graph,
+                embedding_name,
+                self.architecture.pop.manager_remove_no_action,
+            ),
+        )
+        chosen_action = int(
+            summarized_graph.ndata[embedding_name][chosen_node][-1].item()
+        )
+
+        if self.action_detector.is_repeated(chosen_action):
+            chosen_action = 0
+        return chosen_action
+
+    def _update_communities(
+        self, graph: nx.Graph
+    ) -> Tuple[List[Community], Dict[Community, ManagerIndex]]:
+        if self.old_graph is None:
+            new_communities = self.community_detector.dynamo(graph_t=graph)
+        else:
+            new_communities = self.community_detector.dynamo(
+                graph_t=self.old_graph, graph_t1=graph, comm_t=self.communities
+            )
+
+        if self.communities and set(self.communities) == set(new_communities):
+            return new_communities, self.community_to_manager
+
+        community_to_manager: Dict[Community, ManagerIndex] = {}
+        for community in new_communities:
+            manager_to_jaccard = self.managers_history_index.max_jaccard(
+                self.managers_history, community
+            )
+            community_to_manager[community] = max(
+                manager_to_jaccard, key=manager_to_jaccard.get
+            )
+            self.managers_history_index.add(
+                self.managers_history, community_to_manager[community], community
+            )
+        return new_communities, community_to_manager
+
+
+class FrozenExpertPop(BaseAgent):
+    """
+    Inference-only export of a trained ExpertPop, built by ExpertPop.freeze().
+    Same expert rules as ExpertPop, the frozen system is asked for an action when a powerline is overloaded.
+    """
+
+    def __init__(
+        self,
+        pop: FrozenPOP,
+        safe_max_rho: float,
+        curtail_storage_limit: float,
+        expert_only: bool = False,
+    ):
+        BaseAgent.__init__(self, pop.init_action_space)
+        self.greedy_reconnect_agent = RecoPowerlineAgent(pop.init_action_space)
+        self.safe_max_rho: float = safe_max_rho
+        self.curtail_storage_limit: float = curtail_storage_limit
+        self.expert_only: bool = expert_only
+        self.pop: FrozenPOP = pop
+
+    def reset(self, observation: Optional[BaseObservation]):
+        self.pop.reset(observation)
+
+    def act(
+        self, observation: BaseObservation, reward: float, done: bool = False
+    ) -> BaseAction:
+        reconnection_action = self.greedy_reconnect_agent.act(observation, reward)
+
+        if reconnection_action.impact_on_objects()["has_impact"]:
+            # If there is some powerline to reconnect do it
+            return reconnection_action
+
+        if not self.expert_only and max(observation.rho) > self.safe_max_rho:
+            # If there is some powerline overloaded ask the system what to do
+            action = self.pop.act(observation, reward, done)
+            action.limit_curtail_storage(observation, margin=self.curtail_storage_limit)
+            return action
+
+        return self.action_space({})
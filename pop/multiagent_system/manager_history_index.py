@@ -0,0 +1,67 @@
+from typing import Dict, Hashable, Mapping, Set, Tuple
+
+from pop.community_detection.community_detector import Community
+from pop.multiagent_system.fixed_set import FixedSet
+
+
+class ManagerHistoryIndex:
+    """
+    Inverted index node -> (manager, community) over the communities in the manager histories.
+    Jaccard similarities are exact and only computed for the history entries sharing at least one node
+    with the queried community: every other entry has a similarity of 0.
+    The index mirrors the histories, every addition has to go through add().
+    """
+
+    def __init__(self):
+        self.postings: Dict[int, Set[Tuple[Hashable, Community]]] = {}
+
+    def rebuild(self, managers_history: Mapping[Hashable, FixedSet]):
+        self.postings = {}
+        for manager, history in managers_history.items():
+            for community in history:
+                self._insert(manager, community)
+
+    def add(
+        self,
+        managers_history: Mapping[Hashable, FixedSet],
+        manager: Hashable,
+        community: Community,
+    ):
+        evicted = managers_history[manager].add(community)
+        if evicted is not None:
+            self._remove(manager, evicted)
+        self._insert(manager, community)
+
+    def max_jaccard(
+        self, managers_history: Mapping[Hashable, FixedSet], community: Community
+    ) -> Dict[Hashable, float]:
+        """
+        Highest Jaccard similarity between community and the history of each manager,
+        in the order of managers_history.
+        """
+        intersections: Dict[Tuple[Hashable, Community], int] = {}
+        for node in community:
+            for entry in self.postings.get(node, ()):
+                intersections[entry] = intersections.get(entry, 0) + 1
+
+        manager_to_jaccard: Dict[Hashable, float] = {
+            manager: 0.0 for manager in managers_history.keys()
+        }
+        for (manager, old_community), intersection in intersections.items():
+            jaccard = intersection / (
+                len(old_community) + len(community) - intersection
+            )
+            if jaccard > manager_to_jaccard[manager]:
+                manager_to_jaccard[manager] = jaccard
+        return manager_to_jaccard
+
+    def _insert(self, manager: Hashable, community: Community):
+        for node in community:
+            self.postings.setdefault(node, set()).add((manager, community))
+
+    def _remove(self, manager: Hashable, community: Community):
+        for node in community:
+            entries = self.postings[node]
+            entries.discard((manager, community))
+            if not entries:
+                del self.postings[node]
@@ -0,0 +1,275 @@
+from typing import Dict, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+import pylru
+from grid2op.Observation import BaseObservation
+from scipy.sparse import csr_matrix
+
+
+class ObservationGraph:
+    """
+    Bus graph of a grid2op observation stored as arrays.
+    Nodes are the buses 0..num_nodes-1, undirected edges are COO pairs (src < dst) in the same order
+    as the edges of observation.as_networkx().
+    Node and edge features hold one value per node / edge with the same semantics as as_networkx():
+    parallel powerlines between the same buses are merged into one edge.
+    """
+
+    def __init__(
+        self,
+        num_nodes: int,
+        sub_id: np.ndarray,
+        src: np.ndarray,
+        dst: np.ndarray,
+        node_data: Dict[str, np.ndarray],
+        edge_data: Dict[str, np.ndarray],
+    ):
+        self.num_nodes: int = num_nodes
+        self.sub_id: np.ndarray = sub_id
+        self.src: np.ndarray = src
+        self.dst: np.ndarray = dst
+        self.node_data: Dict[str, np.ndarray] = node_data
+        self.edge_data: Dict[str, np.ndarray] = edge_data
+
+        self._networkx: Optional[nx.Graph] = None
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.src)
+
+    @staticmethod
+    def from_observation(observation: BaseObservation) -> "ObservationGraph":
+        mat_p, (_, _, _, lor_bus, lex_bus) = observation.flow_bus_matrix(
+            active_flow=True, as_csr_matrix=True
+        )
+        mat_q, _ = observation.flow_bus_matrix(active_flow=False, as_csr_matrix=True)
+        num_nodes: int = mat_p.shape[0]
+        cls = type(observation)
+
+        connected: np.ndarray = observation.line_status
+        lor_connected = lor_bus[connected]
+        lex_connected = lex_bus[connected]
+
+        bus_sub_id = np.zeros(num_nodes, dtype=cls.line_or_to_subid.dtype)
+        bus_sub_id[lor_connected] = cls.line_or_to_subid[connected]
+        bus_sub_id[lex_connected] = cls.line_ex_to_subid[connected]
+
+        # Off diagonal flows define the edges, as in networkx.from_scipy_sparse_array()
+        bus_p = mat_p.diagonal()
+        mat_p = mat_p.tocoo()
+        off_diagonal = (mat_p.row != mat_p.col) & (mat_p.data != 0)
+        row = mat_p.row[off_diagonal]
+        col = mat_p.col[off_diagonal]
+        src = np.minimum(row, col)
+        dst = np.maximum(row, col)
+        # -> (edges), sorted by (src, dst)
+        edge_key, edge_position = np.unique(src * num_nodes + dst, return_inverse=True)
+
+        # Undirected edges keep the flow read last in row-major order
+        edge_p = np.zeros(len(edge_key), dtype=mat_p.dtype)
+        flow = mat_p.data[off_diagonal]
+        for read_last in [row < col, row > col]:
+            edge_p[edge_position[read_last]] = flow[read_last]
+        src = (edge_key // num_nodes).astype(np.int64)
+        dst = (edge_key % num_nodes).astype(np.int64)
+
+        if len(edge_key) == 0:
+            # as_networkx() leaves the features out when there is no edge
+            return ObservationGraph(num_nodes, bus_sub_id, src, dst, {}, {})
+
+        bus_v = np.zeros(num_nodes)
+        bus_v[lor_connected] = observation.v_or[connected]
+        bus_v[lex_connected] = observation.v_ex[connected]
+        node_data: Dict[str, np.ndarray] = {
+            "p": bus_p,
+            "q": mat_q.diagonal(),
+            "v": bus_v,
+            "sub_id": bus_sub_id,
+        }
+        if observation.support_theta:
+            bus_theta = np.zeros(num_nodes)
+            bus_theta[lor_connected] = observation.theta_or[connected]
+            bus_theta[lex_connected] = observation.theta_ex[connected]
+            node_data["theta"] = bus_theta
+        node_data["cooldown"] = observation.time_before_cooldown_sub[bus_sub_id]
+
+        lines = _ParallelLines(lor_bus, lex_bus, connected, num_nodes, edge_key)
+        edge_data: Dict[str, np.ndarray] = {"p": edge_p}
+        for name, vector_or, vector_ex in [
+            ("p", observation.p_or, observation.p_ex),
+            ("q", observation.q_or, observation.q_ex),
+            ("a", observation.a_or, observation.a_ex),
+        ] + (
+            [("theta", observation.theta_or, observation.theta_ex)]
+            if observation.support_theta
+            else []
+        ):
+            edge_data[name + "_or"], edge_data[name + "_ex"] = lines.oriented_sum(
+                vector_or, vector_ex
+            )
+        for name, vector, reduce in [
+            ("v_or", observation.v_or, None),
+            ("v_ex", observation.v_ex, None),
+            ("rho", observation.rho, np.maximum),
+            ("cooldown", observation.time_before_cooldown_line, np.maximum),
+            ("thermal_limit", observation._thermal_limit, np.add),
+            ("time_next_maintenance", observation.time_next_maintenance, np.minimum),
+            (
+                "duration_next_maintenance",
+                observation.duration_next_maintenance,
+                np.maximum,
+            ),
+            ("nb_connected", 1 * connected, np.add),
+            ("timestep_overflow", observation.timestep_overflow, np.maximum),
+            ("sub_id_or", cls.line_or_to_subid, None),
+            ("sub_id_ex", cls.line_ex_to_subid, None),
+            ("node_id_or", lor_bus, None),
+            ("node_id_ex", lex_bus, None),
+            ("bus_or", observation.line_or_bus, None),
+            ("bus_ex", observation.line_ex_bus, None),
+        ]:
+            edge_data[name] = lines.reduce(vector, reduce)
+
+        return ObservationGraph(num_nodes, bus_sub_id, src, dst, node_data, edge_data)
+
+    def to_networkx(self) -> nx.Graph:
+        """
+        Same graph as observation.as_networkx(), built once.
+        The graph is shared by every caller: only add or overwrite attributes which are not features.
+        """
+        if self._networkx is None:
+            graph = nx.Graph()
+            graph.add_nodes_from(
+                (
+                    node,
+                    {
+                        feature: values[node]
+                        for feature, values in self.node_data.items()
+                    },
+                )
+                for node in range(self.num_nodes)
+            )
+            graph.add_edges_from(
+                (
+                    u,
+                    v,
+                    {
+                        feature: values[edge]
+                        for feature, values in self.edge_data.items()
+                    },
+                )
+                for edge, (u, v) in enumerate(zip(self.src.tolist(), self.dst.tolist()))
+            )
+            self._networkx = graph
+        return self._networkx
+
+    def to_csr(self) -> csr_matrix:
+        # Symmetric adjacency matrix
+        return csr_matrix(
+            (
+                np.ones(2 * self.num_edges),
+                (
+                    np.concatenate((self.src, self.dst)),
+                    np.concatenate((self.dst, self.src)),
+                ),
+            ),
+            shape=(self.num_nodes, self.num_nodes),
+        )
+
+
+class _ParallelLines:
+    """
+    Groups connected powerlines by (origin bus, extremity bus) to merge their values into edges.
+    """
+
+    def __init__(
+        self,
+        lor_bus: np.ndarray,
+        lex_bus: np.ndarray,
+        connected: np.ndarray,
+        num_nodes: int,
+        edge_key: np.ndarray,
+    ):
+        self.lines: np.ndarray = np.flatnonzero(connected)
+        lor_bus = lor_bus[self.lines]
+        lex_bus = lex_bus[self.lines]
+
+        # Powerlines are grouped by oriented bus pair, groups are ordered by their first powerline
+        _, first_line, line_group = np.unique(
+            lor_bus * num_nodes + lex_bus, return_index=True, return_inverse=True
+        )
+        self.line_group: np.ndarray = np.argsort(np.argsort(first_line))[line_group]
+        self.first_line: np.ndarray = np.sort(first_line)
+        group_or = lor_bus[self.first_line]
+        group_ex = lex_bus[self.first_line]
+        self.flipped: np.ndarray = group_or > group_ex
+
+        # When both orientations of a bus pair exist the last group wins, as with a dict update
+        group_edge_key = np.minimum(group_or, group_ex) * num_nodes + np.maximum(
+            group_or, group_ex
+        )
+        group_edge = np.minimum(
+            np.searchsorted(edge_key, group_edge_key), len(edge_key) - 1
+        )
+        in_graph = edge_key[group_edge] == group_edge_key
+        self.edge_group: np.ndarray = np.full(len(edge_key), -1)
+        np.maximum.at(self.edge_group, group_edge[in_graph], np.flatnonzero(in_graph))
+        self.edge_has_group: np.ndarray = self.edge_group >= 0
+
+    def reduce(self, vector: np.ndarray, reduce: Optional[np.ufunc]) -> np.ndarray:
+        vector = vector[self.lines]
+        # Without reduction parallel powerlines share the same value
+        group_values = vector[self.first_line]
+        if reduce is not None:
+            others = np.ones(len(vector), dtype=bool)
+            others[self.first_line] = False
+            # Unbuffered, in powerline order: same result as a sequential fold
+            reduce.at(group_values, self.line_group[others], vector[others])
+        return self._to_edges(group_values)
+
+    def oriented_sum(
+        self, vector_or: np.ndarray, vector_ex: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        sum_or = self._sum(vector_or)
+        sum_ex = self._sum(vector_ex)
+        # Edges are oriented from the smallest bus id to the largest one
+        return (
+            self._to_edges(np.where(self.flipped, sum_ex, sum_or)),
+            self._to_edges(np.where(self.flipped, sum_or, sum_ex)),
+        )
+
+    def _sum(self, vector: np.ndarray) -> np.ndarray:
+        group_values = np.zeros(len(self.first_line), dtype=vector.dtype)
+        np.add.at(group_values, self.line_group, vector[self.lines])
+        return group_values
+
+    def _to_edges(self, group_values: np.ndarray) -> np.ndarray:
+        edge_values = np.zeros(len(self.edge_group), dtype=group_values.dtype)
+        edge_values[self.edge_has_group] = group_values[
+            self.edge_group[self.edge_has_group]
+        ]
+        return edge_values
+
+
+class ObservationConverter:
+    """
+    Converts each observation into an ObservationGraph at most once.
+    Observations are cached by identity: a few of them are alive at the same time
+    (current and next observation) and each is converted on its first request.
+    """
+
+    def __init__(self, cache_size: int = 4):
+        # id(observation) -> (observation, graph)
+        self.cache: pylru.lrucache = pylru.lrucache(size=cache_size)
+
+    def __call__(self, observation: BaseObservation) -> ObservationGraph:
+        key = id(observation)
+        if key in self.cache:
+            cached_observation, graph = self.cache[key]
+            # The cached observation is kept alive so its id cannot be reused
+            if cached_observation is observation:
+                return graph
+        graph = ObservationGraph.from_observation(observation)
+        self.cache[key] = (observation, graph)
+        return graph
@@ -0,0 +1,169 @@
+import multiprocessing as mp
+import random
+from multiprocessing.connection import Connection
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from grid2op.Action import BaseAction
+from grid2op.Environment import BaseEnv
+from grid2op.Observation import BaseObservation, ObservationSpace
+
+# Observations travel between processes as (vector, thermal limits, theta support):
+# thermal limits and theta support are not part of the observation vector
+ObservationMessage = Tuple[np.ndarray, np.ndarray, bool]
+
+
+def _to_message(observation: BaseObservation) -> ObservationMessage:
+    return (
+        observation.to_vect(),
+        np.array(observation._thermal_limit),
+        observation.support_theta,
+    )
+
+
+def _from_message(
+    observation_space: ObservationSpace, message: ObservationMessage
+) -> BaseObservation:
+    vector, thermal_limit, support_theta = message
+    observation = observation_space.from_vect(vector)
+    observation._thermal_limit = thermal_limit
+    observation.support_theta = support_theta
+    return observation
+
+
+def _rollout_worker(
+    connection: Connection,
+    env_factory: Callable[[], BaseEnv],
+    chronics: List[str],
+    seed: int,
+):
+    env: BaseEnv = env_factory()
+    kept_chronics = set(chronics)
+    env.chronics_handler.set_filter(lambda path: path in kept_chronics)
+    env.chronics_handler.real_data.reset()
+    # Seeded once the chronics are cached, since filtering discards the chronic seeds
+    env.seed(seed)
+    env.chronics_handler.shuffle()
+    episodes = 0
+    connection.send(env.reward_range)
+
+    while True:
+        command, data = connection.recv()
+        if command == "reset":
+            connection.send(_to_message(env.reset()))
+        elif command == "step":
+            observation, reward, done, _ = env.step(
+                env.action_space.from_vect(data, check_legit=False)
+            )
+            reset_observation: Optional[ObservationMessage] = None
+            if done:
+                # Each chronic of the subset is played once before the subset is shuffled again
+                episodes += 1
+                if episodes % len(chronics) == 0:
+                    env.chronics_handler.shuffle()
+                reset_observation = _to_message(env.reset())
+            connection.send((_to_message(observation), reward, done, reset_observation))
+        elif command == "close":
+            env.close()
+            connection.close()
+            return
+        else:
+            raise Exception("Unknown rollout worker command: " + str(command))
+
+
+class RolloutWorkers:
+    """
+    Independent copies of the training environment, each stepped in its own process
+    on a disjoint subset of the chronics.
+    Actions are sent to every worker before any observation is received,
+    so that the environments are simulated in parallel.
+    Workers reset their environment as soon as an episode is over.
+    """
+
+    def __init__(
+        self,
+        env_factory: Callable[[], BaseEnv],
+        observation_space: ObservationSpace,
+        chronics: Sequence[str],
+        workers: int,
+        seed: int = 0,
+    ):
+        if workers > len(chronics):
+            raise Exception(
+                "Cannot split "
+                + str(len(chronics))
+                + " chronics among "
+                + str(workers)
+                + " rollout workers"
+            )
+        self.observation_space: ObservationSpace = observation_space
+
+        # Disjoint shuffled subsets of the chronics
+        shuffled_chronics = list(chronics)
+        random.Random(seed).shuffle(shuffled_chronics)
+        self.chronics: List[List[str]] = [
+            shuffled_chronics[worker::workers] for worker in range(workers)
+        ]
+
+        # Workers are spawned: forking would duplicate the Ray driver state
+        context = mp.get_context("spawn")
+        self.connections: List[Connection] = []
+        self.processes: List[mp.Process] = []
+        for worker, worker_chronics in enumerate(self.chronics):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(
+                target=_rollout_worker,
+                args=(worker_connection, env_factory, worker_chronics, seed + worker),
+                daemon=True,
+            )
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+        # Every worker has built its environment once its reward range is received
+        self.reward_range: Tuple[float, float] = [
+            connection.recv() for connection in self.connections
+        ][0]
+
+    def __len__(self) -> int:
+        return len(self.connections)
+
+    def reset(self) -> List[BaseObservation]:
+        for connection in self.connections:
+            connection.send(("reset", None))
+        return [
+            _from_message(self.observation_space, connection.recv())
+            for connection in self.connections
+        ]
+
+    def step(
+        self, actions: Sequence[BaseAction]
+    ) -> List[Tuple[BaseObservation, float, bool, Optional[BaseObservation]]]:
+        """
+        For each worker: next observation, reward, done and the first observation of the next episode if done
+        """
+        for connection, action in zip(self.connections, actions):
+            connection.send(("step", action.to_vect()))
+        results: List[
+            Tuple[BaseObservation, float, bool, Optional[BaseObservation]]
+        ] = []
+        for connection in self.connections:
+            observation, reward, done, reset_observation = connection.recv()
+            results.append(
+                (
+                    _from_message(self.observation_space, observation),
+                    reward,
+                    done,
+                    _from_message(self.observation_space, reset_observation)
+                    if reset_observation is not None
+                    else None,
+                )
+            )
+        return results
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(("close", None))
+        for process in self.processes:
+            process.join()
@@ -1,15 +1,19 @@
 import hashlib
+import multiprocessing
 
 import dgl
 from grid2op.Action import BaseAction
 from grid2op.Converter import IdToAct
 from grid2op.Observation import ObservationSpace
-from typing import List, Tuple, Optional, Dict
+from typing import List, NamedTuple, Tuple, Optional, Dict, Set, Union
 import networkx as nx
 import numpy as np
+import pylru
+import torch as th
 
 from pop.agents.base_gcn_agent import BaseGCNAgent
 from pop.community_detection.community_detector import Community
+from pop.multiagent_system.observation_graph import ObservationGraph
 from grid2op.Exceptions.IllegalActionExceptions import IllegalAction
 from tqdm import tqdm
 
@@ -20,14 +24,13 @@ EncodedAction = int
 class HashableAction:
     def __init__(self, action: BaseAction):
         self.action = action
-        self.hash = hashlib.md5()
 
     def __key(self):
         return str(self.action.impact_on_objects()).encode()
 
     def __hash__(self):
-        self.hash.update(self.__key())
-        return int(self.hash.hexdigest(), base=16)
+        # A new digest each time: the hash must not depend on previous calls
+        return int(hashlib.md5(self.__key()).hexdigest(), base=16)
 
     def __eq__(self, other):
         if isinstance(other, HashableAction):
@@ -215,6 +218,207 @@ def generate_redispatching_action_space(env, actions_per_generator: int = 10):
     return sub_to_action_space, lookup_table
 
 
+class ActionClassifier:
+    """
+    Assigns actions to the substation owning them, as _assign_action() and _assign_action_gen_only().
+    With vectorized=True actions are classified from their vector representation:
+    actions modifying only their redispatching, their line switches, their bus switches
+    or their line status and bus assignments are classified with array operations,
+    every other action falls back to impact_on_objects().
+    """
+
+    def __init__(
+        self,
+        observation_space: ObservationSpace,
+        composite_actions: bool = False,
+        generator_storage_only: bool = False,
+        vectorized: bool = False,
+    ):
+        self.load_to_node: np.ndarray = observation_space.load_to_subid
+        self.generator_to_node: np.ndarray = observation_space.gen_to_subid
+        self.line_origin_to_node: np.ndarray = observation_space.line_or_to_subid
+        self.line_extremity_to_node: np.ndarray = observation_space.line_ex_to_subid
+        # Substation of each element of the topology vector, -1 for elements without owner (storage)
+        self.topology_to_node: np.ndarray = np.full(
+            observation_space.dim_topo, -1, dtype=np.int64
+        )
+        for element_to_node, element_to_position in [
+            (self.load_to_node, observation_space.load_pos_topo_vect),
+            (self.generator_to_node, observation_space.gen_pos_topo_vect),
+            (self.line_origin_to_node, observation_space.line_or_pos_topo_vect),
+            (self.line_extremity_to_node, observation_space.line_ex_pos_topo_vect),
+        ]:
+            self.topology_to_node[element_to_position] = element_to_node
+        self.composite_actions: bool = composite_actions
+        self.generator_storage_only: bool = generator_storage_only
+        self.vectorized: bool = vectorized
+
+    def assign(
+        self, action: BaseAction, encoded_action: int
+    ) -> Optional[Tuple[int, int]]:
+        if not self.composite_actions and self.generator_storage_only:
+            return _assign_action_gen_only(
+                action, self.generator_to_node, encoded_action
+            )
+        return _assign_action(
+            action,
+            self.load_to_node,
+            self.generator_to_node,
+            self.line_origin_to_node,
+            self.line_extremity_to_node,
+            encoded_action,
+            composite_actions=self.composite_actions,
+            generator_storage_only=self.generator_storage_only,
+        )
+
+    def classify(
+        self, actions: List[BaseAction], first_encoded_action: int = 0
+    ) -> List[Optional[Tuple[int, int]]]:
+        if not self.vectorized or len(actions) == 0:
+            return [
+                self.assign(action, encoded_action)
+                for encoded_action, action in enumerate(
+                    actions, start=first_encoded_action
+                )
+            ]
+
+        # -> (actions, action size)
+        vectors = np.stack([action.to_vect() for action in actions])
+        # Parts of the vector modified with respect to the action doing nothing
+        no_action = type(actions[0])()
+        no_action_vector = no_action.to_vect()
+        modified_parts: Dict[str, np.ndarray] = {}
+        part_vectors: Dict[str, np.ndarray] = {}
+        offset = 0
+        for attribute in type(no_action).attr_list_vect:
+            size = np.asarray(getattr(no_action, attribute)).size
+            part = vectors[:, offset : offset + size]
+            part_vectors[attribute] = part
+            # -> (actions)
+            modified_parts[attribute] = ~(
+                (part == no_action_vector[offset : offset + size])
+                | (np.isnan(part) & np.isnan(no_action_vector[offset : offset + size]))
+            ).all(axis=1)
+            offset += size
+        # -> (actions)
+        modified_count = np.sum(list(modified_parts.values()), axis=0)
+
+        def only(attribute: str) -> np.ndarray:
+            if attribute not in modified_parts:
+                return np.zeros(len(actions), dtype=bool)
+            return modified_parts[attribute] & (modified_count == 1)
+
+        # -> (actions)
+        owners = np.full(len(actions), -1, dtype=np.int64)
+        unassigned = modified_count == 0
+        if "_redispatch" in part_vectors:
+            redispatching = np.abs(part_vectors["_redispatch"]) >= 1e-7
+            redispatch_only = only("_redispatch") & redispatching.any(axis=1)
+            owners[redispatch_only] = self.generator_to_node[
+                np.argmax(redispatching[redispatch_only], axis=1)
+            ]
+        else:
+            redispatch_only = np.zeros(len(actions), dtype=bool)
+
+        if "_switch_line_status" in part_vectors:
+            switches = part_vectors["_switch_line_status"] != 0
+            switch_only = only("_switch_line_status") & switches.any(axis=1)
+            if self.generator_storage_only:
+                unassigned |= switch_only
+            else:
+                assigned = switch_only & (
+                    (switches.sum(axis=1) == 1) | self.composite_actions
+                )
+                owners[assigned] = self.line_origin_to_node[
+                    np.argmax(switches[assigned], axis=1)
+                ]
+                unassigned |= switch_only & ~assigned
+        else:
+            switch_only = np.zeros(len(actions), dtype=bool)
+
+        if "_change_bus_vect" in part_vectors:
+            bus_switches = part_vectors["_change_bus_vect"] != 0
+            bus_switch_only = only("_change_bus_vect") & bus_switches.any(axis=1)
+            if self.composite_actions and not self.generator_storage_only:
+                owners[bus_switch_only] = self.topology_to_node[
+                    np.argmax(bus_switches[bus_switch_only], axis=1)
+                ]
+                # Unknown owners are left to impact_on_objects()
+                bus_switch_only &= owners >= 0
+            else:
+                # Topological actions are only kept as composite actions
+                unassigned |= bus_switch_only
+        else:
+            bus_switch_only = np.zeros(len(actions), dtype=bool)
+
+        # Actions setting line status or buses are only kept as composite actions
+        set_only = (modified_count > 0) & (
+            modified_count
+            == sum(
+                modified_parts[attribute].astype(np.int64)
+                for attribute in ["_set_line_status", "_set_topo_vect"]
+                if attribute in modified_parts
+            )
+        )
+        if not self.composite_actions or self.generator_storage_only:
+            unassigned |= set_only
+
+        classified = unassigned | redispatch_only | switch_only | bus_switch_only
+        assignments: List[Optional[Tuple[int, int]]] = []
+        for position, action in enumerate(actions):
+            if not classified[position]:
+                assignments.append(self.assign(action, first_encoded_action + position))
+            elif unassigned[position]:
+                assignments.append(None)
+            else:
+                assignments.append(
+                    (int(owners[position]), first_encoded_action + position)
+                )
+        return assignments
+
+    def classify_in_parallel(
+        self, actions: List[BaseAction], processes: int
+    ) -> List[Optional[Tuple[int, int]]]:
+        """
+        Classifies consecutive chunks of actions in forked processes and concatenates their results,
+        the result is the same as classify(actions).
+        """
+        if "fork" not in multiprocessing.get_all_start_methods():
+            print("Processes cannot be forked, factoring the action space sequentially")
+            return self.classify(actions)
+
+        global _classification_job
+        chunk_size = max(1, int(np.ceil(len(actions) / (processes * 4))))
+        chunks = [
+            (start, min(start + chunk_size, len(actions)))
+            for start in range(0, len(actions), chunk_size)
+        ]
+        # Forked workers inherit the classifier and the actions, nothing is pickled but the results
+        _classification_job = (self, actions)
+        try:
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                assignments: List[Optional[Tuple[int, int]]] = []
+                for chunk_assignments in tqdm(
+                    pool.imap(_classify_chunk, chunks), total=len(chunks)
+                ):
+                    assignments.extend(chunk_assignments)
+        finally:
+            _classification_job = None
+        return assignments
+
+
+_classification_job: Optional[Tuple[ActionClassifier, List[BaseAction]]] = None
+
+
+def _classify_chunk(chunk: Tuple[int, int]) -> List[Optional[Tuple[int, int]]]:
+    classifier, actions = _classification_job
+    start, end = chunk
+    return [
+        None if assignment is None else (int(assignment[0]), int(assignment[1]))
+        for assignment in classifier.classify(actions[start:end], start)
+    ]
+
+
 def factor_action_space(
     observation_space: ObservationSpace,
     full_converter: IdToAct,
@@ -222,60 +426,38 @@ def factor_action_space(
     composite_actions: bool = False,
     generator_storage_only: bool = False,
     remove_no_action: bool = False,
+    processes: int = 1,
+    vectorized: bool = False,
 ) -> Tuple[Dict[int, List[int]], Dict[HashableAction, int]]:
     # TODO: take storage into account, take observation_space.storage_to_subid
 
-    # Mappings
-    load_to_node = observation_space.load_to_subid
-    generator_to_node = observation_space.gen_to_subid
-    line_origin_to_node = observation_space.line_or_to_subid
-    line_extremity_to_node = observation_space.line_ex_to_subid
-
     print(
         "WARNING: Storage objects are ignored, check if they are present in the environment"
     )
     print("Factoring Action Space")
-    if not composite_actions and generator_storage_only:
-        # Factoring Action Lookup Table
-        owners, encoded_actions = zip(
-            *[
-                action_assignment
-                for action_assignment in [
-                    _assign_action_gen_only(
-                        action,
-                        generator_to_node,
-                        encoded_action,
-                    )
-                    for encoded_action, action in enumerate(
-                        tqdm(full_converter.all_actions[1:])
-                    )
-                ]
-                if action_assignment is not None
-            ]
+    classifier = ActionClassifier(
+        observation_space,
+        composite_actions=composite_actions,
+        generator_storage_only=generator_storage_only,
+        vectorized=vectorized,
+    )
+    # Factoring Action Lookup Table
+    if processes > 1:
+        assignments = classifier.classify_in_parallel(
+            full_converter.all_actions[1:], processes
         )
+    elif vectorized:
+        assignments = classifier.classify(full_converter.all_actions[1:])
     else:
-        # Factoring Action Lookup Table
-        owners, encoded_actions = zip(
-            *[
-                action_assignment
-                for action_assignment in [
-                    _assign_action(
-                        action,
-                        load_to_node,
-                        generator_to_node,
-                        line_origin_to_node,
-                        line_extremity_to_node,
-                        encoded_action,
-                        composite_actions=composite_actions,
-                        generator_storage_only=generator_storage_only,
-                    )
-                    for encoded_action, action in enumerate(
-                        tqdm(full_converter.all_actions[1:])
-                    )
-                ]
-                if action_assignment is not None
-            ]
-        )
+        assignments = [
+            classifier.assign(action, encoded_action)
+            for encoded_action, action in enumerate(
+                tqdm(full_converter.all_actions[1:])
+            )
+        ]
+    owners, encoded_actions = zip(
+        *[assignment for assignment in assignments if assignment is not None]
+    )
 
     action_space_dict = {
         substation: [(full_converter.all_actions[0], 0)] if not remove_no_action else []
@@ -304,6 +486,35 @@ def factor_action_space(
     return sub_id_to_action_space, lookup_table
 
 
+def build_action_lookup_array(
+    substation_to_action_converter: Dict[Substation, IdToAct],
+    lookup_table: Dict[HashableAction, int],
+) -> np.ndarray:
+    """
+    Dense (substation, local action) -> global encoded action table.
+    Actions are hashed once here instead of at every step.
+    Entries are -1 past the last action of a substation and for actions missing from lookup_table.
+    """
+    # -> (substations, max local actions)
+    lookup_array = np.full(
+        (
+            max(substation_to_action_converter.keys()) + 1,
+            max(
+                len(converter.all_actions)
+                for converter in substation_to_action_converter.values()
+            ),
+        ),
+        -1,
+        dtype=np.int64,
+    )
+    for substation, converter in substation_to_action_converter.items():
+        lookup_array[substation, : len(converter.all_actions)] = [
+            lookup_table.get(HashableAction(action), -1)
+            for action in converter.all_actions
+        ]
+    return lookup_array
+
+
 def factor_observation(
     obs_graph: nx.Graph,
     node_features: List[str],
@@ -349,6 +560,224 @@ def factor_observation(
     }
 
 
+class EgoGraphStructure(NamedTuple):
+    # Directed edges in local node ids
+    src: th.Tensor
+    dst: th.Tensor
+    num_nodes: int
+    # Position of each local node in the observation graph nodes
+    node_ids: th.Tensor
+    # Position of the undirected observation graph edge of each directed edge
+    edge_ids: th.Tensor
+
+
+class ObservationFactorizer:
+    """
+    Incremental factor_observation().
+    Ego graph structures only depend on the topology of the observation graph,
+    they are computed once per topology and reused while the topology does not change.
+    Observations sharing a cached topology only slice fresh feature values.
+    ObservationGraphs are sliced without going through networkx.
+    """
+
+    def __init__(
+        self,
+        node_features: List[str],
+        edge_features: List[str],
+        device: str,
+        radius: int = 1,
+        cache_size: int = 16,
+    ):
+        self.node_features: List[str] = node_features
+        self.edge_features: List[str] = edge_features
+        self.device: str = device
+        self.radius: int = radius
+
+        # topology -> substation -> ego graph structure
+        self.cache: pylru.lrucache = pylru.lrucache(size=cache_size)
+
+    def __call__(
+        self, obs_graph: Union[nx.Graph, ObservationGraph]
+    ) -> Dict[Substation, dgl.DGLHeteroGraph]:
+        if isinstance(obs_graph, ObservationGraph):
+            nodes: List[int] = list(range(obs_graph.num_nodes))
+            sub_ids: List[int] = obs_graph.sub_id.tolist()
+            edges: List[Tuple[int, int]] = list(
+                zip(obs_graph.src.tolist(), obs_graph.dst.tolist())
+            )
+            # -> (nodes, ...), (edges, ...)
+            node_features: Dict[str, th.Tensor] = {
+                feature: th.from_numpy(obs_graph.node_data[feature]).to(self.device)
+                for feature in (self.node_features if nodes else [])
+            }
+            edge_features: Dict[str, th.Tensor] = {
+                feature: th.from_numpy(obs_graph.edge_data[feature]).to(self.device)
+                for feature in (self.edge_features if edges else [])
+            }
+        else:
+            node_data = list(obs_graph.nodes.data())
+            edge_data = list(obs_graph.edges.data())
+            nodes = [node for node, _ in node_data]
+            sub_ids = [data["sub_id"] for _, data in node_data]
+            edges = [(u, v) for u, v, _ in edge_data]
+            # -> (nodes, ...), (edges, ...)
+            node_features = {
+                feature: _stack_feature([data[feature] for _, data in node_data]).to(
+                    self.device
+                )
+                for feature in (self.node_features if nodes else [])
+            }
+            edge_features = {
+                feature: _stack_feature([data[feature] for _, _, data in edge_data]).to(
+                    self.device
+                )
+                for feature in (self.edge_features if edges else [])
+            }
+
+        topology = (tuple(nodes), tuple(sub_ids), tuple(edges))
+        if topology in self.cache:
+            substation_to_structure = self.cache[topology]
+        else:
+            substation_to_structure = self._factor_topology(nodes, sub_ids, edges)
+            self.cache[topology] = substation_to_structure
+
+        if self.radius < 1:
+            # Every substation observes the whole graph
+            dgl_graph = self._build_graph(
+                next(iter(substation_to_structure.values())),
+                node_features,
+                edge_features,
+            )
+            return {sub_id: dgl_graph for sub_id in substation_to_structure.keys()}
+        return {
+            sub_id: self._build_graph(structure, node_features, edge_features)
+            for sub_id, structure in substation_to_structure.items()
+        }
+
+    def _factor_topology(
+        self, nodes: List[int], sub_ids: List[int], edges: List[Tuple[int, int]]
+    ) -> Dict[Substation, EgoGraphStructure]:
+        node_position: Dict[int, int] = {
+            node: position for position, node in enumerate(nodes)
+        }
+        adjacency: Dict[int, Set[int]] = {node: set() for node in nodes}
+        edge_position: Dict[Tuple[int, int], int] = {}
+        for position, (u, v) in enumerate(edges):
+            adjacency[u].add(v)
+            adjacency[v].add(u)
+            edge_position[(u, v)] = position
+            edge_position[(v, u)] = position
+
+        substation_to_buses: Dict[Substation, List[int]] = {}
+        for node_id, sub_id in zip(nodes, sub_ids):
+            substation_to_buses.setdefault(sub_id, []).append(node_id)
+
+        if self.radius < 1:
+            whole_graph = self._structure(
+                set(nodes),
+                set(edge_position.values()),
+                edges,
+                node_position,
+            )
+            return {sub_id: whole_graph for sub_id in substation_to_buses.keys()}
+
+        substation_to_structure: Dict[Substation, EgoGraphStructure] = {}
+        for sub_id, buses in substation_to_buses.items():
+            # Same nodes and edges as the composition of the ego graphs of each bus
+            ego_nodes: Set[int] = set()
+            ego_edges: Set[int] = set()
+            for bus in buses:
+                bus_ego_nodes = self._neighbourhood(bus, adjacency)
+                ego_nodes.update(bus_ego_nodes)
+                ego_edges.update(
+                    edge_position[(u, v)]
+                    for u in bus_ego_nodes
+                    for v in adjacency[u]
+                    if v in bus_ego_nodes
+                )
+            substation_to_structure[sub_id] = self._structure(
+                ego_nodes, ego_edges, edges, node_position
+            )
+        return substation_to_structure
+
+    def _neighbourhood(self, source: int, adjacency: Dict[int, Set[int]]) -> Set[int]:
+        # Nodes within self.radius hops, as nx.single_source_shortest_path_length()
+        reached: Set[int] = {source}
+        frontier: Set[int] = {source}
+        for _ in range(self.radius):
+            frontier = {v for u in frontier for v in adjacency[u]} - reached
+            if not frontier:
+                break
+            reached.update(frontier)
+        return reached
+
+    def _structure(
+        self,
+        ego_nodes: Set[int],
+        ego_edges: Set[int],
+        edges: List[Tuple[int, int]],
+        node_position: Dict[int, int],
+    ) -> EgoGraphStructure:
+        # Local node ids follow the sorted node labels as in dgl.from_networkx()
+        local_nodes: List[int] = sorted(ego_nodes)
+        local_id: Dict[int, int] = {node: idx for idx, node in enumerate(local_nodes)}
+
+        src: List[int] = []
+        dst: List[int] = []
+        edge_ids: List[int] = []
+        for edge_id in sorted(ego_edges):
+            u, v = edges[edge_id]
+            # Undirected edges become two directed edges as in nx.Graph.to_directed()
+            src.append(local_id[u])
+            dst.append(local_id[v])
+            edge_ids.append(edge_id)
+            if u != v:
+                src.append(local_id[v])
+                dst.append(local_id[u])
+                edge_ids.append(edge_id)
+
+        return EgoGraphStructure(
+            src=th.tensor(src, dtype=th.int64, device=self.device),
+            dst=th.tensor(dst, dtype=th.int64, device=self.device),
+            num_nodes=len(local_nodes),
+            node_ids=th.tensor(
+                [node_position[node] for node in local_nodes],
+                dtype=th.int64,
+                device=self.device,
+            ),
+            edge_ids=th.tensor(edge_ids, dtype=th.int64, device=self.device),
+        )
+
+    def _build_graph(
+        self,
+        structure: EgoGraphStructure,
+        node_features: Dict[str, th.Tensor],
+        edge_features: Dict[str, th.Tensor],
+    ) -> dgl.DGLHeteroGraph:
+        # A new graph is built every time: agents store and modify their observations
+        dgl_graph = dgl.graph(
+            (structure.src, structure.dst),
+            num_nodes=structure.num_nodes,
+            device=self.device,
+        )
+        if structure.num_nodes > 0:
+            for feature, values in node_features.items():
+                dgl_graph.ndata[feature] = values[structure.node_ids]
+        if len(structure.edge_ids) > 0:
+            for feature, values in edge_features.items():
+                dgl_graph.edata[feature] = values[structure.edge_ids]
+        return dgl_graph
+
+
+def _stack_feature(values: list) -> th.Tensor:
+    # Same conversion as dgl.from_networkx()
+    if isinstance(values[0], th.Tensor):
+        return th.stack(values)
+    if isinstance(values[0], np.ndarray):
+        return th.as_tensor(np.array(values))
+    return th.as_tensor(values)
+
+
 def split_graph_into_communities(
     graph: nx.Graph,
     communities: List[Community],
@@ -366,3 +795,206 @@ def split_graph_into_communities(
         )
         for community in communities
     }
+
+
+def build_quotient_graph(
+    graph: nx.Graph, communities: List[Community], device: str
+) -> Tuple[dgl.DGLHeteroGraph, List[int]]:
+    """
+    Directed DGL graph with one supernode per community, with the structure obtained by contracting
+    each community into its first node with nx.contracted_nodes():
+    supernodes follow the order of their first node in graph.nodes,
+    communities with internal edges get a self loop.
+    Returns the graph and the community index of each supernode.
+    """
+    node_position = {node: position for position, node in enumerate(graph.nodes)}
+
+    # -> (nodes)
+    labels = np.full(len(node_position), -1, dtype=np.int64)
+    first_node_position = np.empty(len(communities), dtype=np.int64)
+    for community_id, community in enumerate(communities):
+        labels[[node_position[node] for node in community]] = community_id
+        first_node_position[community_id] = node_position[next(iter(community))]
+
+    # -> (communities)
+    supernode_to_community = np.argsort(first_node_position, kind="stable")
+    community_to_supernode = np.empty(len(communities), dtype=np.int64)
+    community_to_supernode[supernode_to_community] = np.arange(len(communities))
+
+    edges = np.array(
+        [(node_position[u], node_position[v]) for u, v in graph.edges],
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    # -> (edges, 2)
+    supernode_edges = community_to_supernode[labels[edges]]
+    # Parallel edges between supernodes are merged, as in a simple graph
+    supernode_edges = np.unique(np.sort(supernode_edges, axis=1), axis=0)
+    loops = supernode_edges[:, 0] == supernode_edges[:, 1]
+    src = np.concatenate(
+        (supernode_edges[:, 0], supernode_edges[~loops, 1]),
+    )
+    dst = np.concatenate(
+        (supernode_edges[:, 1], supernode_edges[~loops, 0]),
+    )
+
+    return (
+        dgl.graph(
+            (th.as_tensor(src), th.as_tensor(dst)),
+            num_nodes=len(communities),
+            device=device,
+        ),
+        supernode_to_community.tolist(),
+    )
+
+
+def lookup_local_actions(
+    action_lookup_array: np.ndarray,
+    substation_to_local_action: Dict[Substation, int],
+) -> Dict[Substation, EncodedAction]:
+    """
+    Global encoded action of each local action, see build_action_lookup_array()
+    """
+    # -> (substations)
+    encoded_actions = action_lookup_array[
+        list(substation_to_local_action.keys()),
+        list(substation_to_local_action.values()),
+    ]
+    if (encoded_actions < 0).any():
+        raise Exception(
+            "Local actions missing from the action lookup table: "
+            + str(substation_to_local_action)
+        )
+    return dict(zip(substation_to_local_action.keys(), encoded_actions.tolist()))
+
+
+def split_graph_with_actions(
+    graph: nx.Graph,
+    substation_to_encoded_action: Dict[Substation, EncodedAction],
+    communities: List[Community],
+    node_features: List[str],
+    edge_features: List[str],
+    device: str,
+) -> Dict[Community, dgl.DGLHeteroGraph]:
+    """
+    Community sub graphs given to the managers
+    Each node holds the action chosen for its substation as an extra "action" feature (0 if none)
+    """
+    nx.set_node_attributes(
+        graph,
+        {
+            node_id: {
+                "action": substation_to_encoded_action[node_data["sub_id"]]
+                if substation_to_encoded_action.get(node_data["sub_id"])
+                else 0,
+            }
+            for node_id, node_data in graph.nodes.data()
+        },
+    )
+    return split_graph_into_communities(
+        graph=graph,
+        node_features=node_features + ["action"],
+        edge_features=edge_features,
+        communities=communities,
+        device=device,
+    )
+
+
+def manager_masks(
+    graph: nx.Graph,
+    communities: List[Community],
+    substation_to_actions: Dict[Substation, int],
+    remove_no_action: bool,
+) -> Dict[Community, frozenset]:
+    """
+    Nodes each manager may choose in its community
+    With remove_no_action nodes of substations with no action but the no-action are masked,
+    unless every node of the community is
+    """
+    enabled_nodes = set(
+        node
+        for community in communities
+        for node in community
+        if not remove_no_action
+        or substation_to_actions[graph.nodes[node]["sub_id"]] > 1
+    )
+    return {
+        community: frozenset(
+            [node for node in community if node in enabled_nodes]
+            if set(community).intersection(enabled_nodes)
+            else [list(community)[0]]
+        )
+        for community in communities
+    }
+
+
+def community_encoded_actions(
+    community_to_substation: Dict[Community, Substation],
+    substation_to_encoded_action: Dict[Substation, EncodedAction],
+) -> Dict[Community, EncodedAction]:
+    # Action of the substation chosen by each manager (0 if none)
+    return {
+        community: substation_to_encoded_action[substation]
+        if substation_to_encoded_action.get(substation)
+        else 0
+        for community, substation in community_to_substation.items()
+    }
+
+
+def summarize_graph(
+    graph: nx.Graph,
+    communities: List[Community],
+    community_to_encoded_action: Dict[Community, EncodedAction],
+    community_to_embedding: Dict[Community, th.Tensor],
+    n_sub: int,
+    embedding_name: str,
+    device: str,
+) -> dgl.DGLHeteroGraph:
+    """
+    Head manager input: each community is contracted into a supernode, see build_quotient_graph()
+    Each supernode has the contracted embedding, its community (1 hot encoded)
+    And the action chosen by its community manager
+    """
+    summarized_graph, supernode_to_community = build_quotient_graph(
+        graph, communities, device=device
+    )
+    supernode_communities = [
+        communities[community_id] for community_id in supernode_to_community
+    ]
+
+    # -> (supernodes, n_sub * 2)
+    membership = th.zeros(len(supernode_communities), n_sub * 2)
+    for supernode, community in enumerate(supernode_communities):
+        membership[supernode, [node for node in community if 0 <= node < n_sub * 2]] = 1
+    summarized_graph.ndata[embedding_name] = th.cat(
+        (
+            th.stack(
+                [
+                    th.sigmoid(community_to_embedding[community].to(device))
+                    for community in supernode_communities
+                ]
+            ),
+            membership.to(device),
+            th.tensor(
+                [
+                    [community_to_encoded_action[community]]
+                    for community in supernode_communities
+                ],
+                dtype=th.float32,
+                device=device,
+            ),
+        ),
+        dim=-1,
+    )
+    return summarized_graph
+
+
+def head_manager_mask(
+    summarized_graph: dgl.DGLHeteroGraph, embedding_name: str, remove_no_action: bool
+) -> List[int]:
+    # With remove_no_action supernodes whose manager chose the no-action are masked
+    return [
+        node
+        for node in range(summarized_graph.num_nodes())
+        if not remove_no_action
+        or summarized_graph.ndata[embedding_name][node][-1].item() != 0
+    ]
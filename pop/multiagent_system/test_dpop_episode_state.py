@@ -0,0 +1,121 @@
+from types import SimpleNamespace
+from typing import Any, Dict, List, Tuple
+
+from pop.multiagent_system.dpop import DPOP
+
+INCENTIVES: Dict[str, float] = {
+    "largest_base_prize": 1.0,
+    "smallest_base_penalty": 0.1,
+    "prize_logarithmic_growth_factor": 0.5,
+    "penalty_exponential_growth_factor": 0.5,
+    "base_prize_exponential_decay_half_life": 2.0,
+    "base_penalty_exponential_growth_factor": 0.5,
+}
+
+DICTATORSHIP_PENALTY: Dict[str, float] = {
+    "base_penalty_exponential_decay_half_life": 2.0,
+    "penalty_exponential_growth_factor": 0.5,
+    "smallest_base_penalty": 0.1,
+}
+
+
+def _dpop() -> DPOP:
+    # Only the episode controllers are exercised, networks and ray actors are not needed
+    dpop: DPOP = DPOP.__new__(DPOP)
+    dpop.architecture = SimpleNamespace(
+        pop=SimpleNamespace(
+            disabled_action_loops_length=2,
+            repeated_action_penalty=0.5,
+            incentives=INCENTIVES,
+            dictatorship_penalty=DICTATORSHIP_PENALTY,
+        )
+    )
+    dpop.env = SimpleNamespace(n_sub=3)
+    dpop.substation_to_action_converter = {
+        substation: SimpleNamespace(all_actions=[None] * (substation + 2))
+        for substation in range(3)
+    }
+    dpop.managers_history = {"manager_0": None}
+    return dpop
+
+
+def _act(
+    dpop: DPOP, episode_state: Dict[str, Any], action: int, node: int
+) -> Tuple[Dict[str, Any], Tuple[bool, float, Dict[str, float], float, float]]:
+    """
+    Uses the controllers of an environment as my_act_batch() and step() do
+    """
+    dpop.set_episode_state(episode_state)
+    repeated: bool = dpop.action_detector.is_repeated(action)
+    outcome = (
+        repeated,
+        dpop.action_detector.penalty(),
+        dpop.manager_incentives.incentives(["manager_0"] if action else []),
+        dpop.manager_dictatorship_penalties["manager_0"].penalty(node),
+        dpop.dictatorship_penalty.penalty(node),
+    )
+    return dpop.get_episode_state(), outcome
+
+
+def _play(
+    dpop: DPOP, episode_state: Dict[str, Any], moves: List[Tuple[int, int]]
+) -> List[Tuple[bool, float, Dict[str, float], float, float]]:
+    outcomes = []
+    for action, node in moves:
+        episode_state, outcome = _act(dpop, episode_state, action, node)
+        outcomes.append(outcome)
+    return outcomes
+
+
+def test_environments_do_not_share_episode_controllers():
+    moves_a: List[Tuple[int, int]] = [(5, 0), (5, 0), (5, 0), (0, 1)]
+    moves_b: List[Tuple[int, int]] = [(7, 2), (5, 1), (7, 2), (7, 2)]
+
+    alone = _dpop()
+    outcomes_b_alone = _play(alone, alone.new_episode_state(), moves_b)
+
+    dpop = _dpop()
+    state_a, state_b = dpop.new_episode_state(), dpop.new_episode_state()
+    outcomes_a, outcomes_b = [], []
+    for move_a, move_b in zip(moves_a, moves_b):
+        state_a, outcome_a = _act(dpop, state_a, *move_a)
+        state_b, outcome_b = _act(dpop, state_b, *move_b)
+        outcomes_a.append(outcome_a)
+        outcomes_b.append(outcome_b)
+
+    assert outcomes_b == outcomes_b_alone
+    assert outcomes_a == _play(_dpop(), _dpop().new_episode_state(), moves_a)
+
+    # 5 is repeated in environment A only, 7 is repeated in environment B only
+    assert [outcome[:2] for outcome in outcomes_a] == [
+        (False, 0),
+        (True, -0.5),
+        (True, -1.0),
+        (False, 0),
+    ]
+    assert [outcome[:2] for outcome in outcomes_b] == [
+        (False, 0),
+        (False, 0),
+        (True, -0.5),
+        (True, -1.0),
+    ]
+
+
+def test_new_managers_join_every_environment():
+    dpop = _dpop()
+    state_a, state_b = dpop.new_episode_state(), dpop.new_episode_state()
+
+    # A manager created while environment A acts
+    dpop.set_episode_state(state_a)
+    dpop.managers_history["manager_1"] = None
+    dpop._register_managers()
+    state_a = dpop.get_episode_state()
+
+    for state in (state_a, state_b):
+        dpop.set_episode_state(state)
+        assert set(dpop.manager_incentives.agent_actions) == {"manager_0", "manager_1"}
+        assert set(dpop.manager_dictatorship_penalties) == {"manager_0", "manager_1"}
+    assert (
+        state_a["manager_dictatorship_penalties"]["manager_1"]
+        is not state_b["manager_dictatorship_penalties"]["manager_1"]
+    )
@@ -0,0 +1,65 @@
+from typing import List, Optional, Tuple
+
+import grid2op
+import pytest
+from grid2op.Action import BaseAction
+from grid2op.Converter import IdToAct
+
+from pop.multiagent_system.space_factorization import ActionClassifier
+
+
+@pytest.fixture(scope="module")
+def env():
+    env = grid2op.make("l2rpn_case14_sandbox", test=True)
+    yield env
+    env.close()
+
+
+@pytest.fixture(scope="module")
+def actions(env) -> List[BaseAction]:
+    converter = IdToAct(env.action_space)
+    converter.init_converter(curtail=False, storage=False)
+    action_space = env.action_space
+    # Composite actions exercise the fallback to impact_on_objects()
+    return converter.all_actions + [
+        action_space({"redispatch": [(0, 1.0)], "change_line_status": [2]}),
+        action_space({"change_line_status": [1, 4]}),
+        action_space({"change_bus": {"loads_id": [2], "generators_id": [1]}}),
+        action_space(
+            {"set_line_status": [(5, -1)], "change_bus": {"lines_or_id": [5]}}
+        ),
+    ]
+
+
+def _loop(
+    classifier: ActionClassifier, actions: List[BaseAction]
+) -> List[Optional[Tuple[int, int]]]:
+    return [
+        classifier.assign(action, encoded_action)
+        for encoded_action, action in enumerate(actions)
+    ]
+
+
+@pytest.mark.parametrize("composite_actions", [False, True])
+@pytest.mark.parametrize("generator_storage_only", [False, True])
+def test_vectorized_classification_matches_loop(
+    env, actions, composite_actions: bool, generator_storage_only: bool
+):
+    classifier = ActionClassifier(
+        env.observation_space,
+        composite_actions=composite_actions,
+        generator_storage_only=generator_storage_only,
+        vectorized=True,
+    )
+    expected = _loop(classifier, actions)
+    assert any(assignment is not None for assignment in expected)
+    assert classifier.classify(actions) == expected
+    assert classifier.classify(actions[10:], 10) == expected[10:]
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_parallel_classification_matches_loop(env, actions, vectorized: bool):
+    classifier = ActionClassifier(
+        env.observation_space, composite_actions=True, vectorized=vectorized
+    )
+    assert classifier.classify_in_parallel(actions, 2) == _loop(classifier, actions)
@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+import torch as th
+
+from pop.agents.replay_memory_file import REPLAY_MEMORY_KEY, load_replay_memory
+
+# Checkpoint entries holding this key are stored in the shard file it names,
+# relative to the directory of the manifest
+SHARD_KEY: str = "checkpoint_shard"
+
+
+def shard_reference(shard_file: str) -> Dict[str, str]:
+    return {SHARD_KEY: shard_file}
+
+
+def resolve_shards(checkpoint: Any, directory: str) -> Any:
+    """
+    Replaces every shard reference in checkpoint with the content of its shard,
+    replay memories saved by save_replay_memory() are loaded into RAM
+    """
+    if isinstance(checkpoint, dict):
+        if set(checkpoint.keys()) == {SHARD_KEY}:
+            shard_file = Path(directory, checkpoint[SHARD_KEY])
+            return resolve_shards(th.load(str(shard_file)), str(shard_file.parent))
+        if set(checkpoint.keys()) == {REPLAY_MEMORY_KEY}:
+            return load_replay_memory(
+                str(Path(directory, checkpoint[REPLAY_MEMORY_KEY]))
+            )
+        return {
+            key: resolve_shards(value, directory) for key, value in checkpoint.items()
+        }
+    if isinstance(checkpoint, (list, tuple)):
+        return type(checkpoint)(
+            resolve_shards(value, directory) for value in checkpoint
+        )
+    return checkpoint
+
+
+def save_atomically(
+    state: Dict[str, Any], path: str, temporary_path: Optional[str] = None
+) -> None:
+    # The file at path is either the previous one or the complete new one, never a partial write
+    temporary_path = path + ".tmp" if temporary_path is None else temporary_path
+    with open(temporary_path, "wb") as file:
+        th.save(state, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+
+class BackgroundWriter:
+    """
+    Runs one checkpoint write at a time in a background thread.
+    Writes are given a function building the state, so that slow conversions also happen off the caller thread.
+    Errors are raised by the next call to done(), wait() or write().
+    """
+
+    def __init__(self):
+        self.thread: Optional[threading.Thread] = None
+        self.error: Optional[BaseException] = None
+
+    def write(self, write: Callable[[], None]) -> None:
+        self.wait()
+        self.thread = threading.Thread(target=self._run, args=(write,), daemon=True)
+        self.thread.start()
+
+    def done(self) -> bool:
+        self._raise_error()
+        return self.thread is None or not self.thread.is_alive()
+
+    def wait(self) -> None:
+        if self.thread is not None:
+            self.thread.join()
+        self._raise_error()
+
+    def _run(self, write: Callable[[], None]) -> None:
+        try:
+            write()
+        except BaseException as error:
+            self.error = error
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise Exception("Checkpoint write failed") from error
+
+
+class ShardWriter(BackgroundWriter):
+    """
+    Writes the shard of one module in the background
+    """
+
+    def write_shard(self, path: str, get_state: Callable[[], Dict[str, Any]]) -> None:
+        self.write(lambda: save_atomically(get_state(), path))
+
+
+class ManifestCommitter(BackgroundWriter):
+    """
+    Commits the manifest of a sharded checkpoint once all its shards are written.
+    The manifest is renamed into place: checkpoints whose manifest is missing are incomplete and never loaded.
+    """
+
+    def __init__(self, poll_interval: float = 0.1):
+        super().__init__()
+        self.poll_interval: float = poll_interval
+
+    def commit(
+        self,
+        manifest: Dict[str, Any],
+        manifest_file: str,
+        shards_directory: str,
+        shards_written: Callable[[], bool],
+    ) -> None:
+        def write():
+            while not shards_written():
+                time.sleep(self.poll_interval)
+            save_atomically(
+                manifest,
+                manifest_file,
+                temporary_path=str(Path(shards_directory, "manifest.tmp")),
+            )
+
+        self.write(write)
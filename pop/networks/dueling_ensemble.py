@@ -0,0 +1,374 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import dgl
+import dgl.function as fn
+import dgl.nn.pytorch as dgl_nn
+import torch as th
+import torch.nn as nn
+from dgl import DGLHeteroGraph
+from dgl.nn.functional import edge_softmax
+from torch import Tensor
+
+import pop.networks.custom_layers as cl
+from pop.networks.dueling_net import DuelingNet
+from pop.networks.gcn import GCN
+
+# Stacked weights of one nn.Linear: (members, in_features, out_features), (members, out_features)
+StackedLinear = Tuple[Tensor, Optional[Tensor]]
+
+
+class DuelingEnsemble(object):
+    """
+    Runs several DuelingNets sharing one architecture in a single batched forward pass.
+    Weights of corresponding layers are stacked along a leading member dimension,
+    every node, edge or graph row is multiplied by the weights of the member it belongs to.
+    Advantage streams are zero padded to the largest action space, padded actions are masked.
+    Stacked weights are a copy: call refresh() whenever the member networks change.
+    """
+
+    graph_layers = (dgl_nn.EGATConv, cl.EGATNodeConv)
+    dense_layers = (nn.Linear,)
+
+    def __init__(self, networks: List[DuelingNet]) -> None:
+        self.networks: List[DuelingNet] = networks
+        self.device: th.device = next(networks[0].parameters()).device
+
+        # -> (members)
+        self.action_space_sizes: Tensor = th.tensor(
+            [network.action_space_size for network in networks], device=self.device
+        )
+        self.max_actions: int = int(self.action_space_sizes.max().item())
+
+        # -> (members, max_actions)
+        self.action_mask: Tensor = (
+            th.arange(self.max_actions, device=self.device)[None, :]
+            < self.action_space_sizes[:, None]
+        )
+
+        self.embedding_layers: List[Tuple[nn.Module, Dict[str, Any]]] = []
+        self.value_layers: List[Tuple[nn.Module, Dict[str, Any]]] = []
+        self.advantage_layers: List[Tuple[nn.Module, Dict[str, Any]]] = []
+        self.refresh()
+
+    @staticmethod
+    def supports(networks: List[DuelingNet]) -> bool:
+        """
+        True if every layer of the networks can be run with stacked weights
+        """
+        if not networks:
+            return False
+        for modules in [
+            lambda network: list(network.embedding.model),
+            lambda network: list(network.value_stream),
+            lambda network: list(network.advantage_stream),
+        ]:
+            layer_types = [
+                [type(layer) for layer in modules(network)] for network in networks
+            ]
+            if any(types != layer_types[0] for types in layer_types):
+                return False
+            for layer in modules(networks[0]):
+                if not isinstance(
+                    layer, DuelingEnsemble.graph_layers + DuelingEnsemble.dense_layers
+                ) and any(True for _ in layer.parameters()):
+                    return False
+        return len({network.embedding.edge_features for network in networks}) == 1
+
+    def refresh(self) -> None:
+        self.embedding_layers = self._stack_layers(
+            [list(network.embedding.model) for network in self.networks]
+        )
+        self.value_layers = self._stack_layers(
+            [list(network.value_stream) for network in self.networks]
+        )
+        self.advantage_layers = self._stack_layers(
+            [list(network.advantage_stream) for network in self.networks]
+        )
+
+    def _stack_layers(
+        self, members_layers: List[List[nn.Module]]
+    ) -> List[Tuple[nn.Module, Dict[str, Any]]]:
+        stacked_layers: List[Tuple[nn.Module, Dict[str, Any]]] = []
+        for layers in zip(*members_layers):
+            layer = layers[0]
+            if isinstance(layer, nn.Linear):
+                stacked = {"linear": self._stack_linear(list(layers))}
+            elif isinstance(layer, dgl_nn.EGATConv):
+                stacked = {
+                    "fc_ni": self._stack_linear([conv.fc_ni for conv in layers]),
+                    "fc_nj": self._stack_linear([conv.fc_nj for conv in layers]),
+                    "fc_fij": self._stack_linear([conv.fc_fij for conv in layers]),
+                    # The node projection is called fc_node in older DGL versions
+                    "fc_node": self._stack_linear(
+                        [
+                            getattr(conv, "fc_node_src", None) or conv.fc_node
+                            for conv in layers
+                        ]
+                    ),
+                    # -> (members, heads, out_edge_feats)
+                    "attn": th.stack([conv.attn.detach()[0] for conv in layers]),
+                    # -> (members, heads * out_edge_feats)
+                    "bias": (
+                        th.stack([conv.bias.detach() for conv in layers])
+                        if layer.bias is not None
+                        else None
+                    ),
+                }
+            elif isinstance(layer, cl.EGATNodeConv):
+                convolutions = [conv.convolution for conv in layers]
+                stacked = {
+                    # -> (members, in_feats, out_feats)
+                    "weight": (
+                        th.stack([conv.weight.detach() for conv in convolutions])
+                        if layer.convolution.weight is not None
+                        else None
+                    ),
+                    # -> (members, out_feats)
+                    "bias": (
+                        th.stack([conv.bias.detach() for conv in convolutions])
+                        if layer.convolution.bias is not None
+                        else None
+                    ),
+                }
+            else:
+                stacked = {}
+            stacked_layers.append((layer, stacked))
+        return stacked_layers
+
+    def _stack_linear(self, linears: List[nn.Linear]) -> StackedLinear:
+        # Members may differ in output size (e.g. advantage stream): pad with zeros
+        out_features = max(linear.out_features for linear in linears)
+        weight = th.zeros(
+            len(linears), linears[0].in_features, out_features, device=self.device
+        )
+        bias = (
+            th.zeros(len(linears), out_features, device=self.device)
+            if linears[0].bias is not None
+            else None
+        )
+        for member, linear in enumerate(linears):
+            weight[member, :, : linear.out_features] = linear.weight.detach().t()
+            if bias is not None:
+                bias[member, : linear.out_features] = linear.bias.detach()
+        return weight, bias
+
+    @th.no_grad()
+    def __call__(self, graphs: List[DGLHeteroGraph], members: List[int]) -> Tensor:
+        """
+        Q values of graphs[i] according to network members[i].
+        Padded actions are set to -inf.
+        """
+        # -> (batch_size)
+        graph_members: Tensor = th.tensor(members, device=self.device)
+        g: DGLHeteroGraph = dgl.batch(graphs).to(self.device)
+
+        # -> (batch_size, embedding_size)
+        graph_embedding: Tensor = th.flatten(self._graph_embedding(g, graph_members), 1)
+
+        # -> (batch_size, 1)
+        state_value: Tensor = self._dense_forward(
+            self.value_layers, graph_embedding, graph_members
+        )[:, :1]
+
+        # -> (batch_size, max_actions)
+        state_advantages: Tensor = self._dense_forward(
+            self.advantage_layers, graph_embedding, graph_members
+        )
+        action_mask: Tensor = self.action_mask[graph_members]
+
+        # Advantages are centered over the real actions of each member
+        # -> (batch_size, 1)
+        mean_advantages: Tensor = (state_advantages * action_mask).sum(
+            dim=1, keepdim=True
+        ) / self.action_space_sizes[graph_members].unsqueeze(1)
+        q_values: Tensor = state_value + state_advantages - mean_advantages
+
+        # -> (batch_size, max_actions)
+        return q_values.masked_fill(~action_mask, float("-inf"))
+
+    def _graph_embedding(self, g: DGLHeteroGraph, graph_members: Tensor) -> Tensor:
+        embedding: GCN = self.networks[0].embedding
+
+        # Same preprocessing as GCN.forward(), every member shares the feature ranges
+        g = GCN._add_self_loop_to_batched_graph(g)
+        # -> (nodes)
+        node_members: Tensor = th.repeat_interleave(graph_members, g.batch_num_nodes())
+        # -> (edges)
+        edge_members: Tensor = node_members[g.edges()[0]]
+
+        features: Tuple[Tensor, ...] = (
+            embedding.node_scaler(dict(g.ndata)).to(self.device),
+        )
+        if embedding.edge_features is not None:
+            features = features + (
+                embedding.edge_scaler(dict(g.edata)).to(self.device),
+            )
+
+        for layer, stacked in self.embedding_layers:
+            if isinstance(layer, dgl_nn.EGATConv):
+                features = self._egat_conv(
+                    layer, stacked, g, node_members, edge_members, *features
+                )
+            elif isinstance(layer, cl.EGATNodeConv):
+                features = self._graph_conv(
+                    layer.convolution, stacked, g, node_members, *features
+                )
+            else:
+                features = layer(g, *features)
+            if not isinstance(features, tuple):
+                features = (features,)
+        # -> (nodes, heads, out_node_features) or (nodes, out_node_features)
+        node_embeddings: Tensor = features[0]
+
+        if len(node_embeddings.shape) == 3:
+            # Mean over heads if multi-headed attention
+            node_embeddings = th.mean(node_embeddings, dim=1)
+
+        # -> (batch_size, embedding_size)
+        return DuelingNet._compute_graph_embedding(g, node_embeddings)
+
+    @staticmethod
+    def _dense_forward(
+        layers: List[Tuple[nn.Module, Dict[str, Any]]], x: Tensor, members: Tensor
+    ) -> Tensor:
+        for layer, stacked in layers:
+            if isinstance(layer, nn.Linear):
+                x = _grouped_linear(x, members, stacked["linear"])
+            else:
+                x = layer(x)
+        return x
+
+    @staticmethod
+    def _egat_conv(
+        layer: dgl_nn.EGATConv,
+        stacked: Dict[str, Any],
+        g: DGLHeteroGraph,
+        node_members: Tensor,
+        edge_members: Tensor,
+        node_features: Tensor,
+        edge_features: Tensor,
+    ) -> Tuple[Tensor, Tensor]:
+        # Same computation as dgl.nn.EGATConv.forward() with per member weights
+        heads: int = layer._num_heads
+        with g.local_scope():
+            g.srcdata["f_ni"] = _grouped_linear(
+                node_features, node_members, stacked["fc_ni"]
+            )
+            g.dstdata["f_nj"] = _grouped_linear(
+                node_features, node_members, stacked["fc_nj"]
+            )
+            g.apply_edges(fn.u_add_v("f_ni", "f_nj", "f_tmp"))
+            f_out: Tensor = g.edata.pop("f_tmp") + _grouped_linear(
+                edge_features, edge_members, stacked["fc_fij"]
+            )
+            if stacked["bias"] is not None:
+                f_out = f_out + stacked["bias"][edge_members]
+            # -> (edges, heads, out_edge_feats)
+            f_out = nn.functional.leaky_relu(f_out).view(
+                -1, heads, layer._out_edge_feats
+            )
+
+            # -> (edges, heads, 1)
+            e: Tensor = (
+                (f_out * stacked["attn"][edge_members]).sum(dim=-1).unsqueeze(-1)
+            )
+            g.edata["a"] = edge_softmax(g, e)
+            g.srcdata["h_out"] = _grouped_linear(
+                node_features, node_members, stacked["fc_node"]
+            ).view(-1, heads, layer._out_node_feats)
+            g.update_all(fn.u_mul_e("h_out", "a", "m"), fn.sum("m", "h_out"))
+
+            # -> (nodes, heads, out_node_feats), (edges, heads, out_edge_feats)
+            return g.dstdata["h_out"].view(-1, heads, layer._out_node_feats), f_out
+
+    @staticmethod
+    def _graph_conv(
+        convolution: dgl_nn.GraphConv,
+        stacked: Dict[str, Any],
+        g: DGLHeteroGraph,
+        node_members: Tensor,
+        node_features: Tensor,
+        edge_weight: Optional[Tensor] = None,
+    ) -> Tensor:
+        # Same computation as dgl.nn.GraphConv.forward() with per member weights
+        with g.local_scope():
+            aggregate_fn = fn.copy_u("h", "m")
+            if edge_weight is not None:
+                g.edata["_edge_weight"] = edge_weight
+                aggregate_fn = fn.u_mul_e("h", "_edge_weight", "m")
+
+            features: Tensor = node_features
+            if convolution._norm in ["left", "both"]:
+                features = features * _degree_norm(
+                    g.out_degrees(), convolution._norm, features
+                )
+
+            if convolution._in_feats > convolution._out_feats:
+                if stacked["weight"] is not None:
+                    features = _grouped_linear(
+                        features, node_members, (stacked["weight"], None)
+                    )
+                g.srcdata["h"] = features
+                g.update_all(aggregate_fn, fn.sum(msg="m", out="h"))
+                result: Tensor = g.dstdata["h"]
+            else:
+                g.srcdata["h"] = features
+                g.update_all(aggregate_fn, fn.sum(msg="m", out="h"))
+                result: Tensor = g.dstdata["h"]
+                if stacked["weight"] is not None:
+                    result = _grouped_linear(
+                        result, node_members, (stacked["weight"], None)
+                    )
+
+            if convolution._norm in ["right", "both"]:
+                result = result * _degree_norm(
+                    g.in_degrees(), convolution._norm, result
+                )
+
+            if stacked["bias"] is not None:
+                result = result + stacked["bias"][node_members]
+
+            if convolution._activation is not None:
+                result = convolution._activation(result)
+
+            return result
+
+
+def _degree_norm(degrees: Tensor, norm: str, features: Tensor) -> Tensor:
+    degrees = degrees.to(features).clamp(min=1)
+    degree_norm = th.pow(degrees, -0.5) if norm == "both" else 1.0 / degrees
+    return degree_norm.reshape(degree_norm.shape + (1,) * (features.dim() - 1))
+
+
+def _grouped_linear(x: Tensor, groups: Tensor, linear: StackedLinear) -> Tensor:
+    """
+    Apply to each row of x the weights of its group.
+    Rows are scattered in a zero padded (groups, max_group_rows, in_features) block
+    so that a single bmm serves every group.
+    x: (rows, in_features), groups: (rows) -> (rows, out_features)
+    """
+    weight, bias = linear
+    # -> (groups)
+    group_rows: Tensor = th.bincount(groups, minlength=weight.shape[0])
+    group_offsets: Tensor = th.cumsum(group_rows, dim=0) - group_rows
+
+    # Position of each row inside its group block
+    order: Tensor = th.argsort(groups)
+    sorted_groups: Tensor = groups[order]
+    positions: Tensor = (
+        th.arange(groups.shape[0], device=groups.device) - group_offsets[sorted_groups]
+    )
+
+    # -> (groups, max_group_rows, in_features)
+    blocks: Tensor = x.new_zeros(
+        weight.shape[0], int(group_rows.max().item()), x.shape[-1]
+    )
+    blocks[sorted_groups, positions] = x[order]
+
+    # -> (rows, out_features)
+    sorted_rows: Tensor = th.bmm(blocks, weight)[sorted_groups, positions]
+    if bias is not None:
+        sorted_rows = sorted_rows + bias[sorted_groups]
+    rows: Tensor = th.empty_like(sorted_rows)
+    rows[order] = sorted_rows
+    return rows
@@ -49,8 +49,6 @@ class DuelingNet(nn.Module, SerializableModule):
         # Do not remove it
         self.embedding_size: int = self.embedding.get_embedding_dimension()
 
-        self._node_embeddings: Optional[Tensor] = None
-
         self.advantage_stream: nn.Sequential = get_network(
             self, advantage_stream_architecture, is_graph_network=False
         )
@@ -78,34 +76,85 @@ class DuelingNet(nn.Module, SerializableModule):
         return graph_embedding
 
     def _extract_features(self, g: DGLHeteroGraph) -> Tensor:
+        # Kept local: learn steps and actions may run forward passes concurrently
         # (node*batch_size, embedding_size)
-        self._node_embeddings = self.embedding(g)
+        node_embeddings = self.embedding(g)
 
         # -> (batch_size, embedding_size)
-        graph_embedding = self._compute_graph_embedding(g, self._node_embeddings)
+        graph_embedding = self._compute_graph_embedding(g, node_embeddings)
 
         graph_embedding = th.flatten(graph_embedding, 1)
 
         # -> (batch_size, embedding_size)
         return graph_embedding
 
-    def forward(self, g: DGLHeteroGraph) -> Tensor:
+    def forward(self, g: DGLHeteroGraph, segments: int = 1) -> Tensor:
+        """
+        segments > 1 splits the batch into equally sized consecutive segments
+        and centers advantages within each of them.
+        A forward pass over concatenated batches then matches one forward pass per batch.
+        """
         # -> (batch_size, embedding_size)
         graph_embedding: Tensor = self._extract_features(g)
 
+        # Compute advantage of (current_state, action) for each action
+        # -> (batch_size, action_space_size)
+        state_advantages: FloatTensor = self.advantage_stream(graph_embedding)
+
+        # -> (batch_size, action_space_size)
+        return self._q_values(graph_embedding, state_advantages, segments)
+
+    def _q_values(
+        self, graph_embedding: Tensor, state_advantages: Tensor, segments: int = 1
+    ) -> Tensor:
         # Compute value of current state
         # -> (batch_size, 1)
         state_value: float = self.value_stream(graph_embedding)
+        action_space_size: int = state_advantages.shape[-1]
+
+        # -> (segments, batch_size / segments, action_space_size)
+        segmented_advantages: Tensor = state_advantages.reshape(
+            segments, -1, action_space_size
+        )
+        q_values: Tensor = state_value.reshape(segments, -1, 1) + (
+            segmented_advantages - segmented_advantages.mean(dim=(1, 2), keepdim=True)
+        )
 
-        # Compute advantage of (current_state, action) for each action
         # -> (batch_size, action_space_size)
-        state_advantages: FloatTensor = self.advantage_stream(graph_embedding)
+        return q_values.reshape(-1, action_space_size)
+
+    def evaluate(self, g: DGLHeteroGraph) -> Tuple[Tensor, Tensor, Tensor]:
+        """
+        Q values, advantages (as returned by advantage()) and graph embeddings
+        computed by a single forward pass.
+        """
+        # -> (batch_size, embedding_size)
+        graph_embedding: Tensor = self._extract_features(g)
 
         # -> (batch_size, action_space_size)
-        q_values: Tensor = state_value + (state_advantages - state_advantages.mean())
+        state_advantages: Tensor = self.advantage_stream(graph_embedding)
+
+        return (
+            self._q_values(graph_embedding, state_advantages),
+            th.mean(state_advantages, 0),
+            graph_embedding,
+        )
+
+    def evaluate_batch(self, g: DGLHeteroGraph) -> Tuple[Tensor, Tensor, Tensor]:
+        """
+        Same as evaluate() for each graph of a batched graph, as if they were evaluated one by one
+        """
+        # -> (batch_size, embedding_size)
+        graph_embedding: Tensor = self._extract_features(g)
 
         # -> (batch_size, action_space_size)
-        return q_values
+        state_advantages: Tensor = self.advantage_stream(graph_embedding)
+
+        return (
+            self._q_values(graph_embedding, state_advantages, segments=g.batch_size),
+            state_advantages,
+            graph_embedding,
+        )
 
     def advantage(self, g: DGLHeteroGraph) -> Tensor:
 
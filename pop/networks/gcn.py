@@ -14,8 +14,6 @@ from pop.networks.network_architecture_parsing import (
 from pop.networks.serializable_module import SerializableModule
 from pop.configs.network_architecture import NetworkArchitecture
 from dataclasses import asdict
-from sklearn.preprocessing import MinMaxScaler
-import numpy as np
 
 # ----------------------------------------------------------------#
 # This imports must be aliased this way for network instantiation
@@ -33,6 +31,50 @@ import dgl.nn.pytorch as dgl_nn
 # ----------------------------------------------------------------#
 
 
+class FeatureScaler(nn.Module):
+    """
+    Stacks the features of a graph and scales them as a MinMaxScaler fit on the feature ranges would.
+    Features are matched to ranges by position.
+    Scale and offset are non persistent buffers: they follow the module on any device
+    and are left out of the state dict, since they are rebuilt from the feature ranges.
+    """
+
+    def __init__(
+        self,
+        feature_ranges: Dict[str, Tuple[float, float]],
+        output_range: Tuple[float, float] = (0, 1),
+    ):
+        super(FeatureScaler, self).__init__()
+        # -> (features)
+        data_min = th.tensor(
+            [f_min for (f_min, _) in feature_ranges.values()], dtype=th.float64
+        )
+        data_range = (
+            th.tensor(
+                [f_max for (_, f_max) in feature_ranges.values()], dtype=th.float64
+            )
+            - data_min
+        )
+        # Constant features are only shifted, as in MinMaxScaler
+        data_range[data_range < 10 * th.finfo(th.float64).eps] = 1
+        scale = (output_range[1] - output_range[0]) / data_range
+        self.register_buffer("scale", scale.float(), persistent=False)
+        self.register_buffer(
+            "offset", (output_range[0] - data_min * scale).float(), persistent=False
+        )
+
+    def forward(self, features: Dict[str, Tensor]) -> Tensor:
+        feature_values: List[Tensor] = list(features.values())
+        if len(feature_values) == 1:
+            # A single feature may hold a vector per node
+            # -> (nodes, feature_size)
+            stacked_features = feature_values[0].reshape(len(feature_values[0]), -1)
+        else:
+            # -> (nodes, features)
+            stacked_features = th.stack(feature_values, dim=1)
+        return th.addcmul(self.offset, stacked_features.float(), self.scale)
+
+
 class GCN(nn.Module, SerializableModule):
     def __init__(
         self,
@@ -56,26 +98,14 @@ class GCN(nn.Module, SerializableModule):
         self.model: nn.Sequential = get_network(
             self, architecture, is_graph_network=True
         )
-        self.node_scaler: MinMaxScaler = MinMaxScaler(feature_range=(-1, 1))
         self.feature_ranges = feature_ranges
-
-        node_feature_ranges_array = np.array(
-            [
-                [f_min for (f_min, _) in feature_ranges["node_features"].values()],
-                [f_max for (_, f_max) in feature_ranges["node_features"].values()],
-            ]
+        self.node_scaler: FeatureScaler = FeatureScaler(
+            feature_ranges["node_features"], output_range=(-1, 1)
         )
-        self.node_scaler.fit(node_feature_ranges_array)
-
         if feature_ranges.get("edge_features"):
-            self.edge_scaler: MinMaxScaler = MinMaxScaler()
-            edge_feature_ranges_array = np.array(
-                [
-                    [f_min for (f_min, _) in feature_ranges["edge_features"].values()],
-                    [f_max for (_, f_max) in feature_ranges["edge_features"].values()],
-                ]
+            self.edge_scaler: FeatureScaler = FeatureScaler(
+                feature_ranges["edge_features"]
             )
-            self.edge_scaler.fit(edge_feature_ranges_array)
         self.architecture: NetworkArchitecture = architecture
 
     def forward(self, g: DGLHeteroGraph) -> Tensor:
@@ -92,15 +122,15 @@ class GCN(nn.Module, SerializableModule):
             # -> (nodes*batch_size, heads, out_node_features)
             node_embeddings = self.model(
                 g,
-                self._to_tensor(dict(g.ndata), self.node_scaler),
-                self._to_tensor(dict(g.edata), self.edge_scaler),
+                self.node_scaler(dict(g.ndata)),
+                self.edge_scaler(dict(g.edata)),
             )
 
         else:
             # -> (nodes*batch_size, heads, out_node_features)
             node_embeddings = self.model(
                 g,
-                self._to_tensor(dict(g.ndata), self.node_scaler),
+                self.node_scaler(dict(g.ndata)),
             )
 
         if len(node_embeddings.shape) == 3:
@@ -146,16 +176,6 @@ class GCN(nn.Module, SerializableModule):
         gcn.load_state_dict(checkpoint["network_state"])
         return gcn
 
-    @staticmethod
-    def _to_tensor(d: Dict[str, Tensor], scaler: MinMaxScaler) -> Tensor:
-        features: List[Tensor] = list(d.values())
-        stacked_features = th.stack(features).transpose(0, 1)
-        if len(features) == 1:
-            # this check handles correctly the 1 feature case
-            # together with the 1 node case that in general must not be squeezed
-            stacked_features.squeeze_()
-        return th.tensor(scaler.transform(stacked_features)).float()
-
     @staticmethod
     def _add_self_loop_to_batched_graph(g: DGLHeteroGraph) -> DGLHeteroGraph:
         num_nodes = g.batch_num_nodes()
@@ -4,6 +4,8 @@ from typing import Optional, Any, Dict, TypeVar
 import torch as th
 from pathlib import Path
 
+from pop.networks.checkpoint_shards import resolve_shards
+
 T = TypeVar("T")
 
 
@@ -49,23 +51,24 @@ class SerializableModule(ABC):
                 int(dir_object.stem.split("_")[-1])
                 for dir_object in Path(log_file).parents[0].iterdir()
                 if dir_object.is_file()
-            ]
+            ],
+            default=-1,
         )
 
     def save(self: T) -> None:
+        checkpoint = self.get_state()
+        th.save(checkpoint, self._next_checkpoint_file())
+
+    def _next_checkpoint_file(self: T) -> str:
         if self.log_file is None:
             raise Exception("Called save() in " + self.name + " with None log_dir")
 
-        checkpoint = self.get_state()
         if self.number_of_saves == 0 and list(Path(self.log_file).parents[0].iterdir()):
             self.number_of_saves = self._get_last_saved_checkpoint(self.log_file) + 2
         else:
             self.number_of_saves += 1
 
-        th.save(
-            checkpoint,
-            self._add_counter_to_file_path(self.log_file, self.number_of_saves - 1),
-        )
+        return self._add_counter_to_file_path(self.log_file, self.number_of_saves - 1)
 
     @classmethod
     def load(
@@ -102,7 +105,11 @@ class SerializableModule(ABC):
             print("Loaded Last Checkpoint: " + str(checkpoint_to_load))
             while last_saved_checkpoint >= 0:
                 try:
-                    return th.load(checkpoint_to_load)
+                    # Sharded checkpoints reference their shards relative to the manifest
+                    return resolve_shards(
+                        th.load(checkpoint_to_load),
+                        str(Path(checkpoint_to_load).parents[0]),
+                    )
                 except Exception as e:
                     print(
                         "Exception encountered when loading checkpoint "